@@ -3,6 +3,7 @@ from django.contrib.contenttypes import generic
 from django.contrib.comments.models import Comment
 
 from models import PostImage, Post, Series, Category
+from publishing import update_posts
 
 class PostImageInline(admin.StackedInline):
     """
@@ -33,11 +34,14 @@ class PostAdmin(admin.ModelAdmin):
     """
     prepopulated_fields = {'slug': ('title',)}
     list_display = ('title', 'post_categories_string', 'is_published',
-                    'publish_date', 'updated_on', 'tags', 'series',)
+                    'is_featured', 'publish_date', 'updated_on',
+                    'post_tags_string', 'series',)
     search_fields = ('title', )
-    list_filter = ('is_published', 'series', 'categories')
-    list_editable=('is_published',)
+    list_filter = ('is_published', 'is_featured', 'series', 'categories')
     date_hierarchy = 'publish_date'
+    raw_id_fields = ('author', 'categories',)
+    actions = ['publish_posts', 'unpublish_posts', 'feature_posts',
+        'unfeature_posts',]
     fieldsets = (
         (None, { 'fields': ('title', 'slug',)}),
         ('Publishing', {'fields': ('publish_date', 'last_modified',
@@ -49,6 +53,39 @@ class PostAdmin(admin.ModelAdmin):
     )
     
     inlines = [PostImageInline,CommentInline,]
+
+    def queryset(self, request):
+        # the changelist shows the series, categories and tags of each post
+        return super(PostAdmin, self).queryset(request).select_related(
+            'series').with_categories().with_tags()
+
+    def post_tags_string(self, post):
+        return ', '.join([tag.name for tag in post.tag_list])
+    post_tags_string.short_description = 'tags'
+
+    def _update_posts(self, request, queryset, message, **values):
+        count = update_posts(queryset, **values)
+        self.message_user(request, '%d post%s %s.' % (count,
+            count != 1 and 's' or '', message))
+
+    def publish_posts(self, request, queryset):
+        self._update_posts(request, queryset, 'published',
+            is_published=True)
+    publish_posts.short_description = 'Publish the selected posts'
+
+    def unpublish_posts(self, request, queryset):
+        self._update_posts(request, queryset, 'unpublished',
+            is_published=False)
+    unpublish_posts.short_description = 'Unpublish the selected posts'
+
+    def feature_posts(self, request, queryset):
+        self._update_posts(request, queryset, 'featured', is_featured=True)
+    feature_posts.short_description = 'Feature the selected posts'
+
+    def unfeature_posts(self, request, queryset):
+        self._update_posts(request, queryset, 'unfeatured',
+            is_featured=False)
+    unfeature_posts.short_description = 'Unfeature the selected posts'
     
 class CategoryAdmin(admin.ModelAdmin):
     """
@@ -0,0 +1,398 @@
+"""
+Read-only JSON API
+
+JSON views of the posts, a post, the categories, series and tags, and the
+post archive, following the published post rules of the html views (staff
+see drafts).  Posts are filtered with the same query string parameters the
+html urls take as arguments: year, month, category, series, tag and
+featured.
+
+Listings are streamed: rows are read with iterator() and serialized one at a
+time, so a page is never held in memory.  Pages are sought on
+(publish_date, id) with the cursor in the "next" member of the previous
+page, passed back in the "cursor" query string parameter, and hold "limit"
+results.  "fields" (a comma separated list) selects the members of each
+result, and only the columns they need are read.  Responses carry the same
+ETag and Last-Modified validators as the html views.
+
+A listing's main query runs in the view; the queries made while it's
+streamed use a connection that's closed when the stream ends, and an error
+while streaming ends the listing with an "error" member.  Middleware that
+reads the whole response (GZipMiddleware, or CommonMiddleware with
+USE_ETAGS) buffers the streamed listings.
+"""
+import logging
+from itertools import chain, islice
+from operator import attrgetter, itemgetter
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import HttpResponse, Http404
+from django.utils import simplejson
+
+from tagging.models import TaggedItem
+
+from models import Post, Category, Series, PostArchiveEntry, TagUsage
+from managers import get_date_range
+from pagination import seek, encode_key
+from conditional import blog_condition, get_post_stamps
+from instrumentation import instrumented
+from settings import BLOG_API_PAGE_SIZE, BLOG_API_MAX_PAGE_SIZE
+
+# rows whose categories and tags are read per query
+BATCH_SIZE = 100
+
+logger = logging.getLogger('blog.api')
+
+def dumps(value):
+    return simplejson.dumps(value, cls=DjangoJSONEncoder)
+
+def get_post_url(row):
+    publish_date = row['publish_date']
+    return reverse('blog.views.post_detail', args=[
+        '%04d' % publish_date.year, '%02d' % publish_date.month,
+        '%02d' % publish_date.day, row['slug'],])
+
+def column(name):
+    # a field read from a column of the same name
+    return ((name,), itemgetter(name))
+
+# field: (columns read, getter of the field from a row)
+POST_FIELDS = {
+    'id': column('id'),
+    'title': column('title'),
+    'slug': column('slug'),
+    'url': (('slug', 'publish_date'), get_post_url),
+    'author': column('author__username'),
+    'publish_date': column('publish_date'),
+    'last_modified': column('last_modified'),
+    'is_published': column('is_published'),
+    'is_featured': column('is_featured'),
+    'allow_comments': column('allow_comments'),
+    'series': column('series__slug'),
+    'categories': (('id',), itemgetter('categories')),
+    'tags': (('id',), itemgetter('tags')),
+    'meta_keywords': column('meta_keywords'),
+    'summary': column('summary'),
+    'content': column('content'),
+}
+POST_LIST_FIELDS = ('id', 'title', 'slug', 'url', 'author', 'publish_date',
+    'is_featured', 'series', 'categories', 'tags', 'summary')
+
+ARCHIVE_FIELDS = {
+    'id': (('post',), itemgetter('post')),
+    'title': column('title'),
+    'slug': column('slug'),
+    'url': (('slug', 'publish_date'), get_post_url),
+    'publish_date': column('publish_date'),
+    'is_published': column('is_published'),
+    'is_featured': column('is_featured'),
+}
+ARCHIVE_LIST_FIELDS = ('id', 'title', 'slug', 'url', 'publish_date',
+    'is_featured')
+
+TAXONOMY_FIELDS = {
+    'slug': attrgetter('slug'),
+    'title': attrgetter('title'),
+    'summary': attrgetter('summary'),
+    'url': lambda taxonomy: taxonomy.get_absolute_url(),
+    'post_count': attrgetter('post_count'),
+    'latest_publish_date': attrgetter('latest_publish_date'),
+    'latest_post_title': attrgetter('latest_post_title'),
+    'latest_post_url': attrgetter('latest_post_url'),
+}
+TAXONOMY_LIST_FIELDS = ('slug', 'title', 'url', 'post_count',
+    'latest_publish_date')
+SERIES_FIELDS = dict(TAXONOMY_FIELDS, preface=attrgetter('preface'),
+    created_on=attrgetter('created_on'))
+
+TAG_FIELDS = {
+    'name': attrgetter('tag'),
+    'url': lambda usage: reverse('blog.views.tag_detail',
+        kwargs={'tag': usage.tag}),
+    'post_count': attrgetter('count'),
+}
+
+class BadRequest(ValueError):
+    pass
+
+def json_response(content, status=200):
+    """
+    Return a JSON response of a string, or an iterator of strings, of JSON
+    """
+    return HttpResponse(content, status=status,
+        mimetype='application/json; charset=utf-8')
+
+def stream(content):
+    """
+    Iterate over the strings of a streamed response, closing the database
+    connection once they've been read
+
+    The handler closes the connection (request_finished) before the
+    response is read, so queries made while streaming open a connection
+    that nothing else would close.  An error while streaming ends the
+    results with an "error" member, since the status has been sent.
+    """
+    try:
+        try:
+            for chunk in content:
+                yield chunk
+        except Exception:
+            logger.exception('Error streaming a JSON API response')
+            yield '], "next": null, "error": "The results were cut short."}'
+    finally:
+        connection.close()
+
+def bad_request(e):
+    return json_response(dumps({'error': unicode(e)}), status=400)
+
+def get_fields(request, available, default):
+    """
+    Return the fields named by the "fields" query string parameter, or the
+    default fields
+    """
+    names = request.GET.get('fields')
+    if not names:
+        return list(default)
+    fields = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise BadRequest('Unknown fields: %s' % ', '.join(unknown))
+    return fields
+
+def get_page_size(request):
+    """
+    Return the number of results per page asked for by the "limit" query
+    string parameter
+    """
+    try:
+        page_size = int(request.GET.get('limit', BLOG_API_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('limit must be a number')
+    return min(max(page_size, 1), BLOG_API_MAX_PAGE_SIZE)
+
+def check_date(request):
+    """
+    Raise BadRequest unless the year and month query string parameters are
+    a valid year or month
+    """
+    year = request.GET.get('year')
+    if year:
+        try:
+            get_date_range(year, request.GET.get('month') or None)
+        except ValueError:
+            raise BadRequest('Invalid year or month')
+
+def get_rows(queryset, field_columns, fields, limit, key=('id',)):
+    """
+    Iterate over up to limit rows of a queryset, reading only the columns
+    of the fields (and the key columns)
+
+    The query is run before returning, so that it runs in the view rather
+    than while the response is streamed.
+    """
+    columns = set(key)
+    for name in fields:
+        columns.update(field_columns[name][0])
+    rows = queryset.values(*columns)[:limit]
+    # an empty queryset slices to a list
+    if isinstance(rows, list):
+        return iter(rows)
+    rows = rows.iterator()
+    return chain(list(islice(rows, 1)), rows)
+
+def _attach_taxonomies(rows, fields):
+    ids = [row['id'] for row in rows]
+    if 'categories' in fields:
+        categories = {}
+        for post_id, slug in Post.categories.through.objects.filter(
+            post__in=ids).values_list('post', 'category__slug').order_by(
+            'category__title'):
+            categories.setdefault(post_id, []).append(slug)
+        for row in rows:
+            row['categories'] = categories.get(row['id'], [])
+    if 'tags' in fields:
+        tags = {}
+        for post_id, name in TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Post),
+            object_id__in=ids).values_list('object_id', 'tag__name').order_by(
+            'tag__name'):
+            tags.setdefault(post_id, []).append(name)
+        for row in rows:
+            row['tags'] = tags.get(row['id'], [])
+    return rows
+
+def attach_taxonomies(rows, fields, batch_size=BATCH_SIZE):
+    """
+    Iterate over post rows, reading the category slugs and tag names of a
+    batch of rows at a time if the fields include them
+    """
+    if not ('categories' in fields or 'tags' in fields):
+        for row in rows:
+            yield row
+        return
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            for attached_row in _attach_taxonomies(batch, fields):
+                yield attached_row
+            batch = []
+    for attached_row in _attach_taxonomies(batch, fields):
+        yield attached_row
+
+def serialize(item, field_getters, fields):
+    return dict([(name, field_getters[name](item)) for name in fields])
+
+def stream_page(rows, field_getters, fields, page_size):
+    """
+    Stream a page of rows as JSON
+
+    rows holds up to page_size + 1 rows, the last telling that there's a
+    next page.
+    """
+    yield '{"results": ['
+    next_cursor = None
+    last_row = None
+    for count, row in enumerate(rows):
+        if count == page_size:
+            next_cursor = encode_key(last_row['publish_date'],
+                last_row['id'], 'n')
+            break
+        yield (count and ', ' or '') + dumps(serialize(row, field_getters,
+            fields))
+        last_row = row
+    yield '], "next": %s}' % dumps(next_cursor)
+
+def stream_list(items, field_getters, fields):
+    """
+    Stream a list of items as JSON
+    """
+    yield '{"results": ['
+    for count, item in enumerate(items):
+        yield (count and ', ' or '') + dumps(serialize(item, field_getters,
+            fields))
+    yield '], "next": null}'
+
+def _get_getters(field_columns):
+    return dict([(name, getter)
+        for name, (columns, getter) in field_columns.items()])
+
+POST_GETTERS = _get_getters(POST_FIELDS)
+ARCHIVE_GETTERS = _get_getters(ARCHIVE_FIELDS)
+
+@instrumented('view.api.post_list')
+@blog_condition('posts', 'categories', 'series')
+def post_list(request):
+    """
+    Post List
+    """
+    try:
+        fields = get_fields(request, POST_FIELDS, POST_LIST_FIELDS)
+        page_size = get_page_size(request)
+        check_date(request)
+        posts = seek(Post.objects.build_query(
+            require_published=not request.user.is_staff,
+            year=request.GET.get('year'), month=request.GET.get('month'),
+            category_slug=request.GET.get('category'),
+            series_slug=request.GET.get('series'),
+            tag=request.GET.get('tag'),
+            require_featured=request.GET.get('featured') == '1'),
+            request.GET.get('cursor'))
+    except ValueError as e:
+        return bad_request(e)
+    rows = get_rows(posts, POST_FIELDS, fields, page_size + 1,
+        key=('id', 'publish_date'))
+    return json_response(stream(stream_page(attach_taxonomies(rows, fields),
+        POST_GETTERS, fields, page_size)))
+
+@instrumented('view.api.post_detail')
+@blog_condition('posts', 'categories', 'series',
+    object_stamps=get_post_stamps)
+def post_detail(request, year, month, day, slug):
+    """
+    Post Detail
+    """
+    try:
+        fields = get_fields(request, POST_FIELDS, sorted(POST_FIELDS.keys()))
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        start, end = get_date_range(year, month, day)
+    except ValueError:
+        raise Http404
+    posts = Post.objects.filter(slug=slug, publish_date__gte=start,
+        publish_date__lt=end)
+    if not request.user.is_staff:
+        posts = posts.filter(is_published=True)
+    rows = list(attach_taxonomies(get_rows(posts, POST_FIELDS, fields, 1),
+        fields))
+    if not rows:
+        raise Http404
+    return json_response(dumps(serialize(rows[0], POST_GETTERS, fields)))
+
+@instrumented('view.api.post_archive')
+@blog_condition('posts', 'categories')
+def post_archive(request):
+    """
+    Post Archive
+    """
+    try:
+        fields = get_fields(request, ARCHIVE_FIELDS, ARCHIVE_LIST_FIELDS)
+        page_size = get_page_size(request)
+        check_date(request)
+        entries = seek(PostArchiveEntry.objects.build_query(
+            require_published=not request.user.is_staff,
+            year=request.GET.get('year'), month=request.GET.get('month'),
+            category_slug=request.GET.get('category'),
+            tag=request.GET.get('tag'),
+            require_featured=request.GET.get('featured') == '1'),
+            request.GET.get('cursor'))
+    except ValueError as e:
+        return bad_request(e)
+    rows = get_rows(entries, ARCHIVE_FIELDS, fields, page_size + 1,
+        key=('id', 'publish_date'))
+    return json_response(stream(stream_page(rows, ARCHIVE_GETTERS, fields,
+        page_size)))
+
+@instrumented('view.api.category_list')
+@blog_condition('posts', 'categories')
+def category_list(request):
+    """
+    Category List
+    """
+    try:
+        fields = get_fields(request, TAXONOMY_FIELDS, TAXONOMY_LIST_FIELDS)
+    except ValueError as e:
+        return bad_request(e)
+    return json_response(stream(stream_list(Category.objects.get_annotated(),
+        TAXONOMY_FIELDS, fields)))
+
+@instrumented('view.api.series_list')
+@blog_condition('posts', 'series')
+def series_list(request):
+    """
+    Series List
+    """
+    try:
+        fields = get_fields(request, SERIES_FIELDS, TAXONOMY_LIST_FIELDS)
+    except ValueError as e:
+        return bad_request(e)
+    return json_response(stream(stream_list(Series.objects.get_annotated(),
+        SERIES_FIELDS, fields)))
+
+@instrumented('view.api.tag_list')
+@blog_condition('posts')
+def tag_list(request):
+    """
+    Tag List
+    """
+    try:
+        fields = get_fields(request, TAG_FIELDS, ('name', 'url',
+            'post_count'))
+    except ValueError as e:
+        return bad_request(e)
+    return json_response(stream(stream_list(TagUsage.objects.get_usage(),
+        TAG_FIELDS, fields)))
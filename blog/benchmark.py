@@ -0,0 +1,243 @@
+"""
+Benchmarks
+
+Times every url in blog.urls (including the RSS feed and the JSON API), the
+PostManager archive and query methods, and the sitemaps against the current
+database, typically a corpus made by blog_generate_corpus.  The views are
+called through the url resolver with RequestFactory requests from an
+anonymous user, so no middleware runs.  Each benchmark reports its latency
+percentiles and query count, the run reports the process' peak memory, and
+results can be compared against a stored baseline.
+"""
+from time import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.urlresolvers import resolve
+from django.db import connection
+from django.test.client import RequestFactory
+
+from models import Post, TagPosting
+from sitemaps import sitemaps
+from cache import fragment_cache, taxonomy_cache
+from instrumentation import get_percentile
+
+PERCENTILES = (50, 90, 99)
+
+class BenchmarkError(Exception):
+    pass
+
+class Benchmark(object):
+    """
+    A named callable to time
+    """
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+def get_peak_memory():
+    """
+    Return the peak resident memory of the process (kilobytes on Linux), or
+    None where it's unknown
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def clear_caches():
+    """
+    Empty the blog's caches
+
+    The fragment and feed keys are hashed, so the blog's keys can't be told
+    apart from the rest of a cache backend's: the backends are cleared
+    whole, which is only done if they're local to this process.  Raises
+    BenchmarkError if the blog uses a shared backend, like memcached.
+    """
+    backends = [cache, fragment_cache.cache, taxonomy_cache.cache]
+    for backend in backends:
+        if not isinstance(backend, (LocMemCache, DummyCache)):
+            raise BenchmarkError('--cold would clear the shared %s cache ' \
+                'backend; benchmark with a locmem cache instead.' % (
+                backend.__class__.__name__,))
+    for backend in backends:
+        backend.clear()
+    fragment_cache.local.clear()
+    taxonomy_cache.local.clear()
+
+def get_view(path, data=None):
+    """
+    Return a callable that requests a path of blog.urls
+    """
+    factory = RequestFactory()
+    def view():
+        request = factory.get(path, data or {})
+        request.user = AnonymousUser()
+        func, args, kwargs = resolve(path, urlconf='blog.urls')
+        response = func(request, *args, **kwargs)
+        if response.status_code != 200:
+            raise BenchmarkError('%s returned %d' % (path,
+                response.status_code))
+        # streamed responses run their queries as they're read
+        response.content
+        return response
+    return view
+
+def get_benchmarks():
+    """
+    Return the benchmarks of the current database
+
+    The urls are filled in with the latest published post, and categories,
+    series and tags that have published posts.
+    """
+    published = Post.objects.get_published_posts().order_by('-publish_date')
+    try:
+        post = published[0]
+    except IndexError:
+        raise BenchmarkError('There are no published posts to benchmark; ' \
+            'generate a corpus with blog_generate_corpus.')
+    year, month = '%04d' % post.publish_date.year, \
+        '%02d' % post.publish_date.month
+    benchmarks = []
+    def add_view(name, path, data=None):
+        benchmarks.append(Benchmark('url.%s' % name, get_view(path, data)))
+
+    add_view('post_index', '/')
+    add_view('rss', '/rss/')
+    add_view('archive', '/archive/')
+    add_view('archive.year', '/%s/' % year)
+    add_view('archive.month', '/%s/%s/' % (year, month))
+    add_view('latest', '/latest/')
+    add_view('post_detail', '/%s/%s/%02d/%s/' % (year, month,
+        post.publish_date.day, post.slug))
+    add_view('category_index', '/categories/')
+    add_view('series_index', '/series/')
+    add_view('tag_index', '/tags/')
+    add_view('search', '/search/', {'q': post.title.split()[0]})
+    add_view('api.posts', '/api/posts/')
+    add_view('api.posts.fields', '/api/posts/', {'fields': 'title,url'})
+    add_view('api.post_detail', '/api/posts/%s/%s/%02d/%s/' % (year, month,
+        post.publish_date.day, post.slug))
+    add_view('api.archive', '/api/archive/')
+    add_view('api.categories', '/api/categories/')
+    add_view('api.series', '/api/series/')
+    add_view('api.tags', '/api/tags/')
+
+    category_post = published.filter(categories__isnull=False)[:1]
+    if category_post:
+        category = category_post[0].categories.all()[0]
+        date = category_post[0].publish_date
+        add_view('category_detail', '/categories/%s/' % category.slug)
+        add_view('category.year', '/categories/%s/%04d/' % (category.slug,
+            date.year))
+        add_view('category.month', '/categories/%s/%04d/%02d/' % (
+            category.slug, date.year, date.month))
+    series_post = published.filter(series__isnull=False)[:1]
+    if series_post:
+        series = series_post[0].series
+        date = series_post[0].publish_date
+        add_view('series_detail', '/series/%s/' % series.slug)
+        add_view('series.year', '/series/%s/%04d/' % (series.slug,
+            date.year))
+        add_view('series.month', '/series/%s/%04d/%02d/' % (series.slug,
+            date.year, date.month))
+    postings = TagPosting.objects.filter(is_published=True,
+        publish_date__lt=Post.objects.get_visible_as_of()).order_by(
+        '-publish_date')[:1]
+    if postings:
+        tag, date = postings[0].tag, postings[0].publish_date
+        add_view('tag_detail', '/tags/%s/' % tag)
+        add_view('tag.year', '/tags/%s/%04d/' % (tag, date.year))
+        add_view('tag.month', '/tags/%s/%04d/%02d/' % (tag, date.year,
+            date.month))
+
+    def add(name, function, *args, **kwargs):
+        benchmarks.append(Benchmark(name,
+            lambda: function(*args, **kwargs)))
+    def evaluate(*args, **kwargs):
+        return list(Post.objects.build_query(*args, **kwargs)[:20])
+    add('manager.get_post_archive', Post.objects.get_post_archive)
+    add('manager.get_post_archive.year', Post.objects.get_post_archive,
+        year=year)
+    add('manager.get_post_archive_counts',
+        Post.objects.get_post_archive_counts)
+    add('manager.build_query', evaluate)
+    add('manager.build_query.with_tags', evaluate, with_tags=True)
+    add('manager.build_query.featured', evaluate, require_featured=True)
+    add('manager.build_query.month', evaluate, year=year, month=month)
+    if category_post:
+        add('manager.build_query.category', evaluate,
+            category_slug=category.slug)
+    if series_post:
+        add('manager.build_query.series', evaluate, series_slug=series.slug)
+    if postings:
+        add('manager.build_query.tag', evaluate, tag=tag)
+
+    site = Site(domain='example.com', name='example.com')
+    for name, sitemap_class in sorted(sitemaps.items()):
+        add('sitemap.%s' % name, lambda sitemap_class=sitemap_class:
+            sitemap_class().get_urls(page=1, site=site))
+    return benchmarks
+
+def run_benchmark(benchmark, iterations=20, warmup=2, cold=False):
+    """
+    Run a benchmark
+
+    Returns a dictionary of the latency percentiles (p50, p90 and p99, in
+    seconds) and the most queries of an iteration.
+    """
+    for i in range(warmup):
+        benchmark.function()
+    times = []
+    queries = []
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        for i in range(iterations):
+            if cold:
+                clear_caches()
+            first_query = len(connection.queries)
+            started_on = time()
+            benchmark.function()
+            times.append(time() - started_on)
+            queries.append(len(connection.queries) - first_query)
+            del connection.queries[first_query:]
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+    times.sort()
+    result = dict([('p%d' % percentile, get_percentile(times, percentile))
+        for percentile in PERCENTILES])
+    result['queries'] = max(queries or [0])
+    return result
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compare benchmark results with a baseline
+
+    Returns a list of regressions: benchmarks whose median latency grew by
+    more than threshold (a fraction), whose query count grew at all, and a
+    peak memory that grew by more than threshold.
+    """
+    regressions = []
+    for name, result in sorted(results['benchmarks'].items()):
+        base = baseline.get('benchmarks', {}).get(name)
+        if base is None:
+            continue
+        if result['p50'] > base['p50'] * (1 + threshold):
+            regressions.append('%s: median %.2fms, baseline %.2fms' % (name,
+                result['p50'] * 1000, base['p50'] * 1000))
+        if result['queries'] > base['queries']:
+            regressions.append('%s: %d queries, baseline %d' % (name,
+                result['queries'], base['queries']))
+    if results.get('peak_memory') and baseline.get('peak_memory') and \
+        results['peak_memory'] > baseline['peak_memory'] * (1 + threshold):
+        regressions.append('peak memory: %d, baseline %d' % (
+            results['peak_memory'], baseline['peak_memory']))
+    return regressions
@@ -0,0 +1,215 @@
+"""
+Blog caches
+
+A process-local LRU cache, a fragment cache that puts the LRU in front of
+a (pluggable) Django cache backend, and a taxonomy cache of categories, series
+and tags by slug or name.
+"""
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from django.core.cache import cache, get_cache
+from django.utils.hashcompat import md5_constructor
+
+from settings import BLOG_FRAGMENT_CACHE_BACKEND, \
+    BLOG_FRAGMENT_CACHE_TIMEOUT, BLOG_FRAGMENT_CACHE_LOCAL_SIZE, \
+    BLOG_TAXONOMY_CACHE_BACKEND, BLOG_TAXONOMY_CACHE_TIMEOUT, \
+    BLOG_TAXONOMY_CACHE_SHARED, BLOG_TAXONOMY_CACHE_LOCAL_SIZE, \
+    BLOG_TAXONOMY_CACHE_CHECK_INTERVAL
+
+class LRUCache(object):
+    """
+    Bounded, thread-safe, least recently used cache
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            # re-insert the item as the most recently used
+            self._items[key] = value
+            return value
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._lock.acquire()
+        try:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                # evict the least recently used item
+                del self._items[next(iter(self._items))]
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            self._items.pop(key, None)
+        finally:
+            self._lock.release()
+
+    def delete_prefix(self, prefix):
+        """
+        Delete the items whose keys start with a prefix
+        """
+        self._lock.acquire()
+        try:
+            for key in [key for key in self._items if key.startswith(prefix)]:
+                del self._items[key]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._items.clear()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._items)
+
+class FragmentCache(object):
+    """
+    Rendered fragment cache
+
+    Fragments are looked up in a process-local LRU cache first and then in
+    the Django cache backend.  Keys are expected to carry the version of
+    whatever was rendered, so entries never need to be purged.
+    """
+    def __init__(self, backend=None, timeout=None, local_size=1000):
+        if backend:
+            self.cache = get_cache(backend)
+        else:
+            self.cache = cache
+        self.timeout = timeout
+        self.local = LRUCache(local_size)
+
+    def make_key(self, *parts):
+        """
+        Return a cache key made of the parts
+        """
+        return 'blog.fragment.%s' % (md5_constructor(
+            '|'.join([unicode(part) for part in parts]).encode('utf-8')
+        ).hexdigest(),)
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = self.cache.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        self.cache.set(key, value, self.timeout)
+
+fragment_cache = FragmentCache(backend=BLOG_FRAGMENT_CACHE_BACKEND,
+    timeout=BLOG_FRAGMENT_CACHE_TIMEOUT,
+    local_size=BLOG_FRAGMENT_CACHE_LOCAL_SIZE)
+
+class TaxonomyCache(object):
+    """
+    Taxonomy object cache
+
+    Maps a single field lookup of a model (a category or series slug, a tag
+    name) to the object.  Objects are kept in a process-local LRU cache and,
+    if shared, in the Django cache backend.  Keys carry the model's version
+    stamp, which is kept in the Django cache backend and replaced whenever
+    an object of the model changes; each process rereads the stamps at most
+    every check_interval seconds.  The cached objects are shared, so treat
+    them as read-only.
+    """
+    def __init__(self, backend=None, timeout=None, local_size=1000,
+        shared=False, check_interval=5):
+        if backend:
+            self.cache = get_cache(backend)
+        else:
+            self.cache = cache
+        self.timeout = timeout
+        self.shared = shared
+        self.check_interval = check_interval
+        self.local = LRUCache(local_size)
+        self._versions = {}
+
+    def _get_label(self, model):
+        return '%s.%s' % (model._meta.app_label, model._meta.object_name)
+
+    def get_version(self, model):
+        """
+        Return the version stamp of a model
+        """
+        label = self._get_label(model)
+        version, checked_on = self._versions.get(label, (None, 0))
+        now = time()
+        if version is None or now - checked_on >= self.check_interval:
+            key = 'blog.taxonomy.version.%s' % label
+            version = self.cache.get(key)
+            if version is None:
+                # another process may be adding the stamp too
+                self.cache.add(key, uuid4().hex, self.timeout)
+                version = self.cache.get(key) or uuid4().hex
+            self._versions[label] = (version, now)
+        return version
+
+    def _get_prefix(self, model):
+        return 'blog.taxonomy.%s.' % self._get_label(model)
+
+    def get(self, model, **lookup):
+        """
+        Return the object of a model matching a single field lookup
+
+        Raises the model's DoesNotExist if there's no such object (which
+        isn't cached).
+        """
+        (field, value), = lookup.items()
+        key = '%s%s.%s.%s' % (self._get_prefix(model),
+            self.get_version(model), field, md5_constructor(
+            unicode(value).encode('utf-8')).hexdigest())
+        obj = self.local.get(key)
+        if obj is None and self.shared:
+            obj = self.cache.get(key)
+            if obj is not None:
+                self.local.set(key, obj)
+        if obj is None:
+            obj = model._default_manager.get(**lookup)
+            self.local.set(key, obj)
+            if self.shared:
+                self.cache.set(key, obj, self.timeout)
+        return obj
+
+    def invalidate(self, model):
+        """
+        Replace the version stamp of a model, which invalidates its cached
+        objects in every process sharing the cache backend, and drop the
+        model's objects from this process' LRU cache
+        """
+        label = self._get_label(model)
+        self.cache.set('blog.taxonomy.version.%s' % label, uuid4().hex,
+            self.timeout)
+        self._versions.pop(label, None)
+        self.local.delete_prefix(self._get_prefix(model))
+
+taxonomy_cache = TaxonomyCache(backend=BLOG_TAXONOMY_CACHE_BACKEND,
+    timeout=BLOG_TAXONOMY_CACHE_TIMEOUT,
+    local_size=BLOG_TAXONOMY_CACHE_LOCAL_SIZE,
+    shared=BLOG_TAXONOMY_CACHE_SHARED,
+    check_interval=BLOG_TAXONOMY_CACHE_CHECK_INTERVAL)
@@ -0,0 +1,75 @@
+"""
+Conditional GET support for the blog views
+
+Views answer If-None-Match and If-Modified-Since with 304 Not Modified,
+before any template rendering, using freshness stamps read from the small
+LastChange table instead of scanning the posts.
+"""
+from django.utils.hashcompat import md5_constructor
+from django.views.decorators.http import condition
+
+from models import Post, LastChange
+from managers import get_date_range
+
+def get_latest_publish_date():
+    """
+    Return the publish date of the latest published post
+
+    Scheduled posts change the blog when their publish date passes without
+    being saved, so it's part of every freshness stamp.  It's cached with
+    the visibility boundary, so it costs no query.
+    """
+    return Post.objects.get_latest_publish_date()
+
+def get_changed_on(*scopes):
+    """
+    Return when the scopes last changed, or when the latest published post
+    was published if that's later
+    """
+    stamps = [stamp for stamp in (LastChange.objects.get_changed_on(*scopes),
+        get_latest_publish_date()) if stamp is not None]
+    return stamps and max(stamps) or None
+
+def get_post_stamps(request, year, month, day, slug, **kwargs):
+    """
+    Return the freshness stamps of a post detail
+    """
+    try:
+        start, end = get_date_range(year, month, day)
+    except ValueError:
+        return ()
+    stamps = Post.objects.filter(slug=slug, publish_date__gte=start,
+        publish_date__lt=end).values_list('updated_on', 'last_modified',
+        'comments_updated_on')
+    return stamps and stamps[0] or ()
+
+def blog_condition(*scopes, **kwargs):
+    """
+    Return a view decorator that answers conditional GETs with the last
+    change of the scopes ('posts', 'categories', 'series', 'comments')
+
+    object_stamps is an optional function that is called with the view
+    arguments and returns the freshness stamps of the displayed object
+    """
+    object_stamps = kwargs.get('object_stamps')
+
+    def get_last_modified(request, *args, **kwargs):
+        if not hasattr(request, '_blog_last_modified'):
+            stamps = [get_changed_on(*scopes),]
+            if object_stamps:
+                stamps.extend(object_stamps(request, *args, **kwargs))
+            stamps = [stamp for stamp in stamps if stamp is not None]
+            request._blog_last_modified = stamps and max(stamps) or None
+        return request._blog_last_modified
+
+    def get_etag(request, *args, **kwargs):
+        last_modified = get_last_modified(request, *args, **kwargs)
+        if last_modified is None:
+            return None
+        # staff see drafts, so the representation depends on the user
+        return md5_constructor('%s|%s|%s' % (','.join(scopes),
+            last_modified.isoformat(),
+            request.user.is_authenticated() and request.user.pk or '',
+        )).hexdigest()
+
+    return condition(etag_func=get_etag, last_modified_func=get_last_modified)
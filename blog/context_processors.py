@@ -1,10 +1,15 @@
-from django.shortcuts import get_object_or_404
 from django.http import Http404
 import django.template.context
 
 from tagging.models import Tag, TaggedItem
 
-from models import Post, Series, Category
+from models import Post, Series, Category, TagUsage
+from managers import get_date_range
+from pagination import paginate_posts, InvalidCursor
+from search import search
+from memo import MEMO_CONTEXT_NAME, get_memo, memoize
+from cache import taxonomy_cache
+from instrumentation import instrumented
 
 def context_processor(target):
     """
@@ -25,22 +30,51 @@ def context_processor(target):
       )
       
     """
+    def process(request, *args, **kwargs):
+        c = target(request, *args, **kwargs)
+        # share the request's memo with the blog template tags
+        c.setdefault(MEMO_CONTEXT_NAME, get_memo(request))
+        return c
+    process = instrumented('context_processor.%s' % target.__name__)(process)
     def cp_wrapper(*args, **kwargs):
         if (
             len(args) == 1 and len(kwargs) == 0) \
             or (len(args) == 0 and len(kwargs) == 1 and 'request' in kwargs):
-            return target(*args, **kwargs)
+            return process(*args, **kwargs)
         else:
             def get_processor(request):
-                return target(request, *args, **kwargs)
+                return process(request, *args, **kwargs)
             return get_processor
     return cp_wrapper
+
+def get_cached_object_or_404(model, **lookup):
+    """
+    Get a category, series or tag from the taxonomy cache, or raise Http404
+    """
+    try:
+        return taxonomy_cache.get(model, **lookup)
+    except model.DoesNotExist:
+        raise Http404
+
+def get_category(request, slug):
+    """
+    Get a category by slug (or raise Http404), memoized for the request
+    """
+    return memoize(get_memo(request), ('category', slug),
+        get_cached_object_or_404, Category, slug=slug)
+
+def get_series(request, slug):
+    """
+    Get a series by slug (or raise Http404), memoized for the request
+    """
+    return memoize(get_memo(request), ('series', slug),
+        get_cached_object_or_404, Series, slug=slug)
             
 @context_processor
 def blog_posts_processor(request, year=None, month=None, category_slug=None,
     series_slug=None, tag=None, require_featured=False, start_post=1,
-    max_posts=None,
-    posts_context_name='posts',
+    max_posts=None, cursor=None, per_page=None,
+    posts_context_name='posts', page_context_name='page',
     year_context_name='year', month_context_name='month',
     category_context_name='category', series_context_name='series',
     tag_context_name='tag'):
@@ -48,6 +82,7 @@ def blog_posts_processor(request, year=None, month=None, category_slug=None,
     Return a dictionary containing:
     
     posts
+    page (if per_page was supplied)
     archive year (if supplied)
     archive month (if year and month supplied)
     category (if a slug was supplied)
@@ -59,9 +94,18 @@ def blog_posts_processor(request, year=None, month=None, category_slug=None,
     is_staff = request.user.is_staff
     posts = Post.objects.build_query(require_published = not is_staff,
         year=year, month=month, category_slug=category_slug,
-        series_slug=series_slug, tag=tag, require_featured=require_featured)
+        series_slug=series_slug, tag=tag, require_featured=require_featured,
+        with_tags=True)
     
-    if max_posts != None:
+    page = None
+    if per_page:
+        # cursor mode: seek on (publish_date, id) instead of slicing
+        try:
+            page = paginate_posts(posts, cursor=cursor, per_page=per_page)
+        except InvalidCursor:
+            raise Http404
+        posts = page.object_list
+    elif max_posts != None:
         posts = posts[start_post-1:max_posts]
     elif start_post != None:
         posts = posts[start_post-1:]
@@ -69,15 +113,16 @@ def blog_posts_processor(request, year=None, month=None, category_slug=None,
     c = {
         posts_context_name: posts,
     }
+    if page is not None:
+        c[page_context_name] = page
     if year:
         c[year_context_name] = year
         if month:
             c[month_context_name] = month
     if category_slug:
-        c[category_context_name] = get_object_or_404(
-            Category, slug=category_slug)
+        c[category_context_name] = get_category(request, category_slug)
     if series_slug:
-        c[series_context_name] = get_object_or_404(Series, slug=series_slug)
+        c[series_context_name] = get_series(request, series_slug)
     if tag:
         c[tag_context_name] = tag
     return c
@@ -90,13 +135,22 @@ def blog_post_processor(request, year, month, day, slug, context_name='post'):
     """
     # is this user staff?  Determines published post display
     is_staff = request.user.is_staff
+    # load the navigation pointers in the same query as the post
+    posts = Post.objects.select_related('series', 'previous_post',
+        'next_post', 'previous_in_series', 'next_in_series')
+    try:
+        start, end = get_date_range(year, month, day)
+    except ValueError:
+        raise Http404
+    # a date range, unlike publish_date__day, can use the
+    # (slug, publish_date) index
+    posts = posts.filter(slug=slug, publish_date__gte=start,
+        publish_date__lt=end)
     try:
         if is_staff:
-            post = Post.objects.get(publish_date__year=year,
-                publish_date__month=month, publish_date__day=day, slug=slug)
+            post = posts.get()
         else:
-            post = Post.objects.get(is_published=True, publish_date__year=year,
-                publish_date__month=month, publish_date__day=day, slug=slug)
+            post = posts.get(is_published=True)
             
         return {context_name: post}
     except Post.DoesNotExist:
@@ -106,53 +160,48 @@ def blog_post_processor(request, year, month, day, slug, context_name='post'):
 def blog_categories_processor(request, context_name='categories'):
     """
     Return a dictionary containing categories
+    
+    Each category has its number of published posts in post_count, and its
+    latest post's latest_publish_date, latest_post_title and latest_post_url
     """
-    return {context_name: Category.objects.all()}
+    return {context_name: memoize(get_memo(request), ('categories',),
+        Category.objects.get_annotated)}
 
 @context_processor
 def blog_category_processor(request, slug, context_name='category'):
     """
     Return a dictionary containing a category
     """
-    # is this user staff?  Determines published post display
-    is_staff = request.user.is_staff
-    posts = Post.objects.build_query(
-        require_published = not is_staff, category_slug=slug)
-    try:        
-        category = Category.objects.get(slug=slug)
-        return{context_name: category}
-    except Category.DoesNotExist:
-        raise Http404
+    return {context_name: get_category(request, slug)}
     
 @context_processor
 def blog_seriess_processor(request, context_name='seriess'):
     """
     Return a dictionary containing seriess
+    
+    Each series has its number of published posts in post_count, and its
+    latest post's latest_publish_date, latest_post_title and latest_post_url
     """
-    return {context_name: Series.objects.all()}
+    return {context_name: memoize(get_memo(request), ('seriess',),
+        Series.objects.get_annotated)}
 
 @context_processor
 def blog_series_processor(request, slug, context_name='series'):
     """
     Return a dictionary containing a series
     """
-    # is this user staff?  Determines published post display
-    is_staff = request.user.is_staff
-    posts = Post.objects.build_query(
-        require_published = not is_staff, series_slug=slug)
-    try:
-        series = Series.objects.get(slug=slug)
-        return {context_name: series}
-    except Series.DoesNotExist:
-        raise Http404
+    return {context_name: get_series(request, slug)}
 
 @context_processor
 def blog_tags_processor(request, context_name='tags'):
     """
-    Return a dictionary containing tags
+    Return a dictionary containing the tags with published posts
+    
+    Each tag has the number of its published posts in tag.count
     """
     return {
-        context_name: Tag.objects.usage_for_model(Post)
+        context_name: memoize(get_memo(request), ('tags',),
+            TagUsage.objects.get_usage)
     }
 
 @context_processor
@@ -161,5 +210,33 @@ def blog_tag_processor(request, tag, context_name='tag'):
     Return a dictionary containing a tag
     """
     return {
-        context_name: get_object_or_404(Tag, name=tag),
+        context_name: memoize(get_memo(request), ('tag', tag),
+            get_cached_object_or_404, Tag, name=tag),
         }
+
+@context_processor
+def blog_search_processor(request, query, page=1, per_page=20,
+    results_context_name='search_results', query_context_name='search_query',
+    count_context_name='search_count', page_context_name='search_page',
+    has_next_context_name='search_has_next'):
+    """
+    Return a dictionary containing:
+    
+    search results (each with a post, a score and an html snippet)
+    search query
+    number of matching posts
+    search results page number
+    whether there's a next page of search results
+    
+    """
+    # is this user staff?  Determines published post display
+    is_staff = request.user.is_staff
+    count, results = search(query, require_published = not is_staff,
+        offset=(page - 1) * per_page, limit=per_page)
+    return {
+        results_context_name: results,
+        query_context_name: query,
+        count_context_name: count,
+        page_context_name: page,
+        has_next_context_name: page * per_page < count,
+    }
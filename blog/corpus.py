@@ -0,0 +1,197 @@
+"""
+Synthetic corpus
+
+Generates a large, reproducible blog for benchmarking: posts spread over a
+span of days (with drafts, scheduled and featured posts), Zipf distributed
+tags, categories and series, comments and images.  The posts are inserted
+without running the blog's signal handlers, and their categories, comments
+and images in bulk, every 1000 posts.  The denormalized indexes, the image
+blob reference counts and the image renditions are rebuilt once at the
+end.
+"""
+from datetime import datetime, timedelta
+from random import Random
+from struct import pack
+from zlib import compress, crc32
+
+from django.contrib.auth.models import User
+from django.contrib.comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from models import Post, Category, Series, PostImage, ImageBlob, LastChange
+from managers import bulk_insert
+from renditions import get_image_storage
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam '
+    'quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo '
+    'consequat duis aute irure in reprehenderit voluptate velit esse cillum '
+    'fugiat nulla pariatur excepteur sint occaecat cupidatat non proident '
+    'sunt culpa qui officia deserunt mollit anim id est laborum python django '
+    'cache query index database template server request response latency '
+    'memory benchmark release deploy feature review').split()
+
+def make_png(width=1, height=1):
+    """
+    Return the bytes of a blank grey PNG image
+    """
+    def chunk(kind, data):
+        return pack('>I', len(data)) + kind + data + pack('>I',
+            crc32(kind + data) & 0xffffffff)
+    rows = b''.join([b'\x00' + b'\x80' * width for row in range(height)])
+    return b''.join([b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)),
+        chunk(b'IDAT', compress(rows)),
+        chunk(b'IEND', b'')])
+
+class CorpusGenerator(object):
+    """
+    Synthetic blog corpus generator
+
+    The same seed generates the same corpus.
+    """
+    def __init__(self, posts=1000, tags=200, categories=20, series=30,
+        comments=3, images=1, days=3650, seed=0, author='corpus',
+        stdout=None):
+        self.posts = posts
+        self.tags = tags
+        self.categories = categories
+        self.series = series
+        self.comments = comments
+        self.images = images
+        self.days = days
+        self.random = Random(seed)
+        self.author = author
+        self.stdout = stdout
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write('%s\n' % message)
+
+    def words(self, count):
+        return ' '.join([self.random.choice(WORDS) for i in range(count)])
+
+    def paragraphs(self, count):
+        return '\n\n'.join([
+            self.words(self.random.randint(40, 120)).capitalize() + '.'
+            for i in range(count)])
+
+    def zipf_choice(self, items, weights_total, weights):
+        # weights are 1 / rank, so a few items are much more common
+        target = self.random.random() * weights_total
+        for item, weight in zip(items, weights):
+            target -= weight
+            if target <= 0:
+                return item
+        return items[-1]
+
+    def flush(self, memberships, comments, images):
+        """
+        Insert the pending category memberships, comments and images in
+        bulk, which skips their signal handlers, and empty the lists
+        """
+        for model, objects in ((Post.categories.through, memberships),
+            (Comment, comments), (PostImage, images)):
+            bulk_insert(model, objects)
+            del objects[:]
+
+    def generate(self):
+        """
+        Generate the corpus
+        """
+        author, created = User.objects.get_or_create(username=self.author)
+        now = datetime.now().replace(microsecond=0)
+        start = now - timedelta(days=self.days)
+
+        categories = [Category.objects.create(
+            title='Category %d' % i, slug='corpus-category-%d' % i,
+            summary=self.words(20)) for i in range(self.categories)]
+        seriess = [Series.objects.create(
+            title='Series %d' % i, slug='corpus-series-%d' % i,
+            summary=self.words(20), preface=self.words(60),
+            created_on=start + timedelta(
+                days=self.random.random() * self.days))
+            for i in range(self.series)]
+        self.log('Created %d categories and %d series.' % (len(categories),
+            len(seriess)))
+
+        tag_names = ['corpus-tag-%d' % i for i in range(self.tags)]
+        tag_weights = [1.0 / (rank + 1) for rank in range(len(tag_names))]
+        tag_weights_total = sum(tag_weights)
+
+        image_name = None
+        if self.images:
+            image_name = get_image_storage().save(
+                'apps/blogyall/images/corpus/corpus.png',
+                ContentFile(make_png(64, 64)))
+        post_type = ContentType.objects.get_for_model(Post)
+        site = Site.objects.get_current()
+
+        memberships = []
+        comments = []
+        images = []
+        for i in range(self.posts):
+            publish_date = start + timedelta(
+                seconds=self.random.randint(0, self.days * 86400))
+            roll = self.random.random()
+            if roll < 0.02:
+                # scheduled
+                publish_date = now + timedelta(
+                    seconds=self.random.randint(60, 30 * 86400))
+            tags = set([self.zipf_choice(tag_names, tag_weights_total,
+                tag_weights) for n in range(self.random.randint(0, 6))])
+            post = Post(title=self.words(self.random.randint(3, 9)).title(),
+                slug='corpus-post-%d' % i, author=author,
+                publish_date=publish_date, last_modified=publish_date,
+                is_published=roll >= 0.05 or roll < 0.02,
+                is_featured=self.random.random() < 0.05,
+                allow_comments=True,
+                meta_keywords=', '.join(tags),
+                summary=self.words(self.random.randint(20, 50)),
+                content=self.paragraphs(self.random.randint(2, 8)))
+            if seriess and self.random.random() < 0.2:
+                post.series = self.random.choice(seriess)
+            post.tags = ' '.join(sorted(tags))
+            post_comments = [Comment(content_type=post_type, site=site,
+                user_name='reader%d' % self.random.randint(1, 500),
+                user_email='reader@example.com',
+                comment=self.words(self.random.randint(10, 60)),
+                submit_date=publish_date + timedelta(
+                    minutes=self.random.randint(1, 60 * 24 * 30)),
+                is_public=True, is_removed=False)
+                for n in range(self.random.randint(0, self.comments * 2))]
+            if post_comments:
+                post.comments_updated_on = max([comment.submit_date
+                    for comment in post_comments])
+            # raw saves skip the blog's index updates, which are rebuilt at
+            # the end; django-tagging still saves the tags
+            post.save_base(raw=True)
+            if categories:
+                for category in self.random.sample(categories,
+                    min(len(categories), self.random.randint(1, 3))):
+                    memberships.append(Post.categories.through(post=post,
+                        category=category))
+            for comment in post_comments:
+                comment.object_pk = str(post.pk)
+                comments.append(comment)
+            if image_name:
+                for n in range(self.random.randint(0, self.images * 2)):
+                    images.append(PostImage(post=post, title=self.words(3),
+                        image=image_name, gallery_position=n + 1))
+            if (i + 1) % 1000 == 0:
+                self.flush(memberships, comments, images)
+                self.log('Created %d posts.' % (i + 1))
+        self.flush(memberships, comments, images)
+
+        self.log('Rebuilding the blog indexes.')
+        call_command('blog_rebuild_indexes', verbosity=0)
+        call_command('blog_rebuild_related_posts', verbosity=0)
+        if image_name:
+            ImageBlob.objects.recount()
+            call_command('blog_rebuild_renditions', verbosity=0)
+        LastChange.objects.touch('posts', 'categories', 'series', 'comments')
+        self.log('Generated %d posts.' % self.posts)
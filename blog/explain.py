@@ -0,0 +1,85 @@
+"""
+Query plans
+
+Runs EXPLAIN on the core blog queries and finds the sequential (full table)
+scans in their plans, on SQLite, PostgreSQL and MySQL.
+"""
+import re
+from datetime import datetime
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from models import Post, PostArchiveEntry
+from managers import get_date_range
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+}
+
+def get_core_queries():
+    """
+    Return the core blog queries as a list of (name, queryset)
+    """
+    now = datetime.now()
+    start, end = get_date_range(now.year, now.month, now.day)
+    year_start, year_end = get_date_range(now.year)
+    month_start, month_end = get_date_range(now.year, now.month)
+    published = Post.objects.filter(is_published=True,
+        publish_date__lt=now)
+    return [
+        ('post detail', Post.objects.filter(slug='slug',
+            publish_date__gte=start, publish_date__lt=end)),
+        ('post index', published.order_by('-publish_date', '-id')[:20]),
+        ('featured posts', published.filter(is_featured=True).order_by(
+            '-publish_date')[:20]),
+        ('year posts', published.filter(publish_date__gte=year_start,
+            publish_date__lt=year_end)),
+        ('month posts', published.filter(publish_date__gte=month_start,
+            publish_date__lt=month_end)),
+        ('post archive', PostArchiveEntry.objects.filter(is_published=True,
+            publish_date__lt=now, category__isnull=True).order_by(
+            '-publish_date')),
+        ('category archive', PostArchiveEntry.objects.filter(category=1,
+            is_published=True, publish_date__lt=now).order_by(
+            '-publish_date')),
+        ('tag posts', published.filter(tag_postings__tag='tag',
+            tag_postings__is_published=True,
+            tag_postings__publish_date__lt=now)),
+    ]
+
+def explain(queryset):
+    """
+    Return the query plan of a queryset as a list of lines
+    """
+    connection = connections[queryset.db or DEFAULT_DB_ALIAS]
+    sql, params = queryset.query.get_compiler(
+        connection=connection).as_sql()
+    try:
+        prefix = EXPLAIN_PREFIXES[connection.vendor]
+    except KeyError:
+        raise ValueError('EXPLAIN is not supported on %s' % (
+            connection.vendor,))
+    cursor = connection.cursor()
+    cursor.execute(prefix + sql, params)
+    columns = [column[0] for column in cursor.description]
+    return ['  '.join(['%s=%s' % (column, value)
+        for column, value in zip(columns, row) if value is not None])
+        for row in cursor.fetchall()]
+
+def find_sequential_scans(plan, vendor):
+    """
+    Return the lines of a query plan that scan a whole table
+    """
+    if vendor == 'sqlite':
+        # "SCAN TABLE blog_post" or "SCAN blog_post", but not a scan
+        # through an index
+        pattern = re.compile(r'\bSCAN (TABLE )?\w+(?! USING)( \(|$|\s*$)')
+    elif vendor == 'postgresql':
+        pattern = re.compile(r'\bSeq Scan on\b')
+    elif vendor == 'mysql':
+        pattern = re.compile(r'\btype=ALL\b')
+    else:
+        return []
+    return [line for line in plan if pattern.search(line)]
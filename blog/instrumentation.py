@@ -0,0 +1,282 @@
+"""
+Instrumentation
+
+Records the wall time, number of SQL queries and SQL time of the blog views,
+context processors, template tag renders and PostManager methods, and hands
+each sample to the sinks listed in BLOG_INSTRUMENTATION_SINKS.  With no sinks
+(the default) nothing is recorded.
+
+A sink is any object with a record(sample) method.  Sinks are configured by
+dotted path, optionally with keyword arguments:
+
+    BLOG_INSTRUMENTATION_SINKS = (
+        'blog.instrumentation.LoggingSink',
+        ('blog.instrumentation.StatsDSink', {'host': 'localhost',
+            'port': 8125}),
+        ('blog.instrumentation.FileSink', {'path': '/var/log/blog.jsonl'}),
+    )
+
+SQL queries are counted through Django's debug cursor, which is switched on
+for the duration of the outermost instrumented call; the queries it records
+are dropped again unless DEBUG is on.
+"""
+import logging
+import socket
+from collections import deque
+from math import ceil
+from threading import Lock, local
+from time import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import simplejson
+from django.utils.functional import wraps
+from django.utils.importlib import import_module
+
+from settings import BLOG_INSTRUMENTATION_SINKS
+
+logger = logging.getLogger('blog.instrumentation')
+
+_state = local()
+_sinks = None
+
+class Sample(object):
+    """
+    The wall time (seconds), SQL query count and SQL time (seconds) of an
+    instrumented call
+    """
+    def __init__(self, name, time, queries, sql_time, timestamp=None):
+        self.name = name
+        self.time = time
+        self.queries = queries
+        self.sql_time = sql_time
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return '<Sample %s: %.2fms, %d queries, %.2fms sql>' % (self.name,
+            self.time * 1000, self.queries, self.sql_time * 1000)
+
+def load_sink(spec):
+    """
+    Return a sink from a dotted path, or a (dotted path, keyword arguments)
+    pair
+    """
+    kwargs = {}
+    if not isinstance(spec, basestring):
+        spec, kwargs = spec
+    module_name, class_name = spec.rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)(**kwargs)
+
+def get_sinks():
+    """
+    Return the instrumentation sinks
+    """
+    global _sinks
+    if _sinks is None:
+        _sinks = [load_sink(spec) for spec in BLOG_INSTRUMENTATION_SINKS]
+    return _sinks
+
+def set_sinks(sinks):
+    """
+    Replace the instrumentation sinks (an empty list disables the
+    instrumentation)
+    """
+    global _sinks
+    _sinks = list(sinks)
+
+def _start():
+    depth = getattr(_state, 'depth', 0)
+    if not depth:
+        _state.use_debug_cursor = connection.use_debug_cursor
+        _state.first_query = len(connection.queries)
+        connection.use_debug_cursor = True
+    _state.depth = depth + 1
+    return time(), len(connection.queries)
+
+def _finish(name, started, sinks):
+    started_on, first_query = started
+    elapsed = time() - started_on
+    queries = connection.queries[first_query:]
+    sample = Sample(name, elapsed, len(queries),
+        sum([float(query['time']) for query in queries]), started_on)
+    _state.depth -= 1
+    if not _state.depth:
+        use_debug_cursor = _state.use_debug_cursor
+        connection.use_debug_cursor = use_debug_cursor
+        if not (use_debug_cursor or
+            (use_debug_cursor is None and settings.DEBUG)):
+            del connection.queries[_state.first_query:]
+    for sink in sinks:
+        try:
+            sink.record(sample)
+        except Exception:
+            # a failing sink must not fail the request
+            logger.exception('Instrumentation sink %r failed' % (sink,))
+
+def instrumented(name):
+    """
+    Decorator that records a sample named name for each call
+    """
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            sinks = get_sinks()
+            if not sinks:
+                return function(*args, **kwargs)
+            started = _start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _finish(name, started, sinks)
+        return wraps(function)(wrapper)
+    return decorator
+
+def instrument_methods(cls, names, prefix):
+    """
+    Instrument the methods of a class, naming each sample prefix.method
+    """
+    for name in names:
+        setattr(cls, name, instrumented('%s.%s' % (prefix, name))(
+            getattr(cls, name)))
+
+def get_percentile(values, percentile):
+    """
+    Return the nearest rank percentile of a sorted list of values
+    """
+    if not values:
+        return None
+    rank = int(ceil(percentile / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+def get_percentiles(samples, percentiles=(50, 90, 99)):
+    """
+    Summarize samples by name
+
+    Returns a sorted list of (name, count, {measure: [percentile values]})
+    for the time, queries and sql_time measures.
+    """
+    by_name = {}
+    for sample in samples:
+        by_name.setdefault(sample.name, []).append(sample)
+    summary = []
+    for name in sorted(by_name.keys()):
+        measures = {}
+        for measure in ('time', 'queries', 'sql_time'):
+            values = sorted([getattr(sample, measure)
+                for sample in by_name[name]])
+            measures[measure] = [get_percentile(values, percentile)
+                for percentile in percentiles]
+        summary.append((name, len(by_name[name]), measures))
+    return summary
+
+class LoggingSink(object):
+    """
+    Logs each sample
+    """
+    def __init__(self, logger='blog.instrumentation', level=logging.INFO):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def record(self, sample):
+        self.logger.log(self.level, '%s %.2fms %d queries %.2fms sql' % (
+            sample.name, sample.time * 1000, sample.queries,
+            sample.sql_time * 1000))
+
+class MemorySink(object):
+    """
+    Keeps the latest max_samples samples of each name in memory
+    """
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.samples = {}
+        self._lock = Lock()
+
+    def record(self, sample):
+        self._lock.acquire()
+        try:
+            if sample.name not in self.samples:
+                self.samples[sample.name] = deque(maxlen=self.max_samples)
+            self.samples[sample.name].append(sample)
+        finally:
+            self._lock.release()
+
+    def get_percentiles(self, percentiles=(50, 90, 99)):
+        """
+        Summarize the samples (see get_percentiles)
+        """
+        self._lock.acquire()
+        try:
+            samples = [sample for name_samples in self.samples.values()
+                for sample in name_samples]
+        finally:
+            self._lock.release()
+        return get_percentiles(samples, percentiles)
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.samples.clear()
+        finally:
+            self._lock.release()
+
+class StatsDSink(object):
+    """
+    Sends each sample to a StatsD server over UDP
+
+    The time and SQL time are sent as timers in milliseconds, and the query
+    count as a timer too so that StatsD keeps its percentiles.
+    """
+    def __init__(self, host='localhost', port=8125, prefix='blog'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def format(self, sample):
+        """
+        Return the StatsD packet of a sample
+        """
+        name = '%s.%s' % (self.prefix, sample.name)
+        return '\n'.join([
+            '%s.time:%.3f|ms' % (name, sample.time * 1000),
+            '%s.queries:%d|ms' % (name, sample.queries),
+            '%s.sql_time:%.3f|ms' % (name, sample.sql_time * 1000),])
+
+    def record(self, sample):
+        self.socket.sendto(self.format(sample).encode('utf-8'), self.address)
+
+class FileSink(object):
+    """
+    Appends each sample to a file as a line of JSON, for the
+    blog_instrumentation_percentiles management command
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+
+    def record(self, sample):
+        line = simplejson.dumps({'name': sample.name, 'time': sample.time,
+            'queries': sample.queries, 'sql_time': sample.sql_time,
+            'timestamp': sample.timestamp}) + '\n'
+        self._lock.acquire()
+        try:
+            f = open(self.path, 'a')
+            try:
+                f.write(line)
+            finally:
+                f.close()
+        finally:
+            self._lock.release()
+
+def read_samples(path):
+    """
+    Read the samples written by a FileSink
+    """
+    f = open(path)
+    try:
+        for line in f:
+            if not line.strip():
+                continue
+            data = simplejson.loads(line)
+            yield Sample(data['name'], data['time'], data['queries'],
+                data['sql_time'], data.get('timestamp'))
+    finally:
+        f.close()
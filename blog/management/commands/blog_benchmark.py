@@ -0,0 +1,85 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.utils import simplejson
+
+from blog.benchmark import BenchmarkError, PERCENTILES, get_benchmarks, \
+    run_benchmark, get_peak_memory, compare
+
+class Command(NoArgsCommand):
+    """
+    Benchmark the blog views, managers, feed and sitemaps
+    """
+    help = 'Benchmark the blog urls, PostManager methods, feed and ' \
+        'sitemaps, and compare the results with a baseline.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--iterations', type='int', dest='iterations',
+            default=20, help='Timed iterations per benchmark (default 20).'),
+        make_option('--warmup', type='int', dest='warmup', default=2,
+            help='Untimed iterations per benchmark (default 2).'),
+        make_option('--cold', action='store_true', dest='cold',
+            default=False, help='Empty the caches before each iteration ' \
+            '(requires local memory cache backends).'),
+        make_option('--name', dest='name', default='',
+            help='Only benchmarks whose name starts with this prefix.'),
+        make_option('--baseline', dest='baseline', default=None,
+            help='Baseline file to compare the results with.'),
+        make_option('--save-baseline', action='store_true',
+            dest='save_baseline', default=False,
+            help='Write the results to the baseline file.'),
+        make_option('--threshold', type='float', dest='threshold',
+            default=0.2, help='Allowed median latency and peak memory ' \
+            'growth over the baseline, as a fraction (default 0.2).'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('--save-baseline requires --baseline.')
+        try:
+            benchmarks = [benchmark for benchmark in get_benchmarks()
+                if benchmark.name.startswith(options['name'])]
+        except BenchmarkError as e:
+            raise CommandError(e)
+
+        results = {'benchmarks': {}}
+        self.stdout.write('%-40s %s %8s\n' % ('benchmark',
+            ' '.join(['%9s' % ('p%d ms' % percentile)
+                for percentile in PERCENTILES]), 'queries'))
+        for benchmark in benchmarks:
+            try:
+                result = run_benchmark(benchmark,
+                    iterations=options['iterations'],
+                    warmup=options['warmup'], cold=options['cold'])
+            except BenchmarkError as e:
+                raise CommandError(e)
+            results['benchmarks'][benchmark.name] = result
+            self.stdout.write('%-40s %s %8d\n' % (benchmark.name,
+                ' '.join(['%9.2f' % (result['p%d' % percentile] * 1000)
+                    for percentile in PERCENTILES]), result['queries']))
+        results['peak_memory'] = get_peak_memory()
+        if results['peak_memory'] is not None:
+            self.stdout.write('Peak memory: %d\n' % results['peak_memory'])
+
+        if options['save_baseline']:
+            f = open(options['baseline'], 'w')
+            try:
+                f.write(simplejson.dumps(results, indent=2, sort_keys=True))
+            finally:
+                f.close()
+            self.stdout.write('Saved the baseline to %s.\n' % (
+                options['baseline'],))
+        elif options['baseline']:
+            try:
+                f = open(options['baseline'])
+                try:
+                    baseline = simplejson.loads(f.read())
+                finally:
+                    f.close()
+            except IOError as e:
+                raise CommandError('Could not read the baseline: %s' % e)
+            regressions = compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError('%d regressions:\n%s' % (len(regressions),
+                    '\n'.join(regressions)))
+            self.stdout.write('No regressions against %s.\n' % (
+                options['baseline'],))
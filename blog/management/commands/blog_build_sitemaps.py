@@ -0,0 +1,81 @@
+import gzip
+import os
+from optparse import make_option
+from time import mktime
+
+from django.contrib.sites.models import Site
+from django.core.management.base import NoArgsCommand
+from django.template.loader import render_to_string
+from django.utils.encoding import smart_str
+
+from blog.sitemaps import sitemaps
+from blog.settings import BLOG_SITEMAP_ROOT, BLOG_SITEMAP_URL
+
+SITEMAP_INDEX_FILENAME = 'sitemap.xml.gz'
+
+class Command(NoArgsCommand):
+    """
+    Write the blog sitemaps to gzipped files
+    """
+    help = 'Write the blog sitemap index and sections to gzipped files in ' \
+        'BLOG_SITEMAP_ROOT, rebuilding only the sections that changed.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Rebuild every section, changed or not.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        site = Site.objects.get_current()
+        if not os.path.isdir(BLOG_SITEMAP_ROOT):
+            os.makedirs(BLOG_SITEMAP_ROOT)
+
+        filenames = []
+        rebuilt = 0
+        for section, sitemap_class in sorted(sitemaps.items()):
+            sitemap = sitemap_class()
+            for page in range(1, sitemap.paginator.num_pages + 1):
+                filename = 'sitemap-%s-%d.xml.gz' % (section, page)
+                filenames.append(filename)
+                path = os.path.join(BLOG_SITEMAP_ROOT, filename)
+                if not options['all'] and not self.is_stale(path,
+                    sitemap.get_changed_on(page)):
+                    continue
+                self.write(path, render_to_string('sitemap.xml',
+                    {'urlset': sitemap.get_urls(page=page, site=site)}))
+                rebuilt += 1
+                if verbosity > 1:
+                    self.stdout.write('Wrote %s\n' % (filename,))
+
+        index_path = os.path.join(BLOG_SITEMAP_ROOT, SITEMAP_INDEX_FILENAME)
+        if rebuilt or options['all'] or not os.path.exists(index_path):
+            base_url = BLOG_SITEMAP_URL
+            if base_url.startswith('/'):
+                base_url = 'http://%s%s' % (site.domain, base_url)
+            self.write(index_path, render_to_string('sitemap_index.xml',
+                {'sitemaps': [base_url + filename for filename in filenames]}))
+        if verbosity > 0:
+            self.stdout.write('Rebuilt %d of %d sitemap sections.\n' % (
+                rebuilt, len(filenames)))
+
+    def is_stale(self, path, changed_on):
+        """
+        Return whether a sitemap file is missing or older than its section
+        """
+        if not os.path.exists(path):
+            return True
+        if changed_on is None:
+            return False
+        return os.path.getmtime(path) < mktime(changed_on.timetuple())
+
+    def write(self, path, xml):
+        """
+        Write gzipped xml to a file, replacing it atomically
+        """
+        temp_path = '%s.tmp' % (path,)
+        sitemap_file = gzip.open(temp_path, 'wb')
+        try:
+            sitemap_file.write(smart_str(xml))
+        finally:
+            sitemap_file.close()
+        os.rename(temp_path, path)
@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from blog.settings import BLOG_IMAGE_BLOB_GRACE
+from blog.storage import collect_garbage
+
+class Command(NoArgsCommand):
+    """
+    Delete the unreferenced image blobs
+    """
+    help = 'Recount the post images referring to each image blob and ' \
+        'delete the blobs that none refer to.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--grace', type='int', dest='grace',
+            default=BLOG_IMAGE_BLOB_GRACE,
+            help='Keep unreferenced blobs saved within this many seconds ' \
+            '(default BLOG_IMAGE_BLOB_GRACE).'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+            default=False, help='List the blobs without deleting them.'),
+    )
+
+    def handle_noargs(self, **options):
+        deleted = collect_garbage(grace=options['grace'],
+            dry_run=options['dry_run'])
+        verbosity = int(options.get('verbosity', 1))
+        if verbosity > 1 or options['dry_run']:
+            for name in deleted:
+                self.stdout.write('%s\n' % name)
+        if verbosity > 0:
+            self.stdout.write('%s %d unreferenced blobs.\n' % (
+                options['dry_run'] and 'Found' or 'Deleted', len(deleted)))
@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from blog.explain import get_core_queries, explain, find_sequential_scans
+
+class Command(NoArgsCommand):
+    """
+    Explain the core blog queries and report sequential scans
+    """
+    help = 'Run EXPLAIN on the core blog queries and report the ones that ' \
+        'scan a whole table.  Databases may prefer scanning tables that ' \
+        'are small, so check against a realistically sized database.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--fail', action='store_true', dest='fail',
+            default=False,
+            help='Exit with an error if any query scans a whole table.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        scanning = []
+        for name, queryset in get_core_queries():
+            vendor = connections[queryset.db or DEFAULT_DB_ALIAS].vendor
+            try:
+                plan = explain(queryset)
+            except ValueError as e:
+                raise CommandError(e)
+            scans = find_sequential_scans(plan, vendor)
+            if scans:
+                scanning.append(name)
+            self.stdout.write('%s: %s\n' % (name,
+                scans and 'SEQUENTIAL SCAN' or 'ok'))
+            if verbosity > 1 or scans:
+                for line in (verbosity > 1 and plan or scans):
+                    self.stdout.write('    %s\n' % line)
+        if scanning and options['fail']:
+            raise CommandError('%d queries scan a whole table: %s' % (
+                len(scanning), ', '.join(scanning)))
@@ -0,0 +1,43 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from blog.transfer import write_jsonl, write_wxr
+
+class Command(NoArgsCommand):
+    """
+    Export the blog posts
+    """
+    help = 'Export the posts, categories, series, tags and images as JSON ' \
+        'Lines or WordPress eXtended RSS.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--format', dest='format', default='jsonl',
+            help='Export format, jsonl or wxr (default jsonl).'),
+        make_option('--output', dest='output', default=None,
+            help='File to write to (default standard output).'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=500, help='Posts read per query (default 500).'),
+        make_option('--link', dest='link', default='/',
+            help='Link of the blog in a WXR export (default /).'),
+    )
+
+    def handle_noargs(self, **options):
+        if options['format'] not in ('jsonl', 'wxr'):
+            raise CommandError('Unknown format %r.' % options['format'])
+        if options['output']:
+            stream = open(options['output'], 'w')
+        else:
+            stream = sys.stdout
+        try:
+            if options['format'] == 'wxr':
+                count = write_wxr(stream, batch_size=options['batch_size'],
+                    link=options['link'])
+            else:
+                count = write_jsonl(stream, batch_size=options['batch_size'])
+        finally:
+            if options['output']:
+                stream.close()
+        if options['output'] and int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Exported %d records to %s.\n' % (count,
+                options['output']))
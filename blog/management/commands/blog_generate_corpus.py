@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from blog.corpus import CorpusGenerator
+
+class Command(NoArgsCommand):
+    """
+    Generate a synthetic blog corpus
+    """
+    help = 'Generate a large, reproducible synthetic blog corpus for ' \
+        'benchmarking.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--posts', type='int', dest='posts', default=1000,
+            help='Number of posts (default 1000).'),
+        make_option('--tags', type='int', dest='tags', default=200,
+            help='Number of distinct tags (default 200).'),
+        make_option('--categories', type='int', dest='categories',
+            default=20, help='Number of categories (default 20).'),
+        make_option('--series', type='int', dest='series', default=30,
+            help='Number of series (default 30).'),
+        make_option('--comments', type='int', dest='comments', default=3,
+            help='Average comments per post (default 3).'),
+        make_option('--images', type='int', dest='images', default=1,
+            help='Average images per post (default 1).'),
+        make_option('--days', type='int', dest='days', default=3650,
+            help='Number of days the posts span (default 3650).'),
+        make_option('--seed', type='int', dest='seed', default=0,
+            help='Random seed (default 0).'),
+        make_option('--author', dest='author', default='corpus',
+            help='Username of the posts\' author (default corpus).'),
+    )
+
+    def handle_noargs(self, **options):
+        stdout = None
+        if int(options.get('verbosity', 1)) > 0:
+            stdout = self.stdout
+        CorpusGenerator(posts=options['posts'], tags=options['tags'],
+            categories=options['categories'], series=options['series'],
+            comments=options['comments'], images=options['images'],
+            days=options['days'], seed=options['seed'],
+            author=options['author'], stdout=stdout).generate()
@@ -0,0 +1,62 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.transfer import Importer, read_jsonl, read_wxr
+
+class Command(BaseCommand):
+    """
+    Import blog posts
+    """
+    args = '<file>'
+    help = 'Import posts, categories, series, tags and images from JSON ' \
+        'Lines or WordPress eXtended RSS, in batches.'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+            help='Import format, jsonl or wxr (default by file extension: ' \
+            '.xml and .wxr are wxr).'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=500, help='Posts inserted per transaction (default 500).'),
+        make_option('--checkpoint', dest='checkpoint', default=None,
+            help='File recording the progress, to resume an interrupted ' \
+            'import.'),
+        make_option('--author', dest='author', default=None,
+            help='Username of the author of posts that have none.'),
+        make_option('--no-rebuild', action='store_false', dest='rebuild',
+            default=True, help='Don\'t rebuild the blog indexes afterwards.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the file to import.')
+        path = args[0]
+        format = options['format']
+        if format is None:
+            format = path.lower().endswith(('.xml', '.wxr')) and 'wxr' \
+                or 'jsonl'
+        if format not in ('jsonl', 'wxr'):
+            raise CommandError('Unknown format %r.' % format)
+        stdout = None
+        if int(options.get('verbosity', 1)) > 0:
+            stdout = self.stdout
+        importer = Importer(batch_size=options['batch_size'],
+            checkpoint=options['checkpoint'],
+            default_author=options['author'], stdout=stdout)
+        if format == 'wxr':
+            stream = open(path, 'rb')
+            records = read_wxr(stream)
+        else:
+            stream = open(path)
+            records = read_jsonl(stream)
+        try:
+            try:
+                counts = importer.run(records)
+            except ValueError as e:
+                raise CommandError(e)
+        finally:
+            stream.close()
+        if options['rebuild']:
+            importer.finish()
+        if stdout is not None:
+            stdout.write('Imported %(posts)d posts and %(images)d images, ' \
+                'skipped %(skipped)d existing posts.\n' % counts)
@@ -0,0 +1,50 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.instrumentation import read_samples, get_percentiles
+
+class Command(BaseCommand):
+    """
+    Dump the percentiles of the instrumentation samples written by a
+    FileSink
+    """
+    args = '<samples file> [<samples file> ...]'
+    help = 'Dump the wall time, query count and SQL time percentiles of ' \
+        'the blog instrumentation samples.'
+    option_list = BaseCommand.option_list + (
+        make_option('--percentiles', dest='percentiles', default='50,90,99',
+            help='Comma separated percentiles (default 50,90,99).'),
+        make_option('--name', dest='name', default='',
+            help='Only samples whose name starts with this prefix.'),
+    )
+
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError('Enter at least one samples file.')
+        try:
+            percentiles = [float(percentile) for percentile in
+                options['percentiles'].split(',')]
+        except ValueError:
+            raise CommandError('Invalid percentiles: %s' % (
+                options['percentiles'],))
+        samples = []
+        for path in paths:
+            try:
+                samples.extend([sample for sample in read_samples(path)
+                    if sample.name.startswith(options['name'])])
+            except IOError as e:
+                raise CommandError('Could not read %s: %s' % (path, e))
+
+        headings = ['%g' % percentile for percentile in percentiles]
+        self.stdout.write('%-50s %8s  %s  %s  %s\n' % ('name', 'count',
+            ' '.join(['ms p%-5s' % heading for heading in headings]),
+            ' '.join(['qs p%-5s' % heading for heading in headings]),
+            ' '.join(['sql p%-4s' % heading for heading in headings])))
+        for name, count, measures in get_percentiles(samples, percentiles):
+            self.stdout.write('%-50s %8d  %s  %s  %s\n' % (name, count,
+                ' '.join(['%9.2f' % (value * 1000)
+                    for value in measures['time']]),
+                ' '.join(['%9d' % value for value in measures['queries']]),
+                ' '.join(['%9.2f' % (value * 1000)
+                    for value in measures['sql_time']])))
@@ -0,0 +1,40 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from blog.models import PublishEvent
+from blog.publishing import ping
+from blog.settings import BLOG_PING_URL, BLOG_PING_SITEMAP_URL
+
+class Command(NoArgsCommand):
+    """
+    Ping the pending publish events
+    """
+    help = 'Ping the search engine once for the pending blog publish events.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--loop', action='store_true', dest='loop',
+            default=False, help='Keep processing publish events.'),
+        make_option('--interval', type='int', dest='interval', default=15,
+            help='Seconds between runs with --loop (default 15).'),
+        make_option('--ping-url', dest='ping_url', default=BLOG_PING_URL,
+            help='Url to ping (default BLOG_PING_URL).'),
+        make_option('--sitemap-url', dest='sitemap_url',
+            default=BLOG_PING_SITEMAP_URL,
+            help='Sitemap url to ping (default BLOG_PING_SITEMAP_URL).'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+
+        def ping_sitemap():
+            ping(ping_url=options['ping_url'],
+                sitemap_url=options['sitemap_url'])
+
+        while True:
+            pinged = PublishEvent.objects.process(ping_sitemap)
+            if pinged and verbosity > 0:
+                self.stdout.write('Pinged %d publish events.\n' % (pinged,))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.core.management.base import NoArgsCommand
+
+from blog.models import PostArchiveEntry, TagPosting, TagUsage
+from blog.search import rebuild_index as rebuild_search_index
+from blog.neighbors import rebuild as rebuild_neighbors
+
+class Command(NoArgsCommand):
+    """
+    Rebuild the denormalized blog indexes
+    """
+    help = 'Rebuild the denormalized blog indexes from the posts.'
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        for name, rebuild in (
+            ('post archive', PostArchiveEntry.objects.rebuild),
+            ('tag posting', TagPosting.objects.rebuild),
+            ('tag usage', TagUsage.objects.rebuild),
+            ('search', rebuild_search_index),
+            ('post neighbor', rebuild_neighbors),):
+            rebuild()
+            if verbosity > 0:
+                self.stdout.write('Rebuilt the %s index.\n' % name)
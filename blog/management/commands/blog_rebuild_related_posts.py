@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from blog.related import rebuild
+
+class Command(NoArgsCommand):
+    """
+    Rebuild the related posts
+    """
+    help = 'Rebuild the related posts of every post across a process pool.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+            default=None,
+            help='Number of processes (default: the number of CPUs).'),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=100, help='Posts per task (default 100).'),
+    )
+
+    def handle_noargs(self, **options):
+        count = rebuild(processes=options['processes'],
+            chunk_size=options['chunk_size'])
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Rebuilt the related posts of %d posts.\n' % (
+                count,))
@@ -0,0 +1,53 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from blog.renditions import rebuild, render_pending
+from blog.settings import BLOG_IMAGE_RENDITION_PROCESSES
+
+class Command(NoArgsCommand):
+    """
+    Render the missing post image renditions
+    """
+    help = 'Render the missing renditions of every post image, or of the ' \
+        'pending post images, across a process pool.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+            default=BLOG_IMAGE_RENDITION_PROCESSES,
+            help='Number of processes (default: '
+            'BLOG_IMAGE_RENDITION_PROCESSES, or the number of CPUs).'),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=20, help='Images per batch of tasks (default 20).'),
+        make_option('--pending', action='store_true', dest='pending',
+            default=False, help='Only render the images saved since they ' \
+            'were last rendered.'),
+        make_option('--loop', action='store_true', dest='loop',
+            default=False, help='Keep rendering the pending images.'),
+        make_option('--interval', type='int', dest='interval', default=15,
+            help='Seconds between runs with --loop (default 15).'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if not (options['pending'] or options['loop']):
+            count = rebuild(processes=options['processes'],
+                chunk_size=options['chunk_size'])
+            if verbosity > 0:
+                self.stdout.write('Rendered the renditions of %d images.\n' % (
+                    count,))
+            return
+
+        # images that can't be rendered are logged once, until they change
+        failed = set()
+        while True:
+            rendered, run_failed = render_pending(
+                processes=options['processes'],
+                chunk_size=options['chunk_size'], exclude=failed)
+            failed.update(run_failed)
+            if rendered and verbosity > 0:
+                self.stdout.write('Rendered the renditions of %d images.\n' % (
+                    len(rendered),))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
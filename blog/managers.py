@@ -1,8 +1,28 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models.query import QuerySet
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
 
 from tagging.models import Tag, TaggedItem
+from tagging.utils import calculate_cloud, LOGARITHMIC
+
+from instrumentation import instrument_methods
+from settings import BLOG_TAG_USAGE_CACHE_TIMEOUT, \
+    BLOG_TAXONOMY_CACHE_TIMEOUT, BLOG_VISIBILITY_CACHE_TIMEOUT, \
+    BLOG_PING_DEBOUNCE, \
+    BLOG_PING_MAX_DELAY, BLOG_PING_MAX_ATTEMPTS, BLOG_PING_RETRY_DELAY
+
+# number of posts whose tags are fetched per query by PostQuerySet.with_tags
+TAG_PREFETCH_BATCH_SIZE = 100
+
+TAG_USAGE_CACHE_KEY = 'blog.tag_usage'
+TAG_USAGE_COUNTED_CACHE_KEY = 'blog.tag_usage.counted_as_of'
+VISIBILITY_CACHE_KEY = 'blog.visibility'
+CATEGORY_CACHE_KEY = 'blog.categories'
+SERIES_CACHE_KEY = 'blog.series'
 
 class PostImageManager(models.Manager):
     """
@@ -17,21 +37,155 @@ class PostImageManager(models.Manager):
         Gallery images are PostImages that have a non-null gallery position
         """
         return self.get_query_set().filter(gallery_position__isnull=False)
+
+    def attach_renditions(self, images):
+        """
+        Fetch the renditions of a list of post images in a single query and
+        attach them to each image as image.rendition_list
+        """
+        images = list(images)
+        if not images:
+            return images
+        rendition_model = models.get_model(self.model._meta.app_label,
+            'ImageRendition')
+        image_renditions = {}
+        for rendition in rendition_model.objects.filter(
+            image__in=[image.pk for image in images]):
+            image_renditions.setdefault(rendition.image_id, []).append(
+                rendition)
+        for image in images:
+            image._rendition_list_cache = image_renditions.get(image.pk, [])
+        return images
     
+def get_date_range(year, month=None, day=None):
+    """
+    Return the half-open (start, end) datetime range of a year, month or day
+
+    Filtering publish_date__gte=start, publish_date__lt=end can use an index
+    on publish_date, unlike publish_date__year and friends.  Raises
+    ValueError for an invalid date.
+    """
+    year = int(year)
+    if month is None:
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    month = int(month)
+    start = datetime(year, month, 1)
+    if day is not None:
+        start = start.replace(day=int(day))
+        return start, start + timedelta(days=1)
+    if month == 12:
+        return start, datetime(year + 1, 1, 1)
+    return start, datetime(year, month + 1, 1)
+
+def get_tag_names(tags):
+    """
+    Return a list of tag names from a tag, a tag name or a list of either
+    """
+    if not tags:
+        return []
+    if not isinstance(tags, (list, tuple)):
+        tags = [tags,]
+    return [unicode(tag) for tag in tags]
+
+def bulk_insert(model, objects):
+    """
+    Insert a list of new objects in a single statement
+
+    Uses bulk_create where the Django version has it, otherwise one INSERT
+    executed with the rows of every object.  The objects' primary keys
+    aren't set.
+    """
+    if not objects:
+        return
+    if hasattr(model._default_manager, 'bulk_create'):
+        model._default_manager.bulk_create(objects)
+        return
+    fields = [field for field in model._meta.local_fields
+        if not isinstance(field, models.AutoField)]
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table),
+        ', '.join([qn(field.column) for field in fields]),
+        ', '.join(['%s'] * len(fields)))
+    connection.cursor().executemany(sql, [[field.get_db_prep_save(
+        field.pre_save(obj, True), connection=connection)
+        for field in fields] for obj in objects])
+    transaction.commit_unless_managed()
+
+class PostQuerySet(QuerySet):
+    """
+    Post QuerySet
+    """
+    def __init__(self, *args, **kwargs):
+        super(PostQuerySet, self).__init__(*args, **kwargs)
+        self._prefetch_tags = False
+        self._prefetch_categories = False
+
+    def with_tags(self):
+        """
+        Return a copy of the queryset that attaches the tags of its posts
+        (see PostManager.attach_tags) in one query per batch of posts
+        """
+        return self._clone(_prefetch_tags=True)
+
+    def with_categories(self):
+        """
+        Return a copy of the queryset that attaches the categories of its
+        posts (see PostManager.attach_categories) in one query per batch of
+        posts
+        """
+        return self._clone(_prefetch_categories=True)
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('_prefetch_tags', self._prefetch_tags)
+        kwargs.setdefault('_prefetch_categories', self._prefetch_categories)
+        return super(PostQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def _attach(self, posts):
+        if self._prefetch_tags:
+            self.model.objects.attach_tags(posts)
+        if self._prefetch_categories:
+            self.model.objects.attach_categories(posts)
+        return posts
+
+    def iterator(self):
+        if not (self._prefetch_tags or self._prefetch_categories):
+            for post in super(PostQuerySet, self).iterator():
+                yield post
+            return
+        batch = []
+        for post in super(PostQuerySet, self).iterator():
+            batch.append(post)
+            if len(batch) == TAG_PREFETCH_BATCH_SIZE:
+                for attached_post in self._attach(batch):
+                    yield attached_post
+                batch = []
+        if batch:
+            for attached_post in self._attach(batch):
+                yield attached_post
+
 class PostManager(models.Manager):
     """
     Post Manager
     """
     # use for related fields
     use_for_related_fields = True
+    def get_query_set(self):
+        return PostQuerySet(self.model, using=self._db)
+
     def build_query(self, require_published=True, year=None, month=None,
-        category_slug=None, series_slug=None, tag=None, require_featured=False):
+        category_slug=None, series_slug=None, tag=None, require_featured=False,
+        with_tags=False):
         # Initial posts by require published indicator
         if require_published:
+            visible_as_of = self.get_visible_as_of()
             posts = self.get_query_set().filter(is_published=True,
-                publish_date__lt=datetime.now)
+                publish_date__lt=visible_as_of)
         else:
             posts = self.get_query_set()
+
+        # attach the post tags in bulk
+        if with_tags:
+            posts = posts.with_tags()
             
         # featured
         if require_featured == True:
@@ -39,9 +193,12 @@ class PostManager(models.Manager):
             
         # date
         if year:
-            posts = posts.filter(publish_date__year=year)
-            if month:
-                posts = posts.filter(publish_date__month=month)
+            try:
+                start, end = get_date_range(year, month or None)
+            except ValueError:
+                return posts.none()
+            posts = posts.filter(publish_date__gte=start,
+                publish_date__lt=end)
                 
         #category and series
         if category_slug:
@@ -50,12 +207,111 @@ class PostManager(models.Manager):
             posts = posts.filter(series__slug=series_slug)
             
         # tag
-        if tag:
-            # return posts filtered by the tag
-            return TaggedItem.objects.get_by_model(posts, [tag,])
-        else:
-            return posts
+        # each tag filters through its own join on the tag posting lists, so
+        # several tags intersect
+        for tag_name in get_tag_names(tag):
+            if require_published:
+                posts = posts.filter(tag_postings__tag=tag_name,
+                    tag_postings__is_published=True,
+                    tag_postings__publish_date__lt=visible_as_of)
+            else:
+                posts = posts.filter(tag_postings__tag=tag_name)
+        return posts
     
+    def get_visibility(self):
+        """
+        Return a tuple of (the visibility boundary, the next scheduled
+        publish date, the publish date of the latest visible post), cached
+        until the next scheduled publish date or a reset
+        """
+        now = datetime.now()
+        visibility = cache.get(VISIBILITY_CACHE_KEY)
+        # no post is published between the boundary and the next scheduled
+        # publish date, so the boundary holds until then
+        if visibility is not None and (visibility[1] is None
+            or visibility[1] >= now):
+            return visibility
+        visible_as_of = now.replace(microsecond=0)
+        published = self.model._default_manager.filter(is_published=True)
+        next_publish_date = published.filter(
+            publish_date__gte=visible_as_of
+        ).aggregate(models.Min('publish_date'))['publish_date__min']
+        latest_publish_date = published.filter(
+            publish_date__lt=visible_as_of
+        ).aggregate(models.Max('publish_date'))['publish_date__max']
+        visibility = (visible_as_of, next_publish_date, latest_publish_date)
+        cache.set(VISIBILITY_CACHE_KEY, visibility,
+            BLOG_VISIBILITY_CACHE_TIMEOUT)
+        return visibility
+
+    def get_visible_as_of(self):
+        """
+        Return the visibility boundary of published posts
+        
+        Published posts are visible once their publish date is before the
+        boundary.  Unlike the current time, the boundary only advances when
+        a scheduled post's publish date arrives (or a post is saved), so
+        queries and caches keyed on it stay the same between publishes.
+        """
+        return self.get_visibility()[0]
+
+    def get_latest_publish_date(self):
+        """
+        Return the publish date of the latest visible published post
+        """
+        return self.get_visibility()[2]
+
+    def reset_visible_as_of(self):
+        """
+        Reset the visibility boundary after posts changed
+        """
+        cache.delete(VISIBILITY_CACHE_KEY)
+
+    def attach_tags(self, posts):
+        """
+        Fetch the tags of a list of posts in a single query and attach them
+        to each post as post.tag_list
+
+        Each tag has its blog tag detail url in tag.blog_url
+        """
+        posts = list(posts)
+        if not posts:
+            return posts
+        tagged_items = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model),
+            object_id__in=[post.pk for post in posts]
+        ).select_related('tag').order_by('tag__name')
+        tag_urls = {}
+        post_tags = {}
+        for tagged_item in tagged_items:
+            tag = tagged_item.tag
+            if tag.name not in tag_urls:
+                tag_urls[tag.name] = reverse('blog.views.tag_detail',
+                    kwargs={'tag': tag.name})
+            tag.blog_url = tag_urls[tag.name]
+            post_tags.setdefault(tagged_item.object_id, []).append(tag)
+        for post in posts:
+            post._tag_list_cache = post_tags.get(post.pk, [])
+        return posts
+
+    def attach_categories(self, posts):
+        """
+        Fetch the categories of a list of posts in a single query and attach
+        them to each post as post.category_list
+        """
+        posts = list(posts)
+        if not posts:
+            return posts
+        post_categories = {}
+        for membership in self.model.categories.through.objects.filter(
+            post__in=[post.pk for post in posts]).select_related('category'
+            ).order_by('category__title'):
+            post_categories.setdefault(membership.post_id, []).append(
+                membership.category)
+        for post in posts:
+            post._category_list_cache = post_categories.get(post.pk, [])
+        return posts
+
     def get_published_posts(self):
         """
         Get published posts
@@ -70,45 +326,67 @@ class PostManager(models.Manager):
         return self.build_query(require_published=True, require_featured=True)
     
     def get_post_archive(self, require_published=True, year=None, month=None,
-        category_slug=None, tag=None):
+        category_slug=None, tag=None, require_featured=False):
         """
         Return a Post Archive
         
         A blog post archive is a tuple of (year, months[]),
         each month containing a tuple of (month, days[]),
         each day containing a tuple of (day, posts[])
+
+        The posts are PostArchiveEntry instances read from the denormalized
+        archive index.  They render and link like the posts they reference,
+        and the post itself is available as entry.post.
         
         """
-        # This was originally done as a dictionary
-        # but python dictionaries can't guarantee sort order.
-        posts = self.build_query(require_published=require_published, year=year,
-            month=month, category_slug=category_slug, tag=tag)
-        post_archive = {}
-        for post in posts.order_by('-publish_date'):
-            if not post_archive.has_key(post.publish_date.year):
-                post_archive[post.publish_date.year] = {}
-            if not post_archive[post.publish_date.year].has_key(post.publish_date.month):
-                post_archive[post.publish_date.year][post.publish_date.month] = {}
-            if not post_archive[post.publish_date.year][post.publish_date.month].has_key(post.publish_date.day):
-                post_archive[post.publish_date.year][post.publish_date.month][post.publish_date.day] = []
-            post_archive[post.publish_date.year][post.publish_date.month][post.publish_date.day].append(post)
-
-        # Now that all of that lifting is done, convert the dictionaries into tuples with lists
-        sorted_years = [(k,[]) for k in sorted(post_archive.keys(),
-            reverse=True)]
-        for sorted_year in sorted_years:
-            sorted_months = [(k,[]) for k in sorted(post_archive[sorted_year[0]],
-                reverse=True)]
-            sorted_year[1].extend(sorted_months)
-            for sorted_month in sorted_months:
-                sorted_days = [(k,[]) for k in sorted(
-                    post_archive[sorted_year[0]][sorted_month[0]], reverse=True)]
-                sorted_month[1].extend(sorted_days)
-                for sorted_day in sorted_days:
-                    sorted_day[1].extend(
-                        post_archive[sorted_year[0]][sorted_month[0]][sorted_day[0]])
-            
-        return sorted_years
+        entries = self._get_archive_entry_model().objects.build_query(
+            require_published=require_published, year=year, month=month,
+            category_slug=category_slug, tag=tag,
+            require_featured=require_featured)
+        post_archive = []
+        for entry in entries.order_by('-publish_date'):
+            if not post_archive or post_archive[-1][0] != entry.year:
+                post_archive.append((entry.year, []))
+            months = post_archive[-1][1]
+            if not months or months[-1][0] != entry.month:
+                months.append((entry.month, []))
+            days = months[-1][1]
+            if not days or days[-1][0] != entry.day:
+                days.append((entry.day, []))
+            days[-1][1].append(entry)
+        return post_archive
+
+    def get_post_archive_counts(self, require_published=True, year=None,
+        month=None, category_slug=None, tag=None, require_featured=False):
+        """
+        Return Post Archive counts
+        
+        Post archive counts are a tuple of (year, count, months[]),
+        each month containing a tuple of (month, count, days[]),
+        each day containing a tuple of (day, count)
+        
+        """
+        entries = self._get_archive_entry_model().objects.build_query(
+            require_published=require_published, year=year, month=month,
+            category_slug=category_slug, tag=tag,
+            require_featured=require_featured)
+        counts = entries.values('year', 'month', 'day').annotate(
+            count=models.Count('id')).order_by('-year', '-month', '-day')
+        archive_counts = []
+        for row in counts:
+            if not archive_counts or archive_counts[-1][0] != row['year']:
+                archive_counts.append([row['year'], 0, []])
+            months = archive_counts[-1][2]
+            if not months or months[-1][0] != row['month']:
+                months.append([row['month'], 0, []])
+            months[-1][2].append((row['day'], row['count']))
+            months[-1][1] += row['count']
+            archive_counts[-1][1] += row['count']
+        return [(y, yc, [(m, mc, days) for m, mc, days in months])
+            for y, yc, months in archive_counts]
+
+    def _get_archive_entry_model(self):
+        return models.get_model(self.model._meta.app_label, 'PostArchiveEntry')
     
     @classmethod
     def get_tags_in_use(cls):
@@ -124,10 +402,452 @@ class PostManager(models.Manager):
             ).values('tag_id')
         )
 
+instrument_methods(PostManager, ('build_query', 'get_visible_as_of',
+    'get_latest_publish_date', 'attach_tags', 'attach_categories',
+    'get_published_posts', 'get_featured_posts', 'get_post_archive',
+    'get_post_archive_counts'), 'manager.PostManager')
+
 class PublishedPostManager(PostManager):
     """
     Published Post Manager
     """
     def get_query_set(self):
         return super(PublishedPostManager, self).get_query_set().filter(is_published=True)
-    
\ No newline at end of file
+    
+
+class PostArchiveEntryManager(models.Manager):
+    """
+    Post Archive Entry Manager
+    """
+    def build_query(self, require_published=True, year=None, month=None,
+        category_slug=None, tag=None, require_featured=False):
+        """
+        Build an archive entry query for the same filters as
+        PostManager.build_query
+        """
+        entries = self.get_query_set()
+        if require_published:
+            entries = entries.filter(is_published=True,
+                publish_date__lt=models.get_model(self.model._meta.app_label,
+                    'Post').objects.get_visible_as_of())
+        if require_featured == True:
+            entries = entries.filter(is_featured=True)
+        if year:
+            try:
+                start, end = get_date_range(year, month or None)
+            except ValueError:
+                return entries.none()
+            entries = entries.filter(publish_date__gte=start,
+                publish_date__lt=end)
+        if category_slug:
+            entries = entries.filter(category__slug=category_slug)
+        else:
+            entries = entries.filter(category__isnull=True)
+        # tag archives are served by the tag posting lists
+        for tag_name in get_tag_names(tag):
+            entries = entries.filter(post__tag_postings__tag=tag_name)
+        return entries
+
+    def update_for_post(self, post):
+        """
+        Replace the archive entries of a post, inserting them in one
+        statement
+        """
+        self.get_query_set().filter(post=post).delete()
+        entry = dict(post_id=post.pk, title=post.title, slug=post.slug,
+            publish_date=post.publish_date, year=post.publish_date.year,
+            month=post.publish_date.month, day=post.publish_date.day,
+            is_published=post.is_published, is_featured=post.is_featured)
+        bulk_insert(self.model, [self.model(category_id=category_id,
+            **entry) for category_id in [None] + list(
+            post.categories.values_list('pk', flat=True))])
+
+    def remove_categories(self, post):
+        """
+        Delete the category archive entries of a post
+        """
+        self.get_query_set().filter(post=post,
+            category__isnull=False).delete()
+
+    def rebuild(self):
+        """
+        Rebuild the archive entries of every post
+        """
+        self.get_query_set().delete()
+        post_model = models.get_model(self.model._meta.app_label, 'Post')
+        for post in post_model.objects.all().iterator():
+            self.update_for_post(post)
+
+class TagPostingManager(models.Manager):
+    """
+    Tag Posting Manager
+    """
+    def update_for_post(self, post):
+        """
+        Replace the tag postings of a post
+
+        Returns the set of the names of the tags that were removed from or
+        posted to the post
+        """
+        postings = self.get_query_set().filter(post=post)
+        tags = set(postings.values_list('tag', flat=True))
+        postings.delete()
+        for tag in post.get_tag_names():
+            self.create(tag=tag, post=post, publish_date=post.publish_date,
+                is_published=post.is_published, is_featured=post.is_featured)
+            tags.add(tag)
+        return tags
+
+    def rebuild(self):
+        """
+        Rebuild the tag postings of every post
+        """
+        self.get_query_set().delete()
+        post_model = models.get_model(self.model._meta.app_label, 'Post')
+        for post in post_model.objects.all().iterator():
+            self.update_for_post(post)
+
+class TagUsageManager(models.Manager):
+    """
+    Tag Usage Manager
+
+    Tag usage counts only count visible published posts.  Counts are updated
+    for the tags of a post when it's saved or deleted, and for the tags of
+    scheduled posts once the visibility boundary passes their publish date.
+    """
+    def _get_posting_model(self):
+        return models.get_model(self.model._meta.app_label, 'TagPosting')
+
+    def _get_visible_as_of(self):
+        return models.get_model(self.model._meta.app_label, 'Post'
+            ).objects.get_visible_as_of()
+
+    def update_counts(self, tags=None):
+        """
+        Recount the published posts of the tags (every tag if None)
+        """
+        postings = self._get_posting_model().objects.filter(is_published=True,
+            publish_date__lt=self._get_visible_as_of())
+        usages = self.get_query_set()
+        if tags is not None:
+            tags = list(tags)
+            if not tags:
+                return
+            postings = postings.filter(tag__in=tags)
+            usages = usages.filter(tag__in=tags)
+        counts = dict(
+            postings.values_list('tag').annotate(models.Count('id')).order_by())
+        for usage in usages:
+            count = counts.pop(usage.tag, 0)
+            if not count:
+                usage.delete()
+            elif count != usage.count:
+                usage.count = count
+                usage.save()
+        for tag, count in counts.items():
+            self.create(tag=tag, count=count)
+        cache.delete(TAG_USAGE_CACHE_KEY)
+
+    def update_scheduled_counts(self):
+        """
+        Recount the tags of the scheduled posts that became visible since
+        the tags were last counted
+        """
+        visible_as_of = self._get_visible_as_of()
+        counted_as_of = cache.get(TAG_USAGE_COUNTED_CACHE_KEY)
+        if counted_as_of is None:
+            self.update_counts()
+        elif counted_as_of < visible_as_of:
+            self.update_counts(set(
+                self._get_posting_model().objects.filter(is_published=True,
+                    publish_date__gte=counted_as_of,
+                    publish_date__lt=visible_as_of
+                ).values_list('tag', flat=True)))
+        else:
+            return
+        cache.set(TAG_USAGE_COUNTED_CACHE_KEY, visible_as_of,
+            BLOG_TAG_USAGE_CACHE_TIMEOUT)
+
+    def rebuild(self):
+        """
+        Recount the published posts of every tag
+        """
+        cache.delete(TAG_USAGE_COUNTED_CACHE_KEY)
+        self.update_scheduled_counts()
+
+    def get_usage(self):
+        """
+        Return the tag usages of the tags with published posts
+        """
+        self.update_scheduled_counts()
+        usage = cache.get(TAG_USAGE_CACHE_KEY)
+        if usage is None:
+            usage = list(self.get_query_set())
+            cache.set(TAG_USAGE_CACHE_KEY, usage, BLOG_TAG_USAGE_CACHE_TIMEOUT)
+        return usage
+
+    def get_cloud(self, steps=4, distribution=LOGARITHMIC):
+        """
+        Return the tag usages of the tags with published posts, each with a
+        font_size between 1 and steps
+        """
+        return calculate_cloud(self.get_usage(), steps, distribution)
+
+class TaxonomyManager(models.Manager):
+    """
+    Taxonomy Manager
+
+    Base manager of the categories and series of posts.  Subclasses name the
+    model of visible published posts to annotate the taxonomies with
+    (post_model_name), its taxonomy field and its post id field.
+    """
+    cache_key = None
+    post_model_name = None
+    taxonomy_field = None
+    post_field = None
+
+    def get_annotated(self):
+        """
+        Return every category or series annotated with the number of its
+        visible published posts (post_count), and the publish date, title and
+        url of its latest one (latest_publish_date, latest_post_title and
+        latest_post_url)
+
+        The counts and latest publish dates are aggregated in one query and
+        the latest posts read in another, and cached until a post, category
+        or series changes or a scheduled post becomes visible.
+        """
+        visible_as_of = models.get_model(self.model._meta.app_label, 'Post'
+            ).objects.get_visible_as_of()
+        cached = cache.get(self.cache_key)
+        if cached is not None and cached[0] == visible_as_of:
+            return cached[1]
+
+        posts = models.get_model(self.model._meta.app_label,
+            self.post_model_name).objects.filter(is_published=True,
+            publish_date__lt=visible_as_of,
+            **{'%s__isnull' % self.taxonomy_field: False})
+        counts = dict([(row[self.taxonomy_field], row)
+            for row in posts.values(self.taxonomy_field).annotate(
+            post_count=models.Count(self.post_field),
+            latest_publish_date=models.Max('publish_date')).order_by()])
+        latest_posts = {}
+        if counts:
+            # the posts published on a latest publish date, of which the one
+            # with the highest id is the latest
+            for taxonomy_id, publish_date, title, slug in posts.filter(**{
+                '%s__in' % self.taxonomy_field: counts.keys(),
+                'publish_date__in': set([row['latest_publish_date']
+                    for row in counts.values()])}).order_by(
+                'publish_date', self.post_field).values_list(
+                self.taxonomy_field, 'publish_date', 'title', 'slug'):
+                if publish_date == counts[taxonomy_id]['latest_publish_date']:
+                    latest_posts[taxonomy_id] = (title, slug)
+
+        taxonomies = list(self.get_query_set())
+        for taxonomy in taxonomies:
+            row = counts.get(taxonomy.pk, {})
+            taxonomy.post_count = row.get('post_count', 0)
+            publish_date = taxonomy.latest_publish_date = row.get(
+                'latest_publish_date')
+            taxonomy.latest_post_title, taxonomy.latest_post_slug = \
+                latest_posts.get(taxonomy.pk, (None, None))
+            taxonomy.latest_post_url = None
+            if publish_date is not None:
+                taxonomy.latest_post_url = reverse('blog.views.post_detail',
+                    args=['%04d' % publish_date.year,
+                        '%02d' % publish_date.month,
+                        '%02d' % publish_date.day,
+                        taxonomy.latest_post_slug,])
+        cache.set(self.cache_key, (visible_as_of, taxonomies),
+            BLOG_TAXONOMY_CACHE_TIMEOUT)
+        return taxonomies
+
+    def reset_annotated(self):
+        """
+        Forget the cached annotated categories or series
+        """
+        cache.delete(self.cache_key)
+
+class CategoryManager(TaxonomyManager):
+    """
+    Category Manager
+
+    Categories are annotated from the post archive entries, which hold a
+    row per post and category.
+    """
+    cache_key = CATEGORY_CACHE_KEY
+    post_model_name = 'PostArchiveEntry'
+    taxonomy_field = 'category'
+    post_field = 'post'
+
+class SeriesManager(TaxonomyManager):
+    """
+    Series Manager
+    """
+    cache_key = SERIES_CACHE_KEY
+    post_model_name = 'Post'
+    taxonomy_field = 'series'
+    post_field = 'id'
+
+class LastChangeManager(models.Manager):
+    """
+    Last Change Manager
+    """
+    def touch(self, *scopes):
+        """
+        Record a change of the scopes
+        """
+        now = datetime.now()
+        for scope in scopes:
+            if not self.get_query_set().filter(scope=scope).update(
+                changed_on=now):
+                self.get_or_create(scope=scope, defaults={'changed_on': now})
+
+    def get_changed_on(self, *scopes):
+        """
+        Return when any of the scopes last changed, None if they never did
+        """
+        return self.get_query_set().filter(scope__in=scopes).aggregate(
+            models.Max('changed_on'))['changed_on__max']
+
+class PublishEventManager(models.Manager):
+    """
+    Publish Event Manager
+    """
+    def record(self, post=None):
+        """
+        Record a publish event, due when the post is visible
+        """
+        next_attempt_on = datetime.now()
+        if post is not None and post.publish_date > next_attempt_on:
+            next_attempt_on = post.publish_date
+        return self.create(post=post, next_attempt_on=next_attempt_on)
+
+    def record_once(self, post=None):
+        """
+        Record a publish event, unless an unprocessed one is already due by
+        the time the post is visible (the ping covers every post)
+        """
+        next_attempt_on = datetime.now()
+        if post is not None and post.publish_date > next_attempt_on:
+            next_attempt_on = post.publish_date
+        if self.get_query_set().filter(processed_on__isnull=True,
+            next_attempt_on__lte=next_attempt_on).exists():
+            return None
+        return self.record(post)
+
+    def get_pending(self):
+        """
+        Return the publish events that are due and weren't processed
+        """
+        return self.get_query_set().filter(processed_on__isnull=True,
+            next_attempt_on__lte=datetime.now())
+
+    def process(self, ping, debounce=BLOG_PING_DEBOUNCE,
+        max_delay=BLOG_PING_MAX_DELAY, max_attempts=BLOG_PING_MAX_ATTEMPTS,
+        retry_delay=BLOG_PING_RETRY_DELAY):
+        """
+        Ping once for all pending publish events
+
+        A burst of events is pinged once it has been quiet for debounce
+        seconds, or once its oldest event has waited max_delay seconds.
+        Failed pings are retried after retry_delay seconds, doubling with
+        every attempt; events are given up on (processed, with their
+        last_error) after max_attempts.
+
+        Returns the number of events that were pinged
+        """
+        now = datetime.now()
+        events = list(self.get_pending())
+        if not events:
+            return 0
+        newest = max([event.next_attempt_on for event in events])
+        oldest = min([event.next_attempt_on for event in events])
+        if newest > now - timedelta(seconds=debounce) \
+            and oldest > now - timedelta(seconds=max_delay):
+            return 0
+        try:
+            ping()
+        except Exception as e:
+            for event in events:
+                event.attempts += 1
+                event.last_error = unicode(e) or e.__class__.__name__
+                if event.attempts >= max_attempts:
+                    event.processed_on = now
+                else:
+                    event.next_attempt_on = now + timedelta(
+                        seconds=retry_delay * 2 ** (event.attempts - 1))
+                event.save()
+            return 0
+        self.get_query_set().filter(pk__in=[event.pk for event in events]
+            ).update(processed_on=now, last_error='')
+        return len(events)
+
+class ImageBlobManager(models.Manager):
+    """
+    Image Blob Manager
+    """
+    def record(self, name, content_hash, size):
+        """
+        Record that a blob was saved
+        """
+        now = datetime.now()
+        if not self.get_query_set().filter(name=name).update(saved_on=now):
+            blob, created = self.get_or_create(name=name,
+                defaults={'content_hash': content_hash, 'size': size,
+                'saved_on': now})
+
+    def add_reference(self, name):
+        """
+        Count a post image referring to a blob (names that aren't blobs are
+        ignored)
+        """
+        self.get_query_set().filter(name=name).update(
+            reference_count=models.F('reference_count') + 1)
+
+    def remove_reference(self, name):
+        """
+        Stop counting a post image referring to a blob
+        """
+        self.get_query_set().filter(name=name, reference_count__gt=0).update(
+            reference_count=models.F('reference_count') - 1)
+
+    def delete_unreferenced(self, pk, saved_before):
+        """
+        Delete a blob's row if no post image refers to it and it was saved
+        before a datetime, checked in the DELETE statement itself
+
+        Returns whether the row was deleted.
+        """
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE %s = %%s AND %s = 0 AND '
+            '%s < %%s' % (qn(self.model._meta.db_table),
+            qn(self.model._meta.pk.column), qn('reference_count'),
+            qn('saved_on')),
+            (pk, connection.ops.value_to_db_datetime(saved_before)))
+        transaction.commit_unless_managed()
+        return cursor.rowcount > 0
+
+    def recount(self, batch_size=1000):
+        """
+        Recount the post images referring to every blob, in batches
+        """
+        image_model = models.get_model(self.model._meta.app_label,
+            'PostImage')
+        last_pk = 0
+        while True:
+            blobs = list(self.get_query_set().filter(pk__gt=last_pk).order_by(
+                'pk').values_list('pk', 'name', 'reference_count')[
+                :batch_size])
+            if not blobs:
+                return
+            last_pk = blobs[-1][0]
+            counts = dict(image_model.objects.filter(
+                image__in=[name for pk, name, count in blobs]).values_list(
+                'image').annotate(models.Count('id')).order_by())
+            for pk, name, count in blobs:
+                if counts.get(name, 0) != count:
+                    self.get_query_set().filter(pk=pk).update(
+                        reference_count=counts.get(name, 0))
@@ -0,0 +1,52 @@
+"""
+Request scoped memoization
+
+The blog context processors and template tags memoize their lookups for the
+duration of a request, keyed by the lookup's arguments and whether the user
+is staff, so a lookup repeated by several included templates only hits the
+database once.  The memo is kept on the request, and put in the template
+context (as blog_memo) by the blog context processors so that the template
+tags find it too.
+"""
+MEMO_CONTEXT_NAME = 'blog_memo'
+
+def get_memo(request):
+    """
+    Get the memo of a request
+    """
+    memo = getattr(request, '_blog_memo', None)
+    if memo is None:
+        memo = request._blog_memo = {}
+    return memo
+
+def get_context_memo(context):
+    """
+    Get the memo of the request a template context is rendered for
+
+    The request is found through the blog context processors or the
+    request context processor; otherwise the memo lasts for the render.
+    """
+    memo = context.get(MEMO_CONTEXT_NAME)
+    if memo is None:
+        request = context.get('request')
+        if request is not None:
+            memo = get_memo(request)
+        else:
+            memo = {}
+        # the bottom dictionary outlives the template tags' pushes and pops
+        context.dicts[0][MEMO_CONTEXT_NAME] = memo
+    return memo
+
+def memoize(memo, key, function, *args, **kwargs):
+    """
+    Return function(*args, **kwargs), memoized under key
+
+    Lookups whose key isn't hashable aren't memoized.
+    """
+    try:
+        return memo[key]
+    except KeyError:
+        value = memo[key] = function(*args, **kwargs)
+        return value
+    except TypeError:
+        return function(*args, **kwargs)
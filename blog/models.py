@@ -4,16 +4,22 @@ from django.db import models
 from django.contrib.comments.models import Comment
 from django.contrib.auth.models import User
 from django.contrib.contenttypes import generic
-from django.contrib.sitemaps import ping_google
 from django.contrib.comments.moderation import CommentModerator, moderator
 from django.db.models import permalink
 
 from tagging.models import Tag, TaggedItem
 from tagging.fields import TagField
+from tagging.utils import parse_tag_input
 
 from django.conf import settings
+from django.core.files.storage import default_storage
 
-from managers import PostManager, PublishedPostManager, PostImageManager
+from managers import PostManager, PublishedPostManager, PostImageManager, \
+    PostArchiveEntryManager, TagPostingManager, TagUsageManager, \
+    LastChangeManager, PublishEventManager, CategoryManager, SeriesManager, \
+    ImageBlobManager
+from settings import BLOG_CONTENT_ADDRESSED_IMAGES
+from storage import ContentAddressedStorage
 
 class Series(models.Model):
     """
@@ -25,6 +31,8 @@ class Series(models.Model):
     preface = models.TextField(blank=True)
     created_on = models.DateTimeField(default=datetime.now)
     
+    objects = SeriesManager()
+    
     @models.permalink
     def get_absolute_url(self):
         return ('blog.views.series_detail', [self.slug,])
@@ -45,6 +53,8 @@ class Category(models.Model):
     slug = models.SlugField(unique=True)
     summary = models.TextField(blank=True)
 
+    objects = CategoryManager()
+
     @models.permalink
     def get_absolute_url(self):
         return ('blog.views.category_detail', [self.slug,])
@@ -80,6 +90,18 @@ class Post(models.Model):
     content = models.TextField()    
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    comments_updated_on = models.DateTimeField(blank=True, null=True,
+        editable=False)
+    # neighbor pointers among the published posts, maintained by
+    # blog.neighbors
+    previous_post = models.ForeignKey('self', blank=True, null=True,
+        editable=False, on_delete=models.SET_NULL, related_name='+')
+    next_post = models.ForeignKey('self', blank=True, null=True,
+        editable=False, on_delete=models.SET_NULL, related_name='+')
+    previous_in_series = models.ForeignKey('self', blank=True, null=True,
+        editable=False, on_delete=models.SET_NULL, related_name='+')
+    next_in_series = models.ForeignKey('self', blank=True, null=True,
+        editable=False, on_delete=models.SET_NULL, related_name='+')
     
     comments = generic.GenericRelation(Comment, object_id_field="object_pk")
     
@@ -94,25 +116,21 @@ class Post(models.Model):
     objects = PostManager()
     published = PublishedPostManager()
     
+    def __init__(self, *args, **kwargs):
+        super(Post, self).__init__(*args, **kwargs)
+        # remember the loaded publish state, so publishing is detected without
+        # reloading the post (deferred fields aren't in __dict__)
+        self._was_published = self.__dict__.get('is_published', False) \
+            and self.pk is not None
+
     def save(self, *args, **kwargs):
-        if (
-            getattr(settings, 'BLOG_PING_GOOGLE', False) == True) \
-            and (getattr(settings, 'DEBUG', True) == False):
-            if self.is_published \
-                and self.publish_date <= datetime.now():
-                if not self.pk:
-                    try:
-                        ping_google()
-                    except:
-                        pass
-                else:
-                    old_post = Post.objects.get(pk=self.pk)
-                    if old_post.is_published == False:
-                        try:
-                            ping_google()
-                        except:
-                            pass
         super(Post, self).save(*args, **kwargs)
+        if self.is_published and not self._was_published \
+            and (getattr(settings, 'BLOG_PING_GOOGLE', False) == True) \
+            and (getattr(settings, 'DEBUG', True) == False):
+            # pinged by blog_process_publish_events once it's visible
+            PublishEvent.objects.record(self)
+        self._was_published = self.is_published
 
     class Meta:
         ordering = ('-publish_date',)
@@ -124,27 +142,100 @@ class Post(models.Model):
         else:
             return '%s (DRAFT)' % (self.title,)
 
+    @property
+    def category_list(self):
+        """
+        Return the post categories
+
+        Categories attached in bulk by PostQuerySet.with_categories are used
+        when available
+        """
+        if not hasattr(self, '_category_list_cache'):
+            Post.objects.attach_categories([self,])
+        return self._category_list_cache
+
     @property
     def post_categories_string(self):
         """
         Return the post categories in string format
         """
-        return ', '.join([c.title for c in self.categories.all()])
+        return ', '.join([c.title for c in self.category_list])
             
     
+    @property
+    def tag_list(self):
+        """
+        Return the post tags, each with its blog url in tag.blog_url
+
+        Tags attached in bulk by PostQuerySet.with_tags are used when
+        available
+        """
+        if not hasattr(self, '_tag_list_cache'):
+            Post.objects.attach_tags([self,])
+        return self._tag_list_cache
+
+    def get_related_posts(self, limit=None):
+        """
+        Get the published related posts, best match first
+        """
+        posts = Post.objects.build_query(require_published=True).filter(
+            related_to__post=self).order_by('-related_to__score')
+        if limit:
+            posts = posts[:limit]
+        return posts
+
+    def get_tag_names(self):
+        """
+        Return the post tag names parsed from the tag field
+        """
+        return parse_tag_input(self.tags)
+
+    def _get_visible_neighbor(self, post):
+        if post is None or post.publish_date >= \
+            Post.objects.get_visible_as_of():
+            raise Post.DoesNotExist
+        return post
+    
     def get_previous_post(self):
         """
         Get the previous post by publish_date
         """
-        return self.get_previous_by_publish_date(is_published=True,
-            publish_date__lt=datetime.now)
+        return self._get_visible_neighbor(self.previous_post)
  
     def get_next_post(self):
         """
         Get the next post by publish_date
         """
-        return self.get_next_by_publish_date(is_published=True,
-            publish_date__lt=datetime.now)
+        return self._get_visible_neighbor(self.next_post)
+    
+    def get_previous_post_in_series(self):
+        """
+        Get the previous post in the post's series by publish_date
+        """
+        return self._get_visible_neighbor(self.previous_in_series)
+    
+    def get_next_post_in_series(self):
+        """
+        Get the next post in the post's series by publish_date
+        """
+        return self._get_visible_neighbor(self.next_in_series)
+    
+    def get_category_neighbors(self):
+        """
+        Get the post's neighbors within each of its categories
+        
+        Returns a list of PostNeighbor, with previous and next set to None
+        where there is no visible neighbor.  Requires BLOG_CATEGORY_NEIGHBORS.
+        """
+        visible_as_of = Post.objects.get_visible_as_of()
+        neighbors = list(self.category_neighbors.select_related(
+            'category', 'previous', 'next'))
+        for neighbor in neighbors:
+            for name in ('previous', 'next'):
+                post = getattr(neighbor, name)
+                if post is not None and post.publish_date >= visible_as_of:
+                    setattr(neighbor, name, None)
+        return neighbors
     
 class PublishedPost(Post):
     """
@@ -166,19 +257,297 @@ class PostImage(models.Model):
         upload_to=lambda i,fn:'/'.join(
             ['apps', 'blogyall', 'images',
              i.post.publish_date.strftime('%Y-%m-%d'), i.post.slug, fn]
-        ))
+        ),
+        storage=BLOG_CONTENT_ADDRESSED_IMAGES and ContentAddressedStorage() \
+            or None)
     gallery_position = models.PositiveIntegerField(blank=True, null=True,
         help_text="Post Images without a Gallery Position will not appear in " \
         "the post's gallery images")
     
     objects = PostImageManager()
     
+    def __init__(self, *args, **kwargs):
+        super(PostImage, self).__init__(*args, **kwargs)
+        # remember the loaded image, so renditions are only regenerated when
+        # it changes (deferred fields aren't in __dict__)
+        image = self.__dict__.get('image')
+        self._rendered_image_name = self.pk is not None \
+            and getattr(image, 'name', image) or None
+        # and the image whose blob reference is counted
+        self._counted_image_name = self._rendered_image_name
+
     def __unicode__(self):
         return self.title
     
+    @property
+    def rendition_list(self):
+        """
+        Return the image renditions, narrowest first
+
+        Renditions attached in bulk by PostImageManager.attach_renditions
+        are used when available
+        """
+        if not hasattr(self, '_rendition_list_cache'):
+            PostImage.objects.attach_renditions([self,])
+        return self._rendition_list_cache
+
+    def get_srcset(self, format):
+        """
+        Return the srcset attribute value of the renditions in a format
+        """
+        return ', '.join(['%s %dw' % (rendition.url, rendition.width)
+            for rendition in self.rendition_list
+            if rendition.format == format])
+
     class Meta:
         ordering = ('post', 'gallery_position', 'title',)
 
+class ImageRendition(models.Model):
+    """
+    Image Rendition
+
+    A resized copy of a post image in one width and format, generated by
+    blog.renditions.  The stored file is named by the content hash of the
+    original, so identical images share their renditions.
+    """
+    image = models.ForeignKey(PostImage, related_name='renditions')
+    format = models.CharField(max_length=10)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    name = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ('image', 'width', 'format',)
+        unique_together = (('image', 'format', 'width'),)
+
+    def __unicode__(self):
+        return self.name
+
+    @property
+    def url(self):
+        return default_storage.url(self.name)
+
+class ImageBlob(models.Model):
+    """
+    Image Blob
+
+    A post image upload stored by blog.storage.ContentAddressedStorage, with
+    the number of post images referring to it
+    """
+    name = models.CharField(max_length=255, unique=True)
+    content_hash = models.CharField(max_length=40, db_index=True)
+    size = models.PositiveIntegerField()
+    reference_count = models.PositiveIntegerField(default=0, db_index=True)
+    saved_on = models.DateTimeField(default=datetime.now)
+
+    objects = ImageBlobManager()
+
+    def __unicode__(self):
+        return u'%s: %d references' % (self.name, self.reference_count)
+
+class PostArchiveEntry(models.Model):
+    """
+    Post Archive Entry
+
+    Denormalized archive index row.  Every post gets one entry for the
+    archive of all posts and one entry per category, so that an archive can
+    be read without loading the posts.  Tag archives join the entries with
+    the tag posting lists.  Entries are maintained by the signal handlers in
+    blog.signals.
+    """
+    post = models.ForeignKey(Post, related_name='archive_entries')
+    category = models.ForeignKey(Category, blank=True, null=True,
+        related_name='archive_entries')
+    title = models.CharField(max_length=255)
+    slug = models.SlugField()
+    publish_date = models.DateTimeField(db_index=True)
+    year = models.PositiveIntegerField()
+    month = models.PositiveIntegerField()
+    day = models.PositiveIntegerField()
+    is_published = models.BooleanField()
+    is_featured = models.BooleanField()
+
+    objects = PostArchiveEntryManager()
+
+    class Meta:
+        ordering = ('-publish_date',)
+        verbose_name_plural = 'post archive entries'
+
+    @models.permalink
+    def get_absolute_url(self):
+        return ('blog.views.post_detail', [
+            '%04d' % self.year,
+            '%02d' % self.month,
+            '%02d' % self.day,
+            self.slug,])
+
+    def __unicode__(self):
+        if self.is_published:
+            return self.title
+        else:
+            return '%s (DRAFT)' % (self.title,)
+
+class TagPosting(models.Model):
+    """
+    Tag Posting
+
+    Denormalized tag -> post posting list row, ordered by publish date.
+    Tag filtered post queries read these instead of joining django-tagging's
+    generic TaggedItem table.  Postings are maintained by the signal
+    handlers in blog.signals.
+    """
+    tag = models.CharField(max_length=255, db_index=True)
+    post = models.ForeignKey(Post, related_name='tag_postings')
+    publish_date = models.DateTimeField(db_index=True)
+    is_published = models.BooleanField()
+    is_featured = models.BooleanField()
+
+    objects = TagPostingManager()
+
+    class Meta:
+        ordering = ('tag', '-publish_date',)
+        unique_together = (('tag', 'post'),)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.tag, self.post_id)
+
+class TagUsage(models.Model):
+    """
+    Tag Usage
+
+    Number of published posts per tag, maintained by the signal handlers in
+    blog.signals
+    """
+    tag = models.CharField(max_length=255, unique=True)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = TagUsageManager()
+
+    class Meta:
+        ordering = ('tag',)
+
+    @property
+    def name(self):
+        return self.tag
+
+    @models.permalink
+    def get_absolute_url(self):
+        return ('blog.views.tag_detail', (), {'tag': self.tag})
+
+    def __unicode__(self):
+        return self.tag
+
+class LastChange(models.Model):
+    """
+    Last Change
+
+    When the posts, categories, series or comments (the scope) last changed,
+    maintained by the signal handlers in blog.signals
+    """
+    scope = models.CharField(max_length=50, unique=True)
+    changed_on = models.DateTimeField(default=datetime.now)
+
+    objects = LastChangeManager()
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.scope, self.changed_on)
+
+class PublishEvent(models.Model):
+    """
+    Publish Event
+
+    Outbox of post publishing, pinged to the search engine (in debounced
+    batches, with retries) by the blog_process_publish_events management
+    command
+    """
+    post = models.ForeignKey(Post, blank=True, null=True,
+        on_delete=models.SET_NULL, related_name='publish_events')
+    created_on = models.DateTimeField(default=datetime.now)
+    next_attempt_on = models.DateTimeField(default=datetime.now,
+        db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    processed_on = models.DateTimeField(blank=True, null=True, db_index=True)
+    last_error = models.TextField(blank=True)
+
+    objects = PublishEventManager()
+
+    class Meta:
+        ordering = ('created_on',)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.created_on, self.post_id)
+
+class SearchDocument(models.Model):
+    """
+    Search Document
+
+    The indexed length of a post, maintained by blog.search
+    """
+    post = models.OneToOneField(Post, related_name='search_document')
+    length = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.post_id, self.length)
+
+class SearchPosting(models.Model):
+    """
+    Search Posting
+
+    Inverted search index row: the weighted frequency and the token
+    positions of a term in a post's search document, maintained by
+    blog.search
+    """
+    term = models.CharField(max_length=100, db_index=True)
+    document = models.ForeignKey(SearchDocument, related_name='postings')
+    frequency = models.PositiveIntegerField(default=0)
+    positions = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = (('term', 'document'),)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.term, self.document_id)
+
+class RelatedPost(models.Model):
+    """
+    Related Post
+
+    One of the top scoring related posts of a post, maintained by
+    blog.related
+    """
+    post = models.ForeignKey(Post, related_name='related_posts')
+    related = models.ForeignKey(Post, related_name='related_to')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ('post', '-score',)
+        unique_together = (('post', 'related'),)
+
+    def __unicode__(self):
+        return u'%s: %s (%s)' % (self.post_id, self.related_id, self.score)
+
+class PostNeighbor(models.Model):
+    """
+    Post Neighbor
+    
+    The previous and next published posts of a post within one of its
+    categories, maintained by blog.neighbors when BLOG_CATEGORY_NEIGHBORS is
+    enabled
+    """
+    post = models.ForeignKey(Post, related_name='category_neighbors')
+    category = models.ForeignKey(Category, related_name='post_neighbors')
+    previous = models.ForeignKey(Post, blank=True, null=True,
+        on_delete=models.SET_NULL, related_name='+')
+    next = models.ForeignKey(Post, blank=True, null=True,
+        on_delete=models.SET_NULL, related_name='+')
+
+    class Meta:
+        unique_together = (('post', 'category'),)
+
+    def __unicode__(self):
+        return u'%s in %s: %s, %s' % (self.post_id, self.category_id,
+            self.previous_id, self.next_id)
+
 class PostModerator(CommentModerator):
     """
     Blog post comment moderator
@@ -193,3 +562,6 @@ class PostModerator(CommentModerator):
         close_after=getattr(settings, 'BLOG_COMMENTS_CLOSE_AFTER', None)
 
 moderator.register(Post, PostModerator)
+
+# connect the denormalized index signal handlers
+import signals
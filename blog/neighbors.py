@@ -0,0 +1,298 @@
+"""
+Previous and next post pointers
+
+Every post points to its neighbors among the published posts, ordered by
+publish date and then id: globally (Post.previous_post and next_post),
+within its series (previous_in_series and next_in_series) and, with
+BLOG_CATEGORY_NEIGHBORS, within each of its categories (PostNeighbor).
+Scheduled posts are linked like any other published post; the Post getters
+hide neighbors that aren't visible yet.
+
+The pointers are updated by the signal handlers in blog.signals and rebuilt
+by the blog_rebuild_indexes management command.
+"""
+from bisect import bisect_left
+
+from django.db.models import Q
+
+from models import Post, PostNeighbor
+from managers import bulk_insert
+from settings import BLOG_CATEGORY_NEIGHBORS
+
+# pointer field, and the field of the neighbor that points back
+POINTERS = (
+    ('previous_post', 'next_post'),
+    ('next_post', 'previous_post'),
+    ('previous_in_series', 'next_in_series'),
+    ('next_in_series', 'previous_in_series'),
+)
+POINTER_FIELDS = [name for name, back in POINTERS]
+
+def get_key_filter(lookup, publish_date, pk, prefix=''):
+    """
+    Get a Q of the posts whose (publish date, id) key is lt, lte, gt or gte
+    (the lookup) a key; prefix is the lookup path to the post
+    """
+    return Q(**{'%spublish_date__%s' % (prefix, lookup[:2]): publish_date}) \
+        | Q(**{'%spublish_date' % prefix: publish_date,
+        '%spk__%s' % (prefix, lookup): pk})
+
+def get_gaps(post, previous, next, publish_dates, prefix=''):
+    """
+    Get Qs of the posts from the previous neighbor of a post up to the post,
+    and from the post up to its next neighbor, given the publish dates of
+    the neighbors
+
+    Drafts in these gaps point to the neighbors around the post, like the
+    neighbors themselves.
+    """
+    before = get_key_filter('lt', post.publish_date, post.pk, prefix)
+    if previous:
+        before &= get_key_filter('gte', publish_dates[previous], previous,
+            prefix)
+    after = get_key_filter('gt', post.publish_date, post.pk, prefix)
+    if next:
+        after &= get_key_filter('lte', publish_dates[next], next, prefix)
+    return before, after
+
+def get_publish_dates(pks):
+    """
+    Get a dictionary of post id: publish date of a list of post ids
+    """
+    pks = [pk for pk in pks if pk]
+    if not pks:
+        return {}
+    return dict(Post.objects.filter(pk__in=pks).values_list('pk',
+        'publish_date'))
+
+def get_neighbors(pk, publish_date, posts):
+    """
+    Get the ids of the posts before and after a post in a queryset of posts
+    """
+    posts = posts.exclude(pk=pk)
+    previous = list(posts.filter(Q(publish_date__lt=publish_date) |
+        Q(publish_date=publish_date, pk__lt=pk)).order_by(
+        '-publish_date', '-pk').values_list('pk', flat=True)[:1])
+    next = list(posts.filter(Q(publish_date__gt=publish_date) |
+        Q(publish_date=publish_date, pk__gt=pk)).order_by(
+        'publish_date', 'pk').values_list('pk', flat=True)[:1])
+    return previous and previous[0] or None, next and next[0] or None
+
+def link_post(post):
+    """
+    Recompute the global and series pointers of a post (or post id)
+
+    Returns a dictionary of pointer field: post id
+    """
+    if not isinstance(post, Post):
+        try:
+            post = Post.objects.get(pk=post)
+        except Post.DoesNotExist:
+            return {}
+    published = Post.objects.filter(is_published=True)
+    pointers = dict(zip(('previous_post', 'next_post'),
+        get_neighbors(post.pk, post.publish_date, published)))
+    series = (None, None)
+    if post.series_id:
+        series = get_neighbors(post.pk, post.publish_date,
+            published.filter(series=post.series_id))
+    pointers.update(zip(('previous_in_series', 'next_in_series'), series))
+    Post.objects.filter(pk=post.pk).update(**pointers)
+    for name, pk in pointers.items():
+        setattr(post, '%s_id' % name, pk)
+        post.__dict__.pop('_%s_cache' % name, None)
+    return pointers
+
+def link_category(post, category_id):
+    """
+    Recompute the neighbors of a post within one of its categories
+
+    Returns the ids of the previous and next posts
+    """
+    previous, next = get_neighbors(post.pk, post.publish_date,
+        Post.objects.filter(is_published=True, categories=category_id))
+    if not PostNeighbor.objects.filter(post=post.pk,
+        category=category_id).update(previous=previous, next=next):
+        PostNeighbor.objects.create(post_id=post.pk, category_id=category_id,
+            previous_id=previous, next_id=next)
+    return previous, next
+
+def link_categories(post):
+    """
+    Recompute the neighbors of a post within each of its categories
+
+    Returns a dictionary of category id: (previous id, next id)
+    """
+    category_ids = list(post.categories.values_list('pk', flat=True))
+    PostNeighbor.objects.filter(post=post.pk).exclude(
+        category__in=category_ids).delete()
+    return dict([(category_id, link_category(post, category_id))
+        for category_id in category_ids])
+
+def relink_categories(stale):
+    """
+    Recompute a set of (post id, category id) category neighbors
+    """
+    posts = Post.objects.in_bulk(set([pk for pk, category_id in stale]))
+    for pk, category_id in stale:
+        if pk in posts:
+            link_category(posts[pk], category_id)
+
+def get_pointing_posts(post):
+    """
+    Get what points to a post: the ids of the posts pointing to it, and the
+    (post id, category id) pairs of the category neighbors pointing to it
+    """
+    pointing = Q()
+    for name in POINTER_FIELDS:
+        pointing |= Q(**{name: post.pk})
+    post_ids = set(Post.objects.filter(pointing).values_list('pk', flat=True))
+    categories = set()
+    if BLOG_CATEGORY_NEIGHBORS:
+        categories = set(PostNeighbor.objects.filter(
+            Q(previous=post.pk) | Q(next=post.pk)).values_list(
+            'post', 'category'))
+    return post_ids, categories
+
+def update_category_neighbors(post):
+    """
+    Update the category neighbors affected by a post whose publish state,
+    publish date or categories changed
+    """
+    if not BLOG_CATEGORY_NEIGHBORS:
+        return
+    stale = set(PostNeighbor.objects.filter(
+        Q(previous=post.pk) | Q(next=post.pk)).values_list(
+        'post', 'category'))
+    category_neighbors = link_categories(post)
+    if post.is_published:
+        publish_dates = get_publish_dates(sum(category_neighbors.values(),
+            ()))
+        for category_id, (previous, next) in category_neighbors.items():
+            before, after = get_gaps(post, previous, next, publish_dates,
+                'post__')
+            neighbors = PostNeighbor.objects.filter(category=category_id)
+            neighbors.filter(before).update(next=post.pk)
+            neighbors.filter(after).update(previous=post.pk)
+    relink_categories(stale)
+
+def update_for_post(post):
+    """
+    Update the pointers affected by a saved post
+
+    The post is relinked and, if published, spliced in between its
+    neighbors, along with the drafts in between.  Posts that pointed to it
+    but no longer neighbor it are relinked.
+    """
+    stale = set()
+    pointing = Q()
+    for name in POINTER_FIELDS:
+        pointing |= Q(**{name: post.pk})
+    for row in Post.objects.filter(pointing).values_list(
+        'pk', *POINTER_FIELDS):
+        stale.update([(row[0], name)
+            for name, pk in zip(POINTER_FIELDS, row[1:]) if pk == post.pk])
+
+    pointers = link_post(post)
+    if post.is_published:
+        publish_dates = get_publish_dates(pointers.values())
+        sequences = [(Post.objects.all(), 'previous_post', 'next_post')]
+        if post.series_id:
+            sequences.append((Post.objects.filter(series=post.series_id),
+                'previous_in_series', 'next_in_series'))
+        for posts, previous_name, next_name in sequences:
+            previous, next = pointers[previous_name], pointers[next_name]
+            before, after = get_gaps(post, previous, next, publish_dates)
+            posts.filter(before).update(**{next_name: post.pk})
+            posts.filter(after).update(**{previous_name: post.pk})
+            stale.discard((previous, next_name))
+            stale.discard((next, previous_name))
+    for pk in set([pk for pk, name in stale]):
+        link_post(pk)
+    update_category_neighbors(post)
+
+def update_for_posts(posts):
+    """
+    Update the pointers affected by a list of posts whose publish state
+    changed at once (see blog.publishing.update_posts)
+
+    Each post is spliced in or out like a saved post, so only the posts
+    around the changed posts are read and written.
+    """
+    for post in posts:
+        update_for_post(post)
+
+def update_for_deleted_post(pointing):
+    """
+    Relink what pointed to a deleted post (see get_pointing_posts)
+    """
+    post_ids, categories = pointing
+    for pk in post_ids:
+        link_post(pk)
+    relink_categories(categories)
+
+def _get_sequence_neighbors(keys, key):
+    # the neighbors of a (publish date, id) key in a sorted list of keys,
+    # which may include the key itself
+    index = bisect_left(keys, key)
+    next_index = index
+    if index < len(keys) and keys[index] == key:
+        next_index += 1
+    return (index > 0 and keys[index - 1][1] or None,
+        next_index < len(keys) and keys[next_index][1] or None)
+
+def rebuild():
+    """
+    Rebuild the pointers and category neighbors of every post
+
+    The posts are read in one query and only the pointers that changed are
+    written.
+    """
+    posts = list(Post.objects.values_list('pk', 'publish_date', 'series',
+        'is_published', *POINTER_FIELDS))
+    published = []
+    series_published = {}
+    for pk, publish_date, series, is_published in [row[:4] for row in posts]:
+        if is_published:
+            published.append((publish_date, pk))
+            if series:
+                series_published.setdefault(series, []).append(
+                    (publish_date, pk))
+    published.sort()
+    for keys in series_published.values():
+        keys.sort()
+
+    keys_by_pk = {}
+    for row in posts:
+        pk, publish_date, series = row[:3]
+        key = keys_by_pk[pk] = (publish_date, pk)
+        pointers = _get_sequence_neighbors(published, key)
+        if series:
+            pointers += _get_sequence_neighbors(series_published.get(series,
+                []), key)
+        else:
+            pointers += (None, None)
+        if pointers != tuple(row[4:]):
+            Post.objects.filter(pk=pk).update(
+                **dict(zip(POINTER_FIELDS, pointers)))
+
+    PostNeighbor.objects.all().delete()
+    if not BLOG_CATEGORY_NEIGHBORS:
+        return
+    memberships = list(Post.categories.through.objects.values_list('post',
+        'category'))
+    category_published = {}
+    published_pks = set([pk for publish_date, pk in published])
+    for pk, category_id in memberships:
+        if pk in published_pks:
+            category_published.setdefault(category_id, []).append(
+                keys_by_pk[pk])
+    for keys in category_published.values():
+        keys.sort()
+    neighbors = []
+    for pk, category_id in memberships:
+        previous, next = _get_sequence_neighbors(
+            category_published.get(category_id, []), keys_by_pk[pk])
+        neighbors.append(PostNeighbor(post_id=pk, category_id=category_id,
+            previous_id=previous, next_id=next))
+    bulk_insert(PostNeighbor, neighbors)
@@ -0,0 +1,127 @@
+"""
+Keyset (cursor) pagination for post queries
+
+Pages are sought on (publish_date, id) instead of being sliced with an
+OFFSET, so every page costs the same no matter how deep it is.
+"""
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+
+from django.db.models import Q
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor token can't be decoded
+    """
+    pass
+
+def encode_cursor(post, direction):
+    """
+    Encode an opaque cursor token for a post
+
+    direction is 'n' to seek the posts after the post (older posts) or 'p'
+    to seek the posts before it (newer posts)
+    """
+    return encode_key(post.publish_date, post.pk, direction)
+
+def encode_key(publish_date, pk, direction):
+    """
+    Encode an opaque cursor token for a (publish_date, id) key
+    """
+    value = '%s|%s|%d' % (direction,
+        publish_date.strftime(CURSOR_DATE_FORMAT), pk)
+    return urlsafe_b64encode(value.encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """
+    Decode a cursor token into a tuple of (direction, publish_date, pk)
+    """
+    try:
+        token = str(token)
+        value = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, publish_date, pk = value.decode('ascii').split('|')
+        if direction not in ('n', 'p'):
+            raise ValueError(direction)
+        return (direction, datetime.strptime(publish_date, CURSOR_DATE_FORMAT),
+            int(pk))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor(token)
+
+class CursorPage(object):
+    """
+    A page of posts with the cursor tokens of its neighboring pages
+    """
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return encode_cursor(self.object_list[-1], 'n')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return encode_cursor(self.object_list[0], 'p')
+        return None
+
+def paginate_posts(posts, cursor=None, per_page=10):
+    """
+    Return a CursorPage of posts, ordered by publish_date (newest first)
+
+    cursor is a token from a previous page's next_cursor or
+    previous_cursor; the first page is returned when it is None.
+    Raises InvalidCursor for a malformed token.
+    """
+    if not cursor:
+        object_list = list(posts.order_by('-publish_date', '-id')[
+            :per_page + 1])
+        return CursorPage(object_list[:per_page],
+            has_next=len(object_list) > per_page, has_previous=False)
+
+    direction, publish_date, pk = decode_cursor(cursor)
+    if direction == 'n':
+        object_list = list(posts.filter(
+            Q(publish_date__lt=publish_date) |
+            Q(publish_date=publish_date, id__lt=pk)
+        ).order_by('-publish_date', '-id')[:per_page + 1])
+        return CursorPage(object_list[:per_page],
+            has_next=len(object_list) > per_page, has_previous=True)
+    else:
+        object_list = list(posts.filter(
+            Q(publish_date__gt=publish_date) |
+            Q(publish_date=publish_date, id__gt=pk)
+        ).order_by('publish_date', 'id')[:per_page + 1])
+        has_previous = len(object_list) > per_page
+        object_list = object_list[:per_page]
+        object_list.reverse()
+        return CursorPage(object_list, has_next=True,
+            has_previous=has_previous)
+
+def seek(queryset, cursor=None):
+    """
+    Return a queryset ordered by publish_date (newest first) starting after
+    the key of a next page cursor token, for rows that are read as they're
+    streamed rather than a page at a time
+
+    Raises InvalidCursor for a malformed or previous page token.
+    """
+    queryset = queryset.order_by('-publish_date', '-id')
+    if not cursor:
+        return queryset
+    direction, publish_date, pk = decode_cursor(cursor)
+    if direction != 'n':
+        raise InvalidCursor(cursor)
+    return queryset.filter(Q(publish_date__lt=publish_date) |
+        Q(publish_date=publish_date, id__lt=pk))
@@ -0,0 +1,113 @@
+"""
+Publish event pinging and bulk publishing
+
+Publish events are recorded in the PublishEvent outbox when a post is
+published, and pinged to the search engine by the
+blog_process_publish_events management command, outside of any request.
+
+The admin actions publish, unpublish, feature and unfeature posts in bulk:
+the posts, their archive entries and their tag postings are each updated
+with a single UPDATE instead of saving every post, and newly published posts
+record a single publish event.  The indexes that depend on the publish state
+are then updated: the tag usage counts and related posts once for all the
+changed posts, and the prev/next pointers around each changed post.
+"""
+import urllib
+import urllib2
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.sitemaps import SitemapNotFound
+from django.contrib.sites.models import Site
+from django.core import urlresolvers
+from django.db.models import Q
+
+from settings import BLOG_PING_URL, BLOG_PING_SITEMAP_URL
+from models import Post, Category, Series, PostArchiveEntry, TagPosting, \
+    TagUsage, LastChange, PublishEvent
+from sitemaps import get_sitemap_section
+import neighbors
+import related
+
+def get_sitemap_url():
+    """
+    Get the url of the sitemap index (or sitemap) view
+    """
+    for view in ('django.contrib.sitemaps.views.index',
+        'django.contrib.sitemaps.views.sitemap',):
+        try:
+            return urlresolvers.reverse(view)
+        except urlresolvers.NoReverseMatch:
+            pass
+    raise SitemapNotFound("You didn't provide a sitemap url, and the " \
+        "sitemap url couldn't be auto-detected.")
+
+def ping(ping_url=BLOG_PING_URL, sitemap_url=BLOG_PING_SITEMAP_URL,
+    timeout=10):
+    """
+    Ping the sitemap url to ping_url
+
+    Unlike django.contrib.sitemaps.ping_google, errors (including HTTP error
+    responses) are raised, so failed pings can be retried
+    """
+    if sitemap_url is None:
+        sitemap_url = get_sitemap_url()
+    if sitemap_url.startswith('/'):
+        sitemap_url = 'http://%s%s' % (Site.objects.get_current().domain,
+            sitemap_url)
+    response = urllib2.urlopen('%s?%s' % (ping_url,
+        urllib.urlencode({'sitemap': sitemap_url})), timeout=timeout)
+    try:
+        response.read()
+    finally:
+        response.close()
+
+def update_posts(posts, **values):
+    """
+    Set is_published and/or is_featured of a queryset of posts
+
+    Returns the number of posts that changed.
+    """
+    if not values:
+        return 0
+    changed = Q()
+    for name, value in values.items():
+        if name not in ('is_published', 'is_featured'):
+            raise TypeError('Can\'t bulk update %s' % (name,))
+        changed |= ~Q(**{name: value})
+    rows = list(posts.filter(changed).values_list('pk', 'publish_date',
+        'is_published'))
+    if not rows:
+        return 0
+    pks = [pk for pk, publish_date, is_published in rows]
+    newly_published = [(publish_date, pk)
+        for pk, publish_date, is_published in rows
+        if values.get('is_published') and not is_published]
+
+    # updated_on versions the posts' cached fragments
+    Post.objects.filter(pk__in=pks).update(updated_on=datetime.now(),
+        **values)
+    PostArchiveEntry.objects.filter(post__in=pks).update(**values)
+    TagPosting.objects.filter(post__in=pks).update(**values)
+    Post.objects.reset_visible_as_of()
+
+    if 'is_published' in values:
+        TagUsage.objects.update_counts(set(TagPosting.objects.filter(
+            post__in=pks).values_list('tag', flat=True)))
+        changed_posts = list(Post.objects.filter(pk__in=pks))
+        related.update_for_posts(changed_posts)
+        # featuring doesn't move the posts among their neighbors
+        neighbors.update_for_posts(changed_posts)
+        Category.objects.reset_annotated()
+        Series.objects.reset_annotated()
+
+    if newly_published \
+        and (getattr(settings, 'BLOG_PING_GOOGLE', False) == True) \
+        and (getattr(settings, 'DEBUG', True) == False):
+        # the ping covers every post, so one event is due once the first of
+        # them is visible
+        PublishEvent.objects.record_once(Post.objects.get(
+            pk=min(newly_published)[1]))
+    LastChange.objects.touch('posts', *['sitemap.posts.%d' % section
+        for section in sorted(set([get_sitemap_section(pk) for pk in pks]))])
+    return len(rows)
@@ -0,0 +1,224 @@
+"""
+Related posts
+
+The top scoring related posts of every post are kept in the RelatedPost
+table.  Posts are scored by their weighted tag, category and series overlap
+with recency decay.  Scores are kept in log space, relative to a fixed epoch,
+so that scores computed at different times compare:
+
+    score = log(overlap) + (publish date - epoch) / decay days
+
+The related posts are updated incrementally by the signal handlers in
+blog.signals, and rebuilt across a process pool by the
+blog_rebuild_related_posts management command.  Only visible published
+posts are related, so scheduled posts join the related posts of other posts
+when they're next saved or rebuilt once visible.
+"""
+from datetime import datetime
+from heapq import nlargest
+from math import log
+
+from django.db import connection
+from django.db.models import Count
+
+from models import Post, RelatedPost
+from managers import bulk_insert
+from settings import BLOG_RELATED_POSTS, BLOG_RELATED_WEIGHTS, \
+    BLOG_RELATED_DECAY_DAYS
+
+DECAY_EPOCH = datetime(2000, 1, 1)
+
+# number of posts whose related posts are read per query
+CHUNK_SIZE = 500
+
+def get_recency(publish_date):
+    """
+    Get the log space recency of a publish date
+    """
+    age = publish_date - DECAY_EPOCH
+    return (age.days + age.seconds / 86400.0) / BLOG_RELATED_DECAY_DAYS
+
+def get_rank(item):
+    """
+    Get the rank of a (related post id, score) item: by score, and between
+    equal scores by id, so that every update picks the same related posts
+    """
+    return item[1], item[0]
+
+def get_overlaps(post, visible_only=True):
+    """
+    Get the weighted overlap of the visible published posts (or with
+    visible_only False, of every post) that share tags, categories or a
+    series with the post
+
+    Returns a dictionary of post id: (overlap, publish date, is visible)
+    """
+    visible_as_of = Post.objects.get_visible_as_of()
+    overlaps = {}
+    def add(rows, weight):
+        for row in rows:
+            pk, publish_date, is_published = row[:3]
+            count = len(row) > 3 and row[3] or 1
+            overlap = overlaps.get(pk, (0.0,))[0] + weight * count
+            overlaps[pk] = (overlap, publish_date,
+                is_published and publish_date < visible_as_of)
+
+    posts = Post.objects.exclude(pk=post.pk)
+    if visible_only:
+        posts = posts.filter(is_published=True,
+            publish_date__lt=visible_as_of)
+    columns = ('pk', 'publish_date', 'is_published')
+    tags = post.get_tag_names()
+    if tags:
+        add(posts.filter(tag_postings__tag__in=tags).values_list(
+            *columns).annotate(Count('tag_postings')).order_by(),
+            BLOG_RELATED_WEIGHTS.get('tag', 1.0))
+    categories = list(post.categories.values_list('pk', flat=True))
+    if categories:
+        add(posts.filter(categories__in=categories).values_list(
+            *columns).annotate(Count('categories')).order_by(),
+            BLOG_RELATED_WEIGHTS.get('category', 1.0))
+    if post.series_id:
+        add(posts.filter(series=post.series_id).values_list(
+            *columns).order_by(),
+            BLOG_RELATED_WEIGHTS.get('series', 1.0))
+    return dict([(pk, values) for pk, values in overlaps.items()
+        if values[0] > 0])
+
+def write_related_posts(post_id, scores, current=None):
+    """
+    Replace the related posts of a post with a dictionary of
+    related post id: score
+
+    Given the current related posts (a dictionary of the same form), only
+    the rows that changed are deleted and inserted.
+    """
+    rows = RelatedPost.objects.filter(post=post_id)
+    if current is None:
+        rows.delete()
+        changed = scores.keys()
+    else:
+        changed = [pk for pk, score in scores.items()
+            if current.get(pk) != score]
+        removed = [pk for pk in current.keys()
+            if scores.get(pk) != current[pk]]
+        if removed:
+            rows.filter(related__in=removed).delete()
+    bulk_insert(RelatedPost, [RelatedPost(post_id=post_id, related_id=pk,
+        score=scores[pk]) for pk in changed])
+
+def update_related_posts(post, overlaps=None):
+    """
+    Recompute the related posts of a post (or post id), from its overlaps
+    if they're given
+    
+    Returns the overlaps of the post (see get_overlaps)
+    """
+    if not isinstance(post, Post):
+        post = Post.objects.get(pk=post)
+    if overlaps is None:
+        overlaps = get_overlaps(post)
+    write_related_posts(post.pk, dict(nlargest(BLOG_RELATED_POSTS,
+        [(pk, log(overlap) + get_recency(publish_date))
+        for pk, (overlap, publish_date, is_visible) in overlaps.items()
+        if is_visible], key=get_rank)))
+    return overlaps
+
+def update_for_post(post):
+    """
+    Update the related posts affected by a changed post (see
+    update_for_posts)
+    """
+    update_for_posts([post])
+
+def update_for_posts(posts):
+    """
+    Update the related posts affected by a list of changed posts
+
+    The posts' own related posts are recomputed.  Overlaps are symmetric, so
+    each post is merged into the related posts of the posts it overlaps
+    with (drafts and scheduled posts included), which are only written
+    where it scores above their lowest related post.  Posts that listed one
+    of them with a higher score than it now has are recomputed.  Every
+    affected post is written at most once.
+    """
+    visible_as_of = Post.objects.get_visible_as_of()
+    changed = set([post.pk for post in posts])
+    scores = {}
+    for post in posts:
+        overlaps = get_overlaps(post, visible_only=False)
+        update_related_posts(post, overlaps)
+        if post.is_published and post.publish_date < visible_as_of:
+            recency = get_recency(post.publish_date)
+            for pk, (overlap, publish_date, is_visible) in overlaps.items():
+                if pk not in changed:
+                    scores.setdefault(pk, {})[post.pk] = log(overlap) + \
+                        recency
+
+    stale = set()
+    for pk, related_id, score in RelatedPost.objects.filter(
+        related__in=changed).exclude(post__in=changed).values_list('post',
+        'related', 'score'):
+        new_score = scores.get(pk, {}).get(related_id)
+        if new_score is None or new_score < score:
+            stale.add(pk)
+    for pk in stale:
+        update_related_posts(pk)
+        scores.pop(pk, None)
+
+    pks = scores.keys()
+    for start in range(0, len(pks), CHUNK_SIZE):
+        chunk = pks[start:start + CHUNK_SIZE]
+        related = dict([(pk, {}) for pk in chunk])
+        for pk, related_id, score in RelatedPost.objects.filter(
+            post__in=chunk).values_list('post', 'related', 'score'):
+            related[pk][related_id] = score
+        for pk in chunk:
+            current = related[pk]
+            candidates = [(related_id, score)
+                for related_id, score in scores[pk].items()
+                if current.get(related_id) != score and (
+                len(current) < BLOG_RELATED_POSTS or related_id in current
+                or min(map(get_rank, current.items())) < (score,
+                related_id))]
+            if not candidates:
+                continue
+            merged = dict(current)
+            merged.update(candidates)
+            merged = dict(nlargest(BLOG_RELATED_POSTS, merged.items(),
+                key=get_rank))
+            if merged != current:
+                write_related_posts(pk, merged, current)
+
+def update_for_deleted_post(post_ids):
+    """
+    Recompute the related posts of the posts that listed a deleted post
+    """
+    for pk in post_ids:
+        if Post.objects.filter(pk=pk).exists():
+            update_related_posts(pk)
+
+def _update_related_posts_chunk(post_ids):
+    for pk in post_ids:
+        update_related_posts(pk)
+    connection.close()
+    return len(post_ids)
+
+def rebuild(processes=None, chunk_size=100):
+    """
+    Rebuild the related posts of every post across a pool of processes
+    """
+    post_ids = list(Post.objects.values_list('pk', flat=True))
+    chunks = [post_ids[start:start + chunk_size]
+        for start in range(0, len(post_ids), chunk_size)]
+    if processes == 1:
+        return sum(map(_update_related_posts_chunk, chunks))
+    from multiprocessing import Pool
+    # each process must open its own database connection
+    connection.close()
+    pool = Pool(processes)
+    try:
+        return sum(pool.map(_update_related_posts_chunk, chunks))
+    finally:
+        pool.close()
+        pool.join()
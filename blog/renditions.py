@@ -0,0 +1,272 @@
+"""
+Image renditions
+
+Generates resized renditions of the post images, in each of the
+BLOG_IMAGE_RENDITION_WIDTHS and BLOG_IMAGE_RENDITION_FORMATS, across a pool
+of processes run by the blog_rebuild_renditions management command.  Saving
+a post image whose image changed only deletes its rendition rows, which
+leaves it pending: blog_rebuild_renditions --pending renders the pending
+images outside of any request, like the publish event outbox.  Renditions
+are stored under names made of the content hash of the original image and
+their width, so an unchanged image is never rendered twice and the same
+image uploaded to several posts shares its renditions.  Widths wider than
+the original are rendered at the original's width.
+
+Renditions are saved in the default storage, whatever the storage of the
+images.  The pool's processes only read and write the storages; the
+rendition rows are written by the calling process.  Images PIL can't read
+are logged and skipped; their renditions are rendered once they're
+fixed.
+"""
+import hashlib
+import logging
+from datetime import datetime
+from io import BytesIO
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+
+from models import Post, PostImage, ImageRendition, LastChange
+from managers import bulk_insert
+from settings import BLOG_IMAGE_RENDITION_WIDTHS, \
+    BLOG_IMAGE_RENDITION_FORMATS, BLOG_IMAGE_RENDITION_QUALITY, \
+    BLOG_IMAGE_RENDITION_PATH, BLOG_IMAGE_RENDITION_PROCESSES
+
+# format: (PIL format, file extension)
+FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+    'png': ('PNG', 'png'),
+}
+HASH_CHUNK_SIZE = 64 * 1024
+# Image.ANTIALIAS was renamed Image.LANCZOS
+RESAMPLE = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+
+logger = logging.getLogger('blog.renditions')
+
+def get_image_storage():
+    """
+    Return the storage of the post images
+    """
+    return PostImage._meta.get_field('image').storage
+
+def get_content_hash(name):
+    """
+    Return the SHA-1 hex digest of a post image, read in chunks unless the
+    storage names the image by it
+    """
+    storage = get_image_storage()
+    if hasattr(storage, 'get_content_hash'):
+        content_hash = storage.get_content_hash(name)
+        if content_hash:
+            return content_hash
+    digest = hashlib.sha1()
+    f = storage.open(name, 'rb')
+    try:
+        for chunk in f.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+def get_rendition_directory(content_hash):
+    """
+    Return the storage directory of the renditions of a content hash
+    """
+    return '%s/%s/%s' % (BLOG_IMAGE_RENDITION_PATH, content_hash[:2],
+        content_hash)
+
+def get_rendition_name(content_hash, width, format):
+    """
+    Return the storage name of a rendition
+    """
+    return '%s/%d.%s' % (get_rendition_directory(content_hash), width,
+        FORMATS[format][1])
+
+def delete_renditions(content_hash):
+    """
+    Delete the stored renditions of a content hash, unless a post image
+    still has them (an image saved before content addressing, or another
+    copy of the content)
+
+    Returns whether they were deleted.
+    """
+    directory = get_rendition_directory(content_hash)
+    if ImageRendition.objects.filter(
+        name__startswith=directory + '/').exists():
+        return False
+    try:
+        directories, names = default_storage.listdir(directory)
+    except EnvironmentError:
+        # nothing was rendered
+        return False
+    for name in names:
+        default_storage.delete('%s/%s' % (directory, name))
+    return True
+
+def get_supported_formats(formats=BLOG_IMAGE_RENDITION_FORMATS):
+    """
+    Return the formats PIL can write (WebP needs PIL built with libwebp)
+    """
+    Image.init()
+    return [format for format in formats if FORMATS[format][0] in Image.SAVE]
+
+def render(task):
+    """
+    Render the renditions of an image that aren't stored yet
+
+    task is (image name, content hash or None to hash the image, widths,
+    formats, quality).  Returns a list of (format, width, height, rendition
+    name), or None if the image can't be read or rendered.
+    """
+    name, content_hash, widths, formats, quality = task
+    try:
+        return _render(name, content_hash, widths, formats, quality)
+    except (EnvironmentError, ValueError, SyntaxError):
+        # PIL raises IOError for unknown formats, and SyntaxError or
+        # ValueError for some broken files
+        logger.exception('Error rendering the renditions of %s', name)
+        return None
+
+def _render(name, content_hash, widths, formats, quality):
+    if content_hash is None:
+        content_hash = get_content_hash(name)
+    renditions = []
+    f = get_image_storage().open(name, 'rb')
+    try:
+        original = Image.open(f)
+        original_width, original_height = original.size
+        for width in sorted(set([min(width, original_width)
+            for width in widths])):
+            height = max(1, int(round(
+                original_height * width / float(original_width))))
+            resized = None
+            for format in formats:
+                rendition_name = get_rendition_name(content_hash, width,
+                    format)
+                if not default_storage.exists(rendition_name):
+                    if resized is None:
+                        resized = original
+                        if width != original_width:
+                            resized = original.resize((width, height),
+                                RESAMPLE)
+                    image = resized
+                    if format == 'jpeg' and image.mode != 'RGB':
+                        image = image.convert('RGB')
+                    elif image.mode not in ('RGB', 'RGBA'):
+                        image = image.convert('RGBA')
+                    output = BytesIO()
+                    image.save(output, FORMATS[format][0], quality=quality)
+                    rendition_name = default_storage.save(rendition_name,
+                        ContentFile(output.getvalue()))
+                renditions.append((format, width, height, rendition_name))
+    finally:
+        f.close()
+    return renditions
+
+def write_renditions(image_id, renditions):
+    """
+    Replace the rendition rows of an image
+    """
+    ImageRendition.objects.filter(image=image_id).delete()
+    bulk_insert(ImageRendition, [ImageRendition(image_id=image_id,
+        format=format, width=width, height=height, name=name)
+        for format, width, height, name in renditions])
+
+def reset_for_image(image):
+    """
+    Delete the rendition rows of a post image whose image changed, which
+    leaves it pending for render_pending
+    """
+    ImageRendition.objects.filter(image=image.pk).delete()
+    image._rendered_image_name = image.image.name
+
+def get_pending_images():
+    """
+    Return the post images that have an image but no renditions
+    """
+    return PostImage.objects.exclude(image='').filter(
+        renditions__isnull=True)
+
+def render_images(images, processes=BLOG_IMAGE_RENDITION_PROCESSES,
+    chunk_size=20):
+    """
+    Render the missing renditions of a list of (post image id, image name)
+    across a pool of processes, one image per task
+
+    Returns a tuple of (the ids of the rendered images, the (id, image
+    name) of the images that can't be rendered); images that can't be
+    rendered keep their renditions.
+    """
+    widths = BLOG_IMAGE_RENDITION_WIDTHS
+    formats = get_supported_formats()
+    if not (widths and formats and images):
+        return [], []
+    rendered = []
+    failed = []
+    pool = None
+    if processes != 1:
+        from multiprocessing import Pool
+        # the processes don't use the database, so don't let them inherit
+        # the connection
+        connection.close()
+        pool = Pool(processes)
+    try:
+        for start in range(0, len(images), chunk_size):
+            chunk = images[start:start + chunk_size]
+            tasks = [(name, None, widths, formats,
+                BLOG_IMAGE_RENDITION_QUALITY) for pk, name in chunk]
+            if pool is None:
+                results = map(render, tasks)
+            else:
+                results = pool.map(render, tasks)
+            for (pk, name), renditions in zip(chunk, results):
+                if renditions is None:
+                    failed.append((pk, name))
+                else:
+                    write_renditions(pk, renditions)
+                    rendered.append(pk)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return rendered, failed
+
+def render_pending(processes=BLOG_IMAGE_RENDITION_PROCESSES, chunk_size=20,
+    exclude=()):
+    """
+    Render the post images saved since they were last rendered, except the
+    (id, image name) pairs in exclude, and stamp their posts so the cached
+    pages showing them are refreshed
+
+    Returns a tuple of (the ids of the rendered images, the (id, image name)
+    of the images that can't be rendered).
+    """
+    exclude = set(exclude)
+    images = [image for image in get_pending_images().values_list('pk',
+        'image') if image not in exclude]
+    rendered, failed = render_images(images, processes, chunk_size)
+    if rendered:
+        # updated_on versions the posts' cached fragments and validators
+        Post.objects.filter(images__in=rendered).update(
+            updated_on=datetime.now())
+        LastChange.objects.touch('posts')
+    return rendered, failed
+
+def rebuild(processes=BLOG_IMAGE_RENDITION_PROCESSES, chunk_size=20):
+    """
+    Render the missing renditions of every post image across a pool of
+    processes, one image per task
+
+    Returns the number of images rendered; images that can't be rendered
+    keep their renditions.
+    """
+    rendered, failed = render_images(list(PostImage.objects.exclude(
+        image='').values_list('pk', 'image')), processes, chunk_size)
+    return len(rendered)
@@ -0,0 +1,243 @@
+"""
+Blog search
+
+A tokenized inverted index of the post title, tags, summary and content,
+stored in the blog's own tables (SearchDocument and SearchPosting) and
+updated by the signal handlers in blog.signals when posts are saved.
+Results are ranked with BM25, and quoted phrases in a query must match.
+"""
+import re
+from math import log
+
+from django.db.models import Avg, Count
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+from models import Post, SearchDocument, SearchPosting
+from settings import BLOG_SEARCH_FIELD_WEIGHTS, BLOG_SEARCH_SNIPPET_WORDS, \
+    BLOG_SEARCH_POSTINGS_PER_TERM
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)', re.UNICODE)
+
+# fields are indexed in this order, with a gap in the token positions so
+# that phrases can't match across fields
+SEARCH_FIELDS = ('title', 'tags', 'summary', 'content',)
+FIELD_POSITION_GAP = 100
+MAX_TERM_LENGTH = 100
+# ids per IN (...) query, under SQLite's limit of 999 query parameters
+IN_QUERY_SIZE = 500
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text):
+    """
+    Split text into lowercase search terms
+    """
+    return [token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall(text.lower())]
+
+def get_field_text(post, field):
+    """
+    Get the plain text of a post field
+    """
+    if field == 'tags':
+        return u' '.join(post.get_tag_names())
+    return strip_tags(getattr(post, field))
+
+def index_post(post):
+    """
+    Replace the search document and postings of a post
+    """
+    terms = {}
+    position = 0
+    length = 0
+    for field in SEARCH_FIELDS:
+        weight = BLOG_SEARCH_FIELD_WEIGHTS.get(field, 1)
+        for token in tokenize(get_field_text(post, field)):
+            term = terms.setdefault(token, [0, []])
+            term[0] += weight
+            term[1].append(position)
+            position += 1
+            length += weight
+        position += FIELD_POSITION_GAP
+
+    document, created = SearchDocument.objects.get_or_create(post=post,
+        defaults={'length': length})
+    if not created:
+        if document.length != length:
+            document.length = length
+            document.save()
+        document.postings.all().delete()
+    postings = [SearchPosting(term=term, document=document,
+        frequency=frequency, positions=' '.join([str(p) for p in positions]))
+        for term, (frequency, positions) in terms.items()]
+    if hasattr(SearchPosting.objects, 'bulk_create'):
+        SearchPosting.objects.bulk_create(postings)
+    else:
+        for posting in postings:
+            posting.save()
+
+def rebuild_index():
+    """
+    Rebuild the search index of every post
+    """
+    SearchPosting.objects.all().delete()
+    SearchDocument.objects.all().delete()
+    for post in Post.objects.all().iterator():
+        index_post(post)
+
+def parse_query(query):
+    """
+    Parse a search query into a tuple of (terms, phrases)
+
+    Quoted phrases are lists of terms that must appear next to each other
+    """
+    terms = []
+    phrases = []
+    for phrase, word in QUERY_RE.findall(query):
+        tokens = tokenize(phrase or word)
+        if phrase and len(tokens) > 1:
+            phrases.append(tokens)
+        for token in tokens:
+            if token not in terms:
+                terms.append(token)
+    return terms, phrases
+
+def matches_phrase(positions, phrase):
+    """
+    Return whether the term positions (a dictionary of term: set of
+    positions) contain the phrase
+    """
+    for start in positions.get(phrase[0], ()):
+        for offset, term in enumerate(phrase[1:]):
+            if start + offset + 1 not in positions.get(term, ()):
+                break
+        else:
+            return True
+    return False
+
+def make_snippet(post, terms, words=BLOG_SEARCH_SNIPPET_WORDS):
+    """
+    Return an html snippet of the post content around the first search
+    term, with the search terms highlighted
+    """
+    terms = set(terms)
+    def is_match(word):
+        return bool(terms.intersection(tokenize(word)))
+
+    text_words = strip_tags(post.content).split()
+    for start, word in enumerate(text_words):
+        if is_match(word):
+            start = max(0, start - words // 3)
+            break
+    else:
+        text_words = strip_tags(post.summary).split()
+        start = 0
+    snippet = u' '.join([is_match(word) and
+        u'<strong>%s</strong>' % escape(word) or escape(word)
+        for word in text_words[start:start + words]])
+    if start > 0:
+        snippet = u'&hellip; %s' % snippet
+    if start + words < len(text_words):
+        snippet = u'%s &hellip;' % snippet
+    return mark_safe(snippet)
+
+class SearchResult(object):
+    """
+    Search result
+    """
+    def __init__(self, post, score, terms):
+        self.post = post
+        self.score = score
+        self.terms = terms
+
+    @property
+    def snippet(self):
+        if not hasattr(self, '_snippet'):
+            self._snippet = make_snippet(self.post, self.terms)
+        return self._snippet
+
+def search(query, require_published=True, offset=0, limit=None,
+    postings_per_term=BLOG_SEARCH_POSTINGS_PER_TERM):
+    """
+    Search the posts
+
+    Only the posts of the postings_per_term highest impact postings of each
+    term are scored (None scores them all), so a post matching a common term
+    weakly may be left out.  Returns a tuple of (the number of matching
+    posts, the list of SearchResults from offset to offset + limit, best
+    match first)
+    """
+    terms, phrases = parse_query(query)
+    if not terms:
+        return 0, []
+
+    postings = SearchPosting.objects.all()
+    documents = SearchDocument.objects.all()
+    if require_published:
+        visible_as_of = Post.objects.get_visible_as_of()
+        postings = postings.filter(document__post__is_published=True,
+            document__post__publish_date__lt=visible_as_of)
+        documents = documents.filter(post__is_published=True,
+            post__publish_date__lt=visible_as_of)
+    statistics = documents.aggregate(Count('id'), Avg('length'))
+    document_count = statistics['id__count']
+    average_length = float(statistics['length__avg'] or 1)
+    document_frequencies = dict(postings.filter(term__in=terms).values_list(
+        'term').annotate(Count('id')).order_by())
+
+    # the candidates are the posts of the highest impact postings of each
+    # term: the most frequent, and the newest documents first, read in the
+    # order of the (term, frequency, document) index
+    post_ids = set()
+    for term in terms:
+        term_postings = postings.filter(term=term).order_by('-frequency',
+            '-document')
+        if postings_per_term is not None:
+            term_postings = term_postings[:postings_per_term]
+        post_ids.update(term_postings.values_list('document__post',
+            flat=True))
+
+    # then every posting of the query terms in the candidates is scored
+    fields = ['term', 'document__post', 'document__length', 'frequency',]
+    if phrases:
+        fields.append('positions')
+    matches = {}
+    post_ids = sorted(post_ids)
+    for start in range(0, len(post_ids), IN_QUERY_SIZE):
+        for posting in postings.filter(term__in=terms,
+            document__post__in=post_ids[start:start + IN_QUERY_SIZE]
+            ).values_list(*fields):
+            post_id, length = posting[1:3]
+            matches.setdefault(post_id, (length, []))[1].append(posting)
+
+    scores = []
+    for post_id, (length, post_postings) in matches.items():
+        if phrases:
+            positions = dict([(posting[0],
+                set([int(p) for p in posting[4].split()]))
+                for posting in post_postings])
+            if not all([matches_phrase(positions, phrase)
+                for phrase in phrases]):
+                continue
+        score = 0.0
+        for posting in post_postings:
+            term, frequency = posting[0], posting[3]
+            document_frequency = document_frequencies[term]
+            idf = log(1 + (document_count - document_frequency + 0.5) /
+                (document_frequency + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 *
+                (1 - BM25_B + BM25_B * length / average_length))
+        scores.append((score, post_id))
+    scores.sort(reverse=True)
+
+    if limit is not None:
+        page_scores = scores[offset:offset + limit]
+    else:
+        page_scores = scores[offset:]
+    posts = Post.objects.all().with_tags().in_bulk(
+        [post_id for score, post_id in page_scores])
+    return len(scores), [SearchResult(posts[post_id], score, terms)
+        for score, post_id in page_scores if post_id in posts]
@@ -1,12 +1,27 @@
 """
 Settings defaults - settings should be overridden in the project's settings.py
 """
+import os
+
 from django.conf import settings
 
 DEBUG = getattr(settings, 'DEBUG', True)
 
 BLOG_PING_GOOGLE = getattr(settings, 'BLOG_PING_GOOGLE', False)
 
+# Where publish events are pinged to, the sitemap url that is pinged (the
+# sitemap views are looked up if None), the seconds a burst of publish events
+# must be quiet before it's pinged (and the most seconds it can be delayed),
+# and how many times and after how many seconds (doubling) failed pings
+# are retried
+BLOG_PING_URL = getattr(settings, 'BLOG_PING_URL',
+    'http://www.google.com/webmasters/tools/ping')
+BLOG_PING_SITEMAP_URL = getattr(settings, 'BLOG_PING_SITEMAP_URL', None)
+BLOG_PING_DEBOUNCE = getattr(settings, 'BLOG_PING_DEBOUNCE', 60)
+BLOG_PING_MAX_DELAY = getattr(settings, 'BLOG_PING_MAX_DELAY', 10 * 60)
+BLOG_PING_MAX_ATTEMPTS = getattr(settings, 'BLOG_PING_MAX_ATTEMPTS', 5)
+BLOG_PING_RETRY_DELAY = getattr(settings, 'BLOG_PING_RETRY_DELAY', 60)
+
 BLOG_COMMENTS_EMAIL_NOTIFICATION = getattr(settings,
     'BLOG_COMMENTS_EMAIL_NOTIFICATION', False)
 
@@ -17,3 +32,124 @@ BLOG_COMMENTS_MODERATE_AFTER = getattr(settings,
 
 BLOG_COMMENTS_AUTO_CLOSE = getattr(settings, 'BLOG_COMMENTS_AUTO_CLOSE', False)
 BLOG_COMMENTS_CLOSE_AFTER = getattr(settings, 'BLOG_COMMENTS_CLOSE_AFTER', None)
+
+# Posts per page for the cursor paginated post index (None to disable)
+BLOG_POSTS_PER_PAGE = getattr(settings, 'BLOG_POSTS_PER_PAGE', None)
+
+# Seconds the visibility boundary of published posts is cached for.  The
+# boundary is reset when posts are saved, so processes that don't share a
+# cache backend may not see a new post for up to this long.
+BLOG_VISIBILITY_CACHE_TIMEOUT = getattr(settings,
+    'BLOG_VISIBILITY_CACHE_TIMEOUT', 5 * 60)
+
+# Seconds the published tag usage counts are cached for
+BLOG_TAG_USAGE_CACHE_TIMEOUT = getattr(settings,
+    'BLOG_TAG_USAGE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# Seconds the annotated category and series lists, and the shared tier of
+# the taxonomy cache, are cached for
+BLOG_TAXONOMY_CACHE_TIMEOUT = getattr(settings,
+    'BLOG_TAXONOMY_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# The taxonomy cache's Django cache backend (None for the default cache),
+# which holds its version stamps and, if BLOG_TAXONOMY_CACHE_SHARED, the
+# objects; the number of objects kept in each process' LRU cache (0 to
+# disable it), and the seconds between checks of the version stamps
+BLOG_TAXONOMY_CACHE_BACKEND = getattr(settings,
+    'BLOG_TAXONOMY_CACHE_BACKEND', None)
+BLOG_TAXONOMY_CACHE_SHARED = getattr(settings,
+    'BLOG_TAXONOMY_CACHE_SHARED', False)
+BLOG_TAXONOMY_CACHE_LOCAL_SIZE = getattr(settings,
+    'BLOG_TAXONOMY_CACHE_LOCAL_SIZE', 1000)
+BLOG_TAXONOMY_CACHE_CHECK_INTERVAL = getattr(settings,
+    'BLOG_TAXONOMY_CACHE_CHECK_INTERVAL', 5)
+
+# Number of font sizes in the blog tag cloud
+BLOG_TAG_CLOUD_STEPS = getattr(settings, 'BLOG_TAG_CLOUD_STEPS', 4)
+
+# Cache backend of the rendered post fragments (None for the default cache),
+# the seconds fragments are cached for and the number of fragments kept in
+# each process' LRU cache (0 to disable it)
+BLOG_FRAGMENT_CACHE_BACKEND = getattr(settings,
+    'BLOG_FRAGMENT_CACHE_BACKEND', None)
+BLOG_FRAGMENT_CACHE_TIMEOUT = getattr(settings,
+    'BLOG_FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+BLOG_FRAGMENT_CACHE_LOCAL_SIZE = getattr(settings,
+    'BLOG_FRAGMENT_CACHE_LOCAL_SIZE', 1000)
+
+# Number of posts in the RSS feed, whether the feed items carry the post
+# 'summary' or the 'full' content, and the seconds the feed is cached for
+BLOG_FEED_ITEMS = getattr(settings, 'BLOG_FEED_ITEMS', 20)
+BLOG_FEED_CONTENT = getattr(settings, 'BLOG_FEED_CONTENT', 'full')
+BLOG_FEED_CACHE_TIMEOUT = getattr(settings, 'BLOG_FEED_CACHE_TIMEOUT',
+    60 * 60 * 24)
+
+# Number of urls per sitemap section, and where blog_build_sitemaps writes
+# the gzipped sitemap files and the url they are served from
+BLOG_SITEMAP_LIMIT = getattr(settings, 'BLOG_SITEMAP_LIMIT', 5000)
+BLOG_SITEMAP_ROOT = getattr(settings, 'BLOG_SITEMAP_ROOT',
+    os.path.join(getattr(settings, 'MEDIA_ROOT', ''),
+    'apps', 'blogyall', 'sitemaps'))
+BLOG_SITEMAP_URL = getattr(settings, 'BLOG_SITEMAP_URL',
+    '%sapps/blogyall/sitemaps/' % (getattr(settings, 'MEDIA_URL', '/'),))
+
+# Search index weight of each post field, and the number of words in search
+# result snippets
+BLOG_SEARCH_FIELD_WEIGHTS = getattr(settings, 'BLOG_SEARCH_FIELD_WEIGHTS',
+    {'title': 3, 'tags': 2, 'summary': 1, 'content': 1})
+BLOG_SEARCH_SNIPPET_WORDS = getattr(settings, 'BLOG_SEARCH_SNIPPET_WORDS', 30)
+
+# Search results per page
+BLOG_SEARCH_RESULTS_PER_PAGE = getattr(settings,
+    'BLOG_SEARCH_RESULTS_PER_PAGE', 20)
+
+# Postings scored per search term, highest impact first (None for all)
+BLOG_SEARCH_POSTINGS_PER_TERM = getattr(settings,
+    'BLOG_SEARCH_POSTINGS_PER_TERM', 1000)
+
+# Number of related posts kept per post, the weight of each shared tag,
+# category and series, and the number of days over which a post's relevance
+# decays by a factor of e
+BLOG_RELATED_POSTS = getattr(settings, 'BLOG_RELATED_POSTS', 5)
+BLOG_RELATED_WEIGHTS = getattr(settings, 'BLOG_RELATED_WEIGHTS',
+    {'tag': 1.0, 'category': 0.5, 'series': 2.0})
+BLOG_RELATED_DECAY_DAYS = getattr(settings, 'BLOG_RELATED_DECAY_DAYS', 365)
+
+# Maintain each post's previous and next posts within each of its categories
+# (PostNeighbor) as well as globally and within its series
+BLOG_CATEGORY_NEIGHBORS = getattr(settings, 'BLOG_CATEGORY_NEIGHBORS', False)
+
+# Instrumentation sinks, as dotted paths or (dotted path, keyword arguments)
+# pairs (see blog.instrumentation); no sinks disables the instrumentation
+BLOG_INSTRUMENTATION_SINKS = getattr(settings, 'BLOG_INSTRUMENTATION_SINKS',
+    ())
+
+# Widths (pixels) and formats ('webp', 'jpeg' or 'png') of the renditions
+# generated for each post image, their encoding quality, the storage
+# directory they're saved under, and the number of processes
+# blog_rebuild_renditions renders them across (None for the number of
+# CPUs); no widths disables the renditions
+BLOG_IMAGE_RENDITION_WIDTHS = getattr(settings,
+    'BLOG_IMAGE_RENDITION_WIDTHS', (320, 640, 1024, 1600))
+BLOG_IMAGE_RENDITION_FORMATS = getattr(settings,
+    'BLOG_IMAGE_RENDITION_FORMATS', ('webp', 'jpeg'))
+BLOG_IMAGE_RENDITION_QUALITY = getattr(settings,
+    'BLOG_IMAGE_RENDITION_QUALITY', 80)
+BLOG_IMAGE_RENDITION_PATH = getattr(settings, 'BLOG_IMAGE_RENDITION_PATH',
+    'apps/blogyall/renditions')
+BLOG_IMAGE_RENDITION_PROCESSES = getattr(settings,
+    'BLOG_IMAGE_RENDITION_PROCESSES', None)
+
+# Store post image uploads content addressed (blog.storage), under the
+# storage directory of BLOG_IMAGE_BLOB_PATH, and how long (seconds) an
+# unreferenced blob is kept before blog_collect_image_blobs deletes it
+BLOG_CONTENT_ADDRESSED_IMAGES = getattr(settings,
+    'BLOG_CONTENT_ADDRESSED_IMAGES', False)
+BLOG_IMAGE_BLOB_PATH = getattr(settings, 'BLOG_IMAGE_BLOB_PATH',
+    'apps/blogyall/blobs')
+BLOG_IMAGE_BLOB_GRACE = getattr(settings, 'BLOG_IMAGE_BLOB_GRACE',
+    60 * 60 * 24)
+
+# Default and maximum number of results per page of the JSON API
+BLOG_API_PAGE_SIZE = getattr(settings, 'BLOG_API_PAGE_SIZE', 20)
+BLOG_API_MAX_PAGE_SIZE = getattr(settings, 'BLOG_API_MAX_PAGE_SIZE', 100)
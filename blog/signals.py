@@ -0,0 +1,205 @@
+"""
+Signal handlers that keep the denormalized blog indexes up to date
+"""
+from datetime import datetime
+
+from django.db.models.signals import post_save, pre_delete, post_delete, \
+    m2m_changed
+from django.contrib.comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+
+from tagging.models import Tag
+
+from models import Post, PublishedPost, Category, Series, PostArchiveEntry, \
+    TagPosting, TagUsage, LastChange, RelatedPost, PostImage, ImageBlob
+from sitemaps import get_sitemap_section
+from search import index_post
+from cache import taxonomy_cache
+import neighbors
+import related
+import renditions
+
+def reset_annotated_taxonomies():
+    """
+    Forget the cached post counts and latest posts of the categories and
+    series
+    """
+    Category.objects.reset_annotated()
+    Series.objects.reset_annotated()
+
+def update_post_indexes(sender, instance, **kwargs):
+    """
+    Update the denormalized indexes of a saved post
+    """
+    if kwargs.get('raw', False):
+        return
+    Post.objects.reset_visible_as_of()
+    PostArchiveEntry.objects.update_for_post(instance)
+    TagUsage.objects.update_counts(
+        TagPosting.objects.update_for_post(instance))
+    index_post(instance)
+    related.update_for_post(instance)
+    neighbors.update_for_post(instance)
+    reset_annotated_taxonomies()
+    LastChange.objects.touch('posts',
+        'sitemap.posts.%d' % get_sitemap_section(instance.pk))
+
+def collect_deleted_post_tags(sender, instance, **kwargs):
+    """
+    Remember the tags (and the posts listing as related or pointing to it) of
+    a post that is about to be deleted
+    """
+    instance._deleted_tag_names = set(
+        instance.tag_postings.values_list('tag', flat=True))
+    instance._deleted_listed_by = list(RelatedPost.objects.filter(
+        related=instance).values_list('post', flat=True))
+    instance._deleted_pointing = neighbors.get_pointing_posts(instance)
+
+def update_deleted_post_indexes(sender, instance, **kwargs):
+    """
+    Update the denormalized indexes of a deleted post
+    
+    The post's own index rows are removed by the cascading delete
+    """
+    Post.objects.reset_visible_as_of()
+    TagUsage.objects.update_counts(
+        getattr(instance, '_deleted_tag_names', ()))
+    related.update_for_deleted_post(
+        getattr(instance, '_deleted_listed_by', ()))
+    neighbors.update_for_deleted_post(
+        getattr(instance, '_deleted_pointing', ((), ())))
+    reset_annotated_taxonomies()
+    LastChange.objects.touch('posts',
+        'sitemap.posts.%d' % get_sitemap_section(instance.pk))
+
+def update_post_category_indexes(sender, instance, action, reverse, model,
+    pk_set, **kwargs):
+    """
+    Update the denormalized indexes of posts whose categories changed
+
+    Setting a post's categories (as a post form does) clears them, then adds
+    the new ones.  Clearing only removes the post's category archive entries
+    and category neighbors; the related posts are updated when the
+    categories are added.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse and action == 'post_clear':
+        PostArchiveEntry.objects.remove_categories(instance)
+        neighbors.update_category_neighbors(instance)
+        Category.objects.reset_annotated()
+        LastChange.objects.touch('posts')
+        return
+    if not reverse:
+        posts = [instance,]
+    elif action == 'post_clear':
+        # the cleared category no longer has posts to look up
+        posts = Post.objects.filter(
+            archive_entries__category=instance).distinct()
+    else:
+        posts = Post.objects.filter(pk__in=pk_set)
+    for post in posts:
+        PostArchiveEntry.objects.update_for_post(post)
+        related.update_for_post(post)
+        neighbors.update_category_neighbors(post)
+    Category.objects.reset_annotated()
+    LastChange.objects.touch('posts')
+
+def update_post_comments_updated_on(sender, instance, **kwargs):
+    """
+    Stamp the post of a saved or deleted comment, which versions the post's
+    cached fragments
+    """
+    if kwargs.get('raw', False):
+        return
+    if instance.content_type_id == ContentType.objects.get_for_model(Post).pk:
+        # update the row directly, saving the post would touch updated_on
+        Post.objects.filter(pk=instance.object_pk).update(
+            comments_updated_on=datetime.now())
+        LastChange.objects.touch('comments')
+
+def touch_taxonomy_last_change(sender, instance, **kwargs):
+    """
+    Record a change of the categories or series
+    """
+    if kwargs.get('raw', False):
+        return
+    sender._default_manager.reset_annotated()
+    LastChange.objects.touch(sender is Category and 'categories' or 'series')
+
+def invalidate_taxonomy_cache(sender, instance, **kwargs):
+    """
+    Invalidate the cached categories, series or tags in every process
+
+    A new object can't be cached yet, since lookups that find nothing aren't
+    cached, so creating one (as tagging a post with a new tag does) doesn't
+    invalidate.
+    """
+    if kwargs.get('created', False):
+        return
+    taxonomy_cache.invalidate(sender)
+
+def update_image_renditions(sender, instance, **kwargs):
+    """
+    Leave a post image whose image changed pending for
+    blog_rebuild_renditions --pending
+    """
+    if kwargs.get('raw', False):
+        return
+    if instance.image.name != instance._rendered_image_name:
+        renditions.reset_for_image(instance)
+
+def count_image_blob_references(sender, instance, **kwargs):
+    """
+    Move a saved post image's blob reference to its new image
+    """
+    if kwargs.get('raw', False):
+        return
+    if instance.image.name != instance._counted_image_name:
+        if instance._counted_image_name:
+            ImageBlob.objects.remove_reference(instance._counted_image_name)
+        if instance.image.name:
+            ImageBlob.objects.add_reference(instance.image.name)
+        instance._counted_image_name = instance.image.name
+
+def release_image_blob_reference(sender, instance, **kwargs):
+    """
+    Stop counting a deleted post image's blob reference
+    """
+    if instance._counted_image_name:
+        ImageBlob.objects.remove_reference(instance._counted_image_name)
+
+for post_model in (Post, PublishedPost):
+    post_save.connect(update_post_indexes, sender=post_model,
+        dispatch_uid='blog.signals.update_post_indexes.%s' % (
+            post_model.__name__,))
+    pre_delete.connect(collect_deleted_post_tags, sender=post_model,
+        dispatch_uid='blog.signals.collect_deleted_post_tags.%s' % (
+            post_model.__name__,))
+    post_delete.connect(update_deleted_post_indexes, sender=post_model,
+        dispatch_uid='blog.signals.update_deleted_post_indexes.%s' % (
+            post_model.__name__,))
+m2m_changed.connect(update_post_category_indexes,
+    sender=Post.categories.through,
+    dispatch_uid='blog.signals.update_post_category_indexes')
+post_save.connect(update_image_renditions, sender=PostImage,
+    dispatch_uid='blog.signals.update_image_renditions')
+post_save.connect(count_image_blob_references, sender=PostImage,
+    dispatch_uid='blog.signals.count_image_blob_references')
+post_delete.connect(release_image_blob_reference, sender=PostImage,
+    dispatch_uid='blog.signals.release_image_blob_reference')
+for comment_signal in (post_save, post_delete):
+    comment_signal.connect(update_post_comments_updated_on, sender=Comment,
+        dispatch_uid='blog.signals.update_post_comments_updated_on')
+for taxonomy_model in (Category, Series):
+    for taxonomy_signal in (post_save, post_delete):
+        taxonomy_signal.connect(touch_taxonomy_last_change,
+            sender=taxonomy_model,
+            dispatch_uid='blog.signals.touch_taxonomy_last_change.%s' % (
+                taxonomy_model.__name__,))
+for taxonomy_model in (Category, Series, Tag):
+    for taxonomy_signal in (post_save, post_delete):
+        taxonomy_signal.connect(invalidate_taxonomy_cache,
+            sender=taxonomy_model,
+            dispatch_uid='blog.signals.invalidate_taxonomy_cache.%s' % (
+                taxonomy_model.__name__,))
@@ -1,29 +1,125 @@
+from math import ceil
+
 from django.contrib.sitemaps import Sitemap
-from models import Post, Category, Series
+from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.db.models import Max
+
+from models import Post, Category, Series, LastChange
+from settings import BLOG_SITEMAP_LIMIT
+
+def get_sitemap_section(pk):
+    """
+    Get the sitemap section (page) of an object by its primary key
+    """
+    return (int(pk) - 1) // BLOG_SITEMAP_LIMIT + 1
+
+class SectionPage(object):
+    """
+    Sitemap section page
+    """
+    def __init__(self, object_list, number):
+        self.object_list = object_list
+        self.number = number
+
+class SectionPaginator(object):
+    """
+    Sitemap section paginator
+
+    Sections are fixed primary key ranges rather than offsets, so a section
+    only changes when one of its own objects changes, and reading a deep
+    section costs the same as reading the first one.
+    """
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = per_page
 
-class PostSitemap(Sitemap):
+    def _get_num_pages(self):
+        if not hasattr(self, '_num_pages'):
+            max_pk = self.object_list.aggregate(Max('pk'))['pk__max']
+            self._num_pages = int(ceil(float(max_pk or 0) / self.per_page))
+        return self._num_pages
+    num_pages = property(_get_num_pages)
+
+    def page(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1 or number > max(self.num_pages, 1):
+            raise EmptyPage('That page contains no results')
+        return SectionPage(self.object_list.filter(
+            pk__gt=(number - 1) * self.per_page,
+            pk__lte=number * self.per_page), number)
+
+class SectionSitemap(Sitemap):
+    """
+    Sitemap paged in fixed primary key range sections
+    """
+    limit = BLOG_SITEMAP_LIMIT
+    # LastChange scope of the sitemap's objects
+    change_scope = None
+
+    def get_changed_on(self, page):
+        """
+        Return when a section last changed, None if unknown
+        """
+        return LastChange.objects.get_changed_on(self.change_scope)
+
+    def _get_paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = SectionPaginator(self.items(), self.limit)
+        return self._paginator
+    paginator = property(_get_paginator)
+
+class PostSitemap(SectionSitemap):
     """
     Post sitemap
     """
+    def get_changed_on(self, page):
+        """
+        Return when a section last changed
+
+        Saved and deleted posts touch their section's LastChange scope, and
+        scheduled posts change their section when they're published
+        """
+        stamps = [stamp for stamp in (
+            LastChange.objects.get_changed_on('sitemap.posts.%d' % page),
+            self.paginator.page(page).object_list.aggregate(
+                Max('publish_date'))['publish_date__max'],
+        ) if stamp is not None]
+        return stamps and max(stamps) or None
+
     def items(self):
-        return Post.published.all()
+        return Post.objects.get_published_posts().only(
+            'slug', 'publish_date', 'last_modified').order_by('pk')
 
     def lastmod(self, obj):
         return obj.last_modified
     
-class CategorySitemap(Sitemap):
+class CategorySitemap(SectionSitemap):
     """
     Category sitemap
     """
+    change_scope = 'categories'
+
     def items(self):
-        return Category.objects.all()
+        return Category.objects.only('slug').order_by('pk')
     
-class SeriesSitemap(Sitemap):
+class SeriesSitemap(SectionSitemap):
     """
     Series sitemap
     """
+    change_scope = 'series'
+
     def items(self):
-        return Series.objects.all()
+        return Series.objects.only('slug', 'created_on').order_by('pk')
 
     def lastmod(self, obj):
         return obj.created_on
+
+# sitemaps for django.contrib.sitemaps.views.index and sitemap
+sitemaps = {
+    'posts': PostSitemap,
+    'categories': CategorySitemap,
+    'series': SeriesSitemap,
+}
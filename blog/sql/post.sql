@@ -0,0 +1,6 @@
+-- Composite indexes of the post queries, created by syncdb.  To add them to
+-- an existing database, run:
+--     python manage.py sqlcustom blog | python manage.py dbshell
+CREATE INDEX blog_post_published_publish_date ON blog_post (is_published, publish_date);
+CREATE INDEX blog_post_slug_publish_date ON blog_post (slug, publish_date);
+CREATE INDEX blog_post_featured_publish_date ON blog_post (is_featured, publish_date);
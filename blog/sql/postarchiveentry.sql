@@ -0,0 +1,4 @@
+-- Composite index of the archive queries, created by syncdb.  To add it to
+-- an existing database, run:
+--     python manage.py sqlcustom blog | python manage.py dbshell
+CREATE INDEX blog_postarchiveentry_category_published_publish_date ON blog_postarchiveentry (category_id, is_published, publish_date);
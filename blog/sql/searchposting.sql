@@ -0,0 +1,4 @@
+-- Composite index of the search candidate queries, created by syncdb.  To
+-- add it to an existing database, run:
+--     python manage.py sqlcustom blog | python manage.py dbshell
+CREATE INDEX blog_searchposting_term_frequency ON blog_searchposting (term, frequency, document_id);
@@ -0,0 +1,120 @@
+"""
+Content addressed image storage
+
+Stores each upload under the SHA-1 hash of its content, hashed while the
+upload is streamed to disk in chunks.  Identical uploads, to the same post
+or to different posts, share one blob and one url.  Blobs are recorded in
+ImageBlob with the number of post images referring to them, and blobs that
+are no longer referred to are deleted by the blog_collect_image_blobs
+management command.  A blob's content never changes, so its url can be
+served with far-future cache headers.
+"""
+import os
+import hashlib
+from datetime import datetime, timedelta
+from tempfile import mkstemp
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+
+from settings import BLOG_IMAGE_BLOB_PATH, BLOG_IMAGE_BLOB_GRACE
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage naming each file by the hash of its content
+    """
+    def __init__(self, location=None, base_url=None,
+        blob_path=BLOG_IMAGE_BLOB_PATH):
+        super(ContentAddressedStorage, self).__init__(location, base_url)
+        self.blob_path = blob_path
+
+    def get_available_name(self, name):
+        # the same name is the same content
+        return name
+
+    def get_blob_name(self, content_hash, name):
+        """
+        Return the name of the blob of a content hash, keeping the
+        extension of the uploaded name
+        """
+        return '%s/%s/%s%s' % (self.blob_path, content_hash[:2], content_hash,
+            os.path.splitext(name)[1].lower())
+
+    def get_content_hash(self, name):
+        """
+        Return the content hash of a blob name, or None if the name isn't a
+        blob
+        """
+        if not name.startswith(self.blob_path + '/'):
+            return None
+        return os.path.splitext(os.path.basename(name))[0]
+
+    def _save(self, name, content):
+        directory = self.path(self.blob_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        digest = hashlib.sha1()
+        size = 0
+        fd, temp_path = mkstemp(suffix='.upload', dir=directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            finally:
+                f.close()
+            content_hash = digest.hexdigest()
+            name = self.get_blob_name(content_hash, name)
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                os.remove(temp_path)
+            else:
+                if not os.path.exists(os.path.dirname(full_path)):
+                    os.makedirs(os.path.dirname(full_path))
+                # mkstemp creates the file readable by its owner only
+                os.chmod(temp_path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+                # concurrent uploads of the same content rename the same
+                # bytes into place
+                os.rename(temp_path, full_path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        models.get_model('blog', 'ImageBlob').objects.record(name,
+            content_hash, size)
+        return name
+
+def collect_garbage(grace=BLOG_IMAGE_BLOB_GRACE, dry_run=False):
+    """
+    Recount the references to the image blobs, then delete the blobs that
+    have none and weren't saved within the last grace seconds, along with
+    their renditions
+
+    The grace period keeps the blobs of uploads whose post images are being
+    saved.  Returns the names of the deleted blobs.
+    """
+    from renditions import delete_renditions
+    blob_model = models.get_model('blog', 'ImageBlob')
+    storage = models.get_model('blog', 'PostImage')._meta.get_field(
+        'image').storage
+    blob_model.objects.recount()
+    saved_before = datetime.now() - timedelta(seconds=grace)
+    unreferenced = blob_model.objects.filter(reference_count=0,
+        saved_on__lt=saved_before)
+    deleted = []
+    for pk, name, content_hash in list(unreferenced.values_list('pk', 'name',
+        'content_hash')):
+        if dry_run:
+            deleted.append(name)
+            continue
+        # the blob may have been referred to, or saved again, since it was
+        # counted: only delete its file if this deleted its row
+        if not blob_model.objects.delete_unreferenced(pk, saved_before):
+            continue
+        storage.delete(name)
+        delete_renditions(content_hash)
+        deleted.append(name)
+    return deleted
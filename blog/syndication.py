@@ -1,28 +1,72 @@
 from models import Post
+from conditional import get_changed_on
+from settings import BLOG_FEED_ITEMS, BLOG_FEED_CONTENT, \
+    BLOG_FEED_CACHE_TIMEOUT
 
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.hashcompat import md5_constructor
+from django.views.decorators.http import condition
 
 from django.core.urlresolvers import reverse
 
 class PostFeed(Feed):
     """
     Post Feed
+
+    The feed holds the latest item_limit published posts, with their
+    'summary' or 'full' content (content_mode).  The serialized feed is
+    cached until a post is saved, deleted or published, and is served with
+    ETag and Last-Modified headers.
     """
-    def __init__(self, link='/blog/', title='blog', description='the blog'):
+    def __init__(self, link='/blog/', title='blog', description='the blog',
+        item_limit=BLOG_FEED_ITEMS, content_mode=BLOG_FEED_CONTENT):
         super(PostFeed, self).__init__()
         self.title = title
         self.link = link
         self.description = description
+        self.item_limit = item_limit
+        self.content_mode = content_mode
+
+    def __call__(self, request, *args, **kwargs):
+        changed_on = get_changed_on('posts')
+        if changed_on is None:
+            return super(PostFeed, self).__call__(request, *args, **kwargs)
+        key = 'blog.feed.%s' % (md5_constructor('|'.join([
+            request.get_host(), request.path, changed_on.isoformat(),
+            unicode(self.item_limit), self.content_mode,
+        ]).encode('utf-8')).hexdigest(),)
+
+        def get_feed(request, *args, **kwargs):
+            feed = cache.get(key)
+            if feed is None:
+                response = super(PostFeed, self).__call__(
+                    request, *args, **kwargs)
+                feed = (response.content, response['Content-Type'])
+                cache.set(key, feed, BLOG_FEED_CACHE_TIMEOUT)
+            return HttpResponse(feed[0], content_type=feed[1])
+
+        return condition(
+            etag_func=lambda request, *args, **kwargs: key,
+            last_modified_func=lambda request, *args, **kwargs: changed_on,
+        )(get_feed)(request, *args, **kwargs)
         
     def items(self):
-        return Post.published.all()
+        posts = Post.objects.get_published_posts()
+        if self.content_mode == 'summary':
+            posts = posts.defer('content')
+        if self.item_limit:
+            posts = posts[:self.item_limit]
+        return posts
     
     def item_title(self, item):
         return item.title
     
     def item_description(self, item):
+        if self.content_mode == 'summary':
+            return item.summary
         return item.content
 
     def item_pubdate(self, item):
         return item.publish_date
-
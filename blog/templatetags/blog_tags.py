@@ -5,10 +5,14 @@ from django.core.urlresolvers import reverse
 from django.db import models
 from django.utils import dates
 from django.template import resolve_variable
+from django.template.loader import get_template
 
-from tagging.models import TaggedItem
-
-from blog.models import Post, Category
+from blog.models import Post, PostImage, Category, TagUsage
+from blog.settings import BLOG_TAG_CLOUD_STEPS
+from blog.cache import fragment_cache
+from blog.search import search
+from blog.memo import get_context_memo, memoize
+from blog.instrumentation import instrument_methods
 
 register = template.Library()
 
@@ -32,7 +36,8 @@ class BlogCategoriesNode(template.Node):
         self.args = dict(var_name=var_name)
     def render(self, context):
         var_name = self.args['var_name']
-        context[var_name] = Category.objects.all()
+        context[var_name] = memoize(get_context_memo(context),
+            ('categories',), Category.objects.get_annotated)
         return ''
 
 class BlogTagPostsNode(template.Node):
@@ -43,11 +48,9 @@ class BlogTagPostsNode(template.Node):
         is_staff = resolve_variable('user', context).is_staff
         tag = lit_or_val(self.args['tag'], context)
         var_name = self.args['var_name']
-        if not is_staff:
-            model_query = Post.objects.get_published_posts()
-        else:
-            model_query = Post.objects.all()
-        context[var_name] = TaggedItem.objects.get_by_model(model_query, tag)
+        context[var_name] = memoize(get_context_memo(context),
+            ('tag_posts', is_staff, tag), Post.objects.build_query,
+            require_published=(not is_staff), tag=tag)
         return ''
     
 class PostArchiveNode(template.Node):
@@ -59,10 +62,88 @@ class PostArchiveNode(template.Node):
         var_name = self.args['var_name']
         year = lit_or_val(self.args['year'], context)
         month = lit_or_val(self.args['month'], context)
-        context[var_name] = Post.objects.get_post_archive(
+        context[var_name] = memoize(get_context_memo(context),
+            ('post_archive', is_staff, year, month),
+            Post.objects.get_post_archive,
             require_published=(not is_staff), year=year, month=month)
         return ''
 
+class BlogTagCloudNode(template.Node):
+    def __init__(self, var_name, steps=None):
+        self.args = dict(var_name=var_name, steps=steps)
+    def render(self, context):
+        var_name = self.args['var_name']
+        steps = lit_or_val(self.args['steps'], context) or BLOG_TAG_CLOUD_STEPS
+        context[var_name] = memoize(get_context_memo(context),
+            ('tag_cloud', int(steps)), TagUsage.objects.get_cloud,
+            steps=int(steps))
+        return ''
+
+class BlogSearchResultsNode(template.Node):
+    def __init__(self, query, var_name, limit=None):
+        self.args = dict(query=query, var_name=var_name, limit=limit)
+    def render(self, context):
+        # is this user staff?  Determines published post display
+        is_staff = resolve_variable('user', context).is_staff
+        query = lit_or_val(self.args['query'], context)
+        limit = lit_or_val(self.args['limit'], context)
+        var_name = self.args['var_name']
+        limit = limit and int(limit) or None
+        context[var_name] = memoize(get_context_memo(context),
+            ('search', is_staff, query or '', limit), search, query or '',
+            require_published=(not is_staff), limit=limit)[1]
+        return ''
+
+class BlogRelatedPostsNode(template.Node):
+    def __init__(self, post, var_name, limit=None):
+        self.args = dict(post=post, var_name=var_name, limit=limit)
+    def render(self, context):
+        post = template.Variable(self.args['post']).resolve(context)
+        limit = lit_or_val(self.args['limit'], context)
+        var_name = self.args['var_name']
+        limit = limit and int(limit) or None
+        context[var_name] = memoize(get_context_memo(context),
+            ('related_posts', post.pk, limit), post.get_related_posts,
+            limit=limit)
+        return ''
+
+class BlogPostFragmentNode(template.Node):
+    def __init__(self, post, template_name):
+        self.args = dict(post=post, template_name=template_name)
+    def render(self, context):
+        post = template.Variable(self.args['post']).resolve(context)
+        template_name = lit_or_val(self.args['template_name'], context)
+        # the post's update and comment stamps version the fragment
+        key = fragment_cache.make_key(template_name, post.pk, post.updated_on,
+            post.comments_updated_on)
+        fragment = fragment_cache.get(key)
+        if fragment is None:
+            context.push()
+            try:
+                context['post'] = post
+                fragment = get_template(template_name).render(context)
+            finally:
+                context.pop()
+            fragment_cache.set(key, fragment)
+        return fragment
+
+class BlogGalleryImagesNode(template.Node):
+    def __init__(self, post, var_name):
+        self.args = dict(post=post, var_name=var_name)
+    def render(self, context):
+        post = template.Variable(self.args['post']).resolve(context)
+        var_name = self.args['var_name']
+        context[var_name] = memoize(get_context_memo(context),
+            ('gallery_images', post.pk), PostImage.objects.attach_renditions,
+            post.images.get_gallery_images())
+        return ''
+
+for node_class in (BlogCategoriesNode, BlogTagPostsNode, PostArchiveNode,
+    BlogTagCloudNode, BlogSearchResultsNode, BlogRelatedPostsNode,
+    BlogPostFragmentNode, BlogGalleryImagesNode):
+    instrument_methods(node_class, ('render',), 'tag.%s' % (
+        node_class.__name__,))
+
 def do_get_blog_tag_posts(parser, token):
     """
     Get the blog Posts for a specified tag and store it in a context variable.
@@ -120,6 +201,9 @@ def do_get_blog_categories(parser, token):
     """
     Get the blog Categories and store them in a context variable
     
+    Each category has its number of published posts in post_count, and its
+    latest post's latest_publish_date, latest_post_title and latest_post_url
+    
     Usage::
     
       {% get_blog_categories as [var_name] %}
@@ -136,6 +220,131 @@ def do_get_blog_categories(parser, token):
     var_name = args[-1]
     return BlogCategoriesNode(var_name)
 
+def do_get_blog_tag_cloud(parser, token):
+    """
+    Get the blog tag cloud and store it in a context variable
+    
+    Each tag has its number of published posts in tag.count and a font size
+    between 1 and steps (BLOG_TAG_CLOUD_STEPS by default) in tag.font_size
+    
+    Usage::
+    
+      {% get_blog_tag_cloud [steps] as [var_name] %}
+      
+    Example::
+    
+      {% get_blog_tag_cloud 6 as blog_tag_cloud %}
+    
+    """
+    args = token.split_contents()
+    if len(args) not in (3, 4) or args[-2] != 'as':
+        raise template.TemplateSyntaxError(
+            'incorrect parameters. format is %r [steps] as ' \
+            'variable_name' % args[0])
+    var_name = args[-1]
+    steps = None
+    if len(args) == 4:
+        steps = args[1]
+    return BlogTagCloudNode(var_name, steps)
+
+def do_get_blog_search_results(parser, token):
+    """
+    Search the blog Posts and store the results in a context variable
+    
+    Each result has a post, a score and an html snippet with the search
+    terms highlighted.  Quoted phrases in the query must match.
+    
+    Usage::
+    
+      {% get_blog_search_results [query] [limit] as [var_name] %}
+    
+    query should be a variable or a quoted string
+    
+    Example::
+    
+      {% get_blog_search_results "django" 5 as search_results %}
+    
+    """
+    args = token.split_contents()
+    if len(args) not in (4, 5) or args[-2] != 'as':
+        raise template.TemplateSyntaxError(
+            'incorrect parameters. format is %r query [limit] as ' \
+            'variable_name' % args[0])
+    limit = None
+    if len(args) == 5:
+        limit = args[2]
+    return BlogSearchResultsNode(args[1], args[-1], limit)
+
+def do_get_blog_related_posts(parser, token):
+    """
+    Get the published related posts of a post, best match first, and store
+    them in a context variable
+    
+    Usage::
+    
+      {% get_blog_related_posts [post] [limit] as [var_name] %}
+    
+    Example::
+    
+      {% get_blog_related_posts blog_post 3 as related_posts %}
+    
+    """
+    args = token.split_contents()
+    if len(args) not in (4, 5) or args[-2] != 'as':
+        raise template.TemplateSyntaxError(
+            'incorrect parameters. format is %r post [limit] as ' \
+            'variable_name' % args[0])
+    limit = None
+    if len(args) == 5:
+        limit = args[2]
+    return BlogRelatedPostsNode(args[1], args[-1], limit)
+
+def do_blog_post_fragment(parser, token):
+    """
+    Render a post with a template, cached until the post is edited or its
+    comments change
+    
+    The post is available to the template as post.  Fragments are shared by
+    every request, so the template must not depend on the user.
+    
+    Usage::
+    
+      {% blog_post_fragment [post] [template_name] %}
+    
+    template_name should be a variable or a quoted string
+    
+    Example::
+    
+      {% blog_post_fragment post "blog/post/row.html" %}
+    
+    """
+    args = token.split_contents()
+    if len(args) != 3:
+        raise template.TemplateSyntaxError(
+            'incorrect parameters. format is %r post template_name' % args[0])
+    return BlogPostFragmentNode(args[1], args[2])
+
+def do_get_blog_gallery_images(parser, token):
+    """
+    Get the gallery images of a post, with their renditions, and store them
+    in a context variable
+    
+    Usage::
+    
+      {% get_blog_gallery_images [post] as [var_name] %}
+    
+    Example::
+    
+      {% get_blog_gallery_images blog_post as gallery_images %}
+    
+    """
+    args = token.split_contents()
+    if len(args) != 4 or args[2] != 'as':
+        raise template.TemplateSyntaxError(
+            'incorrect parameters. format is %r post as variable_name' % (
+            args[0],))
+    return BlogGalleryImagesNode(args[1], args[3])
+
 def month_name(value):
     """
     Get the month name from a numeric value
@@ -164,10 +373,32 @@ def blog_tag_get_absolute_url(tag):
     return reverse(
         'blog.views.tag_detail', kwargs={'tag': tag})
 
+def blog_image_srcset(image, format='jpeg'):
+    """
+    Get the srcset of a post image's renditions in a format
+    
+    Usage::
+
+      {% blog_image_srcset [image] [format] %}
+    
+    Example::
+    
+      <img src="{{ image.image.url }}"
+          srcset="{% blog_image_srcset image "jpeg" %}">
+    
+    """
+    return image.get_srcset(format)
+
 register.tag('get_blog_tag_posts', do_get_blog_tag_posts)
 register.tag('get_blog_post_archive', do_get_blog_post_archive)
 register.tag('get_blog_categories', do_get_blog_categories)
+register.tag('get_blog_tag_cloud', do_get_blog_tag_cloud)
+register.tag('blog_post_fragment', do_blog_post_fragment)
+register.tag('get_blog_search_results', do_get_blog_search_results)
+register.tag('get_blog_related_posts', do_get_blog_related_posts)
+register.tag('get_blog_gallery_images', do_get_blog_gallery_images)
 
 register.simple_tag(blog_tag_get_absolute_url)
+register.simple_tag(blog_image_srcset)
 
 register.filter('month_name', month_name)
@@ -0,0 +1,984 @@
+"""
+Blog tests
+
+The denormalized indexes are checked by comparing the incrementally
+maintained rows with the rows of a rebuild.
+"""
+import os
+import shutil
+import socket
+import threading
+from datetime import datetime, timedelta
+from io import BytesIO
+from tempfile import mkdtemp, mkstemp
+from time import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+from django.conf import settings
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User, AnonymousUser
+from django.contrib.comments.models import Comment
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.http import Http404
+from django.template import Context, RequestContext, Template
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import simplejson
+
+from tagging.models import TaggedItem
+
+from models import Post, Category, Series, PostImage, ImageBlob, \
+    ImageRendition, PostArchiveEntry, TagPosting, TagUsage, RelatedPost, \
+    LastChange, PublishEvent, SearchPosting
+from managers import bulk_insert, get_date_range
+from pagination import InvalidCursor, encode_cursor, encode_key, \
+    decode_cursor, paginate_posts
+from syndication import PostFeed
+from context_processors import blog_tags_processor
+from settings import BLOG_FEED_ITEMS
+from admin import PostAdmin
+from cache import taxonomy_cache
+from instrumentation import Sample, StatsDSink, MemorySink, set_sinks, \
+    instrumented
+from management.commands import blog_build_sitemaps
+import api
+import benchmark
+import managers
+import neighbors
+import publishing
+import related
+import renditions
+import search
+import sitemaps
+import storage
+import transfer
+import views
+
+class BlogTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author')
+        self.category = Category.objects.create(title='Category',
+            slug='category')
+        self.series = Series.objects.create(title='Series', slug='series')
+
+    def create_post(self, number, **kwargs):
+        values = {'title': 'Post %d' % number, 'slug': 'post-%d' % number,
+            'author': self.author, 'summary': 'Summary %d' % number,
+            'content': 'Content of post %d' % number,
+            'publish_date': datetime(2010, 1, 1) + timedelta(days=number),
+            'tags': 'tag%d tag%d' % (number % 3, number % 3 + 1)}
+        values.update(kwargs)
+        return Post.objects.create(**values)
+
+    def assertRebuilt(self, get_rows, rebuild, **kwargs):
+        """
+        Assert that incrementally maintained rows match the rows of a rebuild
+        """
+        rows = get_rows()
+        rebuild(**kwargs)
+        self.assertEqual(rows, get_rows())
+
+    def assertRebuiltAfterEdits(self, get_rows, rebuild, **kwargs):
+        """
+        Create, publish, retag, recategorize and delete posts, asserting
+        that the rows match a rebuild after each step
+        """
+        posts = []
+        for number in range(8):
+            post = self.create_post(number, is_published=number % 3 != 0,
+                series=number % 2 and self.series or None)
+            if number % 2:
+                post.categories.add(self.category)
+            posts.append(post)
+        self.assertRebuilt(get_rows, rebuild, **kwargs)
+
+        posts[3].is_published = True
+        posts[3].publish_date = datetime(2009, 12, 1)
+        posts[3].save()
+        self.assertRebuilt(get_rows, rebuild, **kwargs)
+
+        posts[4].tags = 'tag0 tag5'
+        posts[4].is_featured = True
+        posts[4].save()
+        posts[5].save()
+        posts[5].categories.clear()
+        posts[5].save()
+        self.assertRebuilt(get_rows, rebuild, **kwargs)
+
+        posts[1].delete()
+        self.assertRebuilt(get_rows, rebuild, **kwargs)
+
+def get_archive_rows():
+    return sorted(PostArchiveEntry.objects.values_list('post', 'category',
+        'title', 'publish_date', 'is_published', 'is_featured'))
+
+class ArchiveTest(BlogTestCase):
+    def test_edits(self):
+        self.assertRebuiltAfterEdits(get_archive_rows,
+            PostArchiveEntry.objects.rebuild)
+
+    def test_categories(self):
+        post = self.create_post(1)
+        post.categories.add(self.category)
+        self.assertEqual(sorted(PostArchiveEntry.objects.filter(post=post
+            ).values_list('category', flat=True)), [None, self.category.pk])
+        post.categories.clear()
+        self.assertEqual(list(PostArchiveEntry.objects.filter(post=post
+            ).values_list('category', flat=True)), [None])
+
+    def test_post_archive(self):
+        self.create_post(1)
+        self.create_post(2)
+        self.create_post(32, is_published=False)
+        self.assertEqual([(year, month, day, [entry.title
+            for entry in entries])
+            for year, months in Post.objects.get_post_archive()
+            for month, days in months
+            for day, entries in days],
+            [(2010, 1, 3, ['Post 2']), (2010, 1, 2, ['Post 1'])])
+
+class PaginationTest(BlogTestCase):
+    def setUp(self):
+        super(PaginationTest, self).setUp()
+        for number in range(5):
+            self.create_post(number)
+        # published at the same time as post-4
+        self.create_post(5, publish_date=datetime(2010, 1, 5))
+
+    def test_cursor(self):
+        post = Post.objects.get(slug='post-1')
+        self.assertEqual(decode_cursor(encode_cursor(post, 'n')),
+            ('n', post.publish_date, post.pk))
+
+    def test_pages(self):
+        posts = Post.objects.all()
+        page = paginate_posts(posts, per_page=2)
+        pages = [[post.slug for post in page]]
+        while page.has_next:
+            page = paginate_posts(posts, page.next_cursor, per_page=2)
+            pages.append([post.slug for post in page])
+        self.assertEqual(pages, [['post-5', 'post-4'], ['post-3', 'post-2'],
+            ['post-1', 'post-0']])
+        page = paginate_posts(posts, page.previous_cursor, per_page=2)
+        self.assertEqual([post.slug for post in page], ['post-3', 'post-2'])
+        self.assertTrue(page.has_previous)
+
+    def test_bad_cursor(self):
+        for token in ('garbage', encode_key(datetime(2010, 1, 1), 1, 'x')):
+            self.assertRaises(InvalidCursor, decode_cursor, token)
+        request = RequestFactory().get('/', {'cursor': 'garbage'})
+        request.user = AnonymousUser()
+        self.assertRaises(Http404, views.post_index, request, per_page=2)
+
+class TagPrefetchTest(BlogTestCase):
+    def test_with_tags(self):
+        for number in range(5):
+            self.create_post(number)
+        ContentType.objects.get_for_model(Post)
+        # the posts and their tags
+        with self.assertNumQueries(2):
+            tags = [[tag.name for tag in post.tag_list]
+                for post in Post.objects.all().with_tags()]
+        self.assertEqual(tags, [['tag1', 'tag2'], ['tag0', 'tag1'],
+            ['tag2', 'tag3'], ['tag1', 'tag2'], ['tag0', 'tag1']])
+
+def get_tag_posting_rows():
+    return sorted(TagPosting.objects.values_list('tag', 'post',
+        'publish_date', 'is_published', 'is_featured'))
+
+class TagPostingTest(BlogTestCase):
+    urls = 'blog.urls'
+
+    def test_edits(self):
+        self.assertRebuiltAfterEdits(get_tag_posting_rows,
+            TagPosting.objects.rebuild)
+
+    def test_tag_query(self):
+        for number in range(4):
+            self.create_post(number, is_published=number != 3)
+        def get_slugs(tag, require_published=True):
+            return [post.slug for post in Post.objects.build_query(tag=tag,
+                require_published=require_published)]
+        self.assertEqual(get_slugs('tag1'), ['post-1', 'post-0'])
+        self.assertEqual(get_slugs(['tag1', 'tag2']), ['post-1'])
+        self.assertEqual(get_slugs('tag1', require_published=False),
+            ['post-3', 'post-1', 'post-0'])
+
+    def test_tag_detail(self):
+        self.create_post(1)
+        response = self.client.get('/tags/tag1/')
+        self.assertEqual((response.context['tag'].name,
+            response.context['tag_name']), ('tag1', 'tag1'))
+
+def get_tag_usage_rows():
+    return sorted(TagUsage.objects.filter(count__gt=0).values_list('tag',
+        'count'))
+
+class TagUsageTest(BlogTestCase):
+    def test_edits(self):
+        self.assertRebuiltAfterEdits(get_tag_usage_rows,
+            TagUsage.objects.rebuild)
+
+    def test_usage(self):
+        for number in range(4):
+            self.create_post(number, is_published=number != 3)
+        self.assertEqual([(usage.tag, usage.count)
+            for usage in TagUsage.objects.get_usage()],
+            [('tag0', 1), ('tag1', 2), ('tag2', 2), ('tag3', 1)])
+        # cached until a post changes
+        self.assertNumQueries(0, TagUsage.objects.get_usage)
+        self.assertEqual([(usage.tag, usage.font_size)
+            for usage in TagUsage.objects.get_cloud(steps=2)],
+            [('tag0', 1), ('tag1', 2), ('tag2', 2), ('tag3', 1)])
+
+class FragmentCacheTest(BlogTestCase):
+    def test_comment_save(self):
+        post = self.create_post(1)
+        template = Template('{% load blog_tags %}'
+            '{% blog_post_fragment post "blog/post/body.html" %}')
+        def render():
+            return template.render(Context({
+                'post': Post.objects.get(pk=post.pk)}))
+        self.assertTrue('Post 1' in render())
+        # updating the row doesn't change the post's updated_on
+        Post.objects.filter(pk=post.pk).update(title='Renamed')
+        self.assertTrue('Post 1' in render())
+        Comment.objects.create(
+            content_type=ContentType.objects.get_for_model(Post),
+            object_pk=str(post.pk), site_id=settings.SITE_ID,
+            user_name='reader', user_email='reader@example.com',
+            comment='First')
+        self.assertTrue('Renamed' in render())
+
+class ConditionalGetTest(BlogTestCase):
+    urls = 'blog.urls'
+
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.create_post(1)
+
+    def test_not_modified(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/',
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+            304)
+        self.create_post(2)
+        self.assertEqual(self.client.get('/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_staff(self):
+        etag = self.client.get('/')['ETag']
+        user = User.objects.create_user('staff', 'staff@example.com',
+            'password')
+        user.is_staff = True
+        user.save()
+        self.client.login(username='staff', password='password')
+        self.assertNotEqual(self.client.get('/')['ETag'], etag)
+
+class FeedTest(BlogTestCase):
+    urls = 'blog.urls'
+
+    def setUp(self):
+        super(FeedTest, self).setUp()
+        for number in range(3):
+            self.create_post(number)
+
+    def get(self, feed, **headers):
+        return feed(RequestFactory().get('/rss/', **headers))
+
+    def test_item_limit(self):
+        self.assertEqual(PostFeed().item_limit, BLOG_FEED_ITEMS)
+        content = self.get(PostFeed(item_limit=2)).content
+        self.assertEqual(content.count('<item>'), 2)
+        self.assertTrue('Content of post 2' in content)
+        self.assertFalse('Content of post 0' in content)
+
+    def test_summary(self):
+        content = self.get(PostFeed(content_mode='summary')).content
+        self.assertTrue('Summary 2' in content)
+        self.assertFalse('Content of post' in content)
+
+    def test_etag(self):
+        etag = self.get(PostFeed())['ETag']
+        self.assertEqual(self.get(PostFeed(),
+            HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.create_post(3)
+        response = self.get(PostFeed(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+class SitemapTest(BlogTestCase):
+    def setUp(self):
+        super(SitemapTest, self).setUp()
+        # sections of two posts
+        self.limit = sitemaps.BLOG_SITEMAP_LIMIT
+        sitemaps.BLOG_SITEMAP_LIMIT = sitemaps.SectionSitemap.limit = 2
+        self.root = blog_build_sitemaps.BLOG_SITEMAP_ROOT
+        blog_build_sitemaps.BLOG_SITEMAP_ROOT = mkdtemp()
+        self.posts = [self.create_post(number) for number in range(5)]
+
+    def tearDown(self):
+        sitemaps.BLOG_SITEMAP_LIMIT = sitemaps.SectionSitemap.limit = \
+            self.limit
+        shutil.rmtree(blog_build_sitemaps.BLOG_SITEMAP_ROOT)
+        blog_build_sitemaps.BLOG_SITEMAP_ROOT = self.root
+
+    def test_sections(self):
+        self.assertEqual([sitemaps.get_sitemap_section(pk)
+            for pk in range(1, 6)], [1, 1, 2, 2, 3])
+        paginator = sitemaps.PostSitemap().paginator
+        pks = []
+        for number in range(1, paginator.num_pages + 1):
+            for post in paginator.page(number).object_list:
+                self.assertEqual(sitemaps.get_sitemap_section(post.pk),
+                    number)
+                pks.append(post.pk)
+        self.assertEqual(sorted(pks), sorted([post.pk
+            for post in self.posts]))
+
+    def test_build(self):
+        def build():
+            output = StringIO()
+            call_command('blog_build_sitemaps', stdout=output)
+            return output.getvalue()
+        sections = sitemaps.PostSitemap().paginator.num_pages + 2
+        self.assertEqual(build(), 'Rebuilt %d of %d sitemap sections.\n' % (
+            sections, sections))
+        self.assertEqual(build(), 'Rebuilt 0 of %d sitemap sections.\n' % (
+            sections,))
+
+        # the files were built before the last change of a post section
+        root = blog_build_sitemaps.BLOG_SITEMAP_ROOT
+        built_on = time() - 60 * 60
+        for filename in os.listdir(root):
+            os.utime(os.path.join(root, filename), (built_on, built_on))
+        LastChange.objects.update(
+            changed_on=datetime.now() - timedelta(hours=2))
+        self.posts[0].save()
+        self.assertEqual(build(), 'Rebuilt 1 of %d sitemap sections.\n' % (
+            sections,))
+        self.assertEqual(sorted([filename for filename in os.listdir(root)
+            if os.path.getmtime(os.path.join(root, filename)) > built_on]),
+            ['sitemap-posts-%d.xml.gz' % sitemaps.get_sitemap_section(
+            self.posts[0].pk), 'sitemap.xml.gz'])
+
+class PingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class PublishEventTest(BlogTestCase):
+    def setUp(self):
+        super(PublishEventTest, self).setUp()
+        self.server = HTTPServer(('127.0.0.1', 0), PingHandler)
+        self.server.paths = []
+        self.server.status = 200
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.ping_url = 'http://127.0.0.1:%d/ping' % (
+            self.server.server_address[1],)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def ping(self):
+        publishing.ping(ping_url=self.ping_url,
+            sitemap_url='http://example.com/sitemap.xml')
+
+    def test_record(self):
+        ping_google = getattr(settings, 'BLOG_PING_GOOGLE', False)
+        debug = settings.DEBUG
+        settings.BLOG_PING_GOOGLE = True
+        settings.DEBUG = False
+        try:
+            post = self.create_post(1, is_published=False)
+            self.assertEqual(PublishEvent.objects.count(), 0)
+            post.is_published = True
+            post.save()
+            post.save()
+        finally:
+            settings.BLOG_PING_GOOGLE = ping_google
+            settings.DEBUG = debug
+        self.assertEqual(list(PublishEvent.objects.values_list('post',
+            flat=True)), [post.pk])
+
+    def test_process(self):
+        PublishEvent.objects.record()
+        PublishEvent.objects.record()
+        self.assertEqual(PublishEvent.objects.process(self.ping,
+            debounce=60, max_delay=60), 0)
+        self.assertEqual(PublishEvent.objects.process(self.ping,
+            debounce=0), 2)
+        self.assertEqual(self.server.paths, ['/ping?sitemap=' \
+            'http%3A%2F%2Fexample.com%2Fsitemap.xml'])
+        self.assertEqual(PublishEvent.objects.get_pending().count(), 0)
+
+    def test_retry(self):
+        self.server.status = 500
+        event = PublishEvent.objects.record()
+        self.assertEqual(PublishEvent.objects.process(self.ping, debounce=0,
+            max_attempts=2, retry_delay=60), 0)
+        event = PublishEvent.objects.get(pk=event.pk)
+        self.assertEqual(event.attempts, 1)
+        self.assertTrue(event.last_error)
+        self.assertTrue(event.processed_on is None)
+        self.assertTrue(event.next_attempt_on > datetime.now())
+
+        PublishEvent.objects.filter(pk=event.pk).update(
+            next_attempt_on=datetime.now() - timedelta(seconds=1))
+        PublishEvent.objects.process(self.ping, debounce=0, max_attempts=2)
+        event = PublishEvent.objects.get(pk=event.pk)
+        self.assertEqual(event.attempts, 2)
+        self.assertFalse(event.processed_on is None)
+
+class FrozenDatetime(datetime):
+    """
+    datetime whose now() is set by the tests
+    """
+    frozen = None
+
+    @classmethod
+    def now(cls):
+        return cls.frozen
+
+class ScheduledPostTest(BlogTestCase):
+    def setUp(self):
+        super(ScheduledPostTest, self).setUp()
+        managers.datetime = FrozenDatetime
+
+    def tearDown(self):
+        managers.datetime = datetime
+
+    def test_publish_on_schedule(self):
+        FrozenDatetime.frozen = datetime(2010, 1, 10)
+        self.create_post(1, tags='tag1')
+        self.create_post(20, tags='tag1 tag2')
+        def get_visible():
+            return ([post.slug for post in Post.objects.get_published_posts()],
+                [(usage.tag, usage.count)
+                for usage in TagUsage.objects.get_usage()])
+        self.assertEqual(get_visible(), (['post-1'], [('tag1', 1)]))
+
+        # the boundary holds until the scheduled publish date
+        FrozenDatetime.frozen = datetime(2010, 1, 20)
+        self.assertNumQueries(0, Post.objects.get_visible_as_of)
+        self.assertEqual(get_visible(), (['post-1'], [('tag1', 1)]))
+
+        FrozenDatetime.frozen = datetime(2010, 1, 22)
+        self.assertEqual(get_visible(), (['post-20', 'post-1'],
+            [('tag1', 2), ('tag2', 1)]))
+
+class SearchTest(BlogTestCase):
+    def test_search(self):
+        self.create_post(1, title='Red fox', content='The quick red fox')
+        self.create_post(2, content='A red herring and a fox')
+        self.create_post(3, content='Red red red red red', is_published=False)
+        count, results = search.search('red fox')
+        self.assertEqual(count, 2)
+        self.assertEqual(results[0].post.slug, 'post-1')
+        count, results = search.search('"red fox"')
+        self.assertEqual([result.post.slug for result in results],
+            ['post-1'])
+        count, results = search.search('red', require_published=False,
+            postings_per_term=1)
+        self.assertEqual([result.post.slug for result in results],
+            ['post-3'])
+
+    def test_index(self):
+        post = self.create_post(1, content='alpha')
+        post.content = 'beta'
+        post.save()
+        self.assertFalse(SearchPosting.objects.filter(term='alpha').exists())
+        self.assertEqual(search.search('beta')[0], 1)
+
+def get_related_rows():
+    return sorted([(post, related_post, round(score, 9))
+        for post, related_post, score in
+        RelatedPost.objects.values_list('post', 'related', 'score')])
+
+class RelatedPostTest(BlogTestCase):
+    def test_edits(self):
+        # the in-memory test database isn't shared with a process pool
+        self.assertRebuiltAfterEdits(get_related_rows, related.rebuild,
+            processes=1)
+
+    def test_get_related_posts(self):
+        post = self.create_post(1, tags='apple banana')
+        self.create_post(2, tags='apple banana')
+        self.create_post(3, tags='apple')
+        self.create_post(4, tags='cherry')
+        self.assertEqual([related_post.slug
+            for related_post in post.get_related_posts()],
+            ['post-2', 'post-3'])
+
+def get_neighbor_rows():
+    return sorted(Post.objects.values_list('pk', *neighbors.POINTER_FIELDS))
+
+class NeighborTest(BlogTestCase):
+    def test_edits(self):
+        self.assertRebuiltAfterEdits(get_neighbor_rows, neighbors.rebuild)
+
+    def test_publish_drafts(self):
+        posts = [self.create_post(number, is_published=False)
+            for number in range(1, 6)]
+        self.assertRebuilt(get_neighbor_rows, neighbors.rebuild)
+        for post in posts[:3]:
+            post.is_published = True
+            post.save()
+            self.assertRebuilt(get_neighbor_rows, neighbors.rebuild)
+        # the remaining drafts point to the last published post
+        self.assertEqual(list(Post.objects.filter(pk__in=[posts[3].pk,
+            posts[4].pk]).values_list('previous_post', flat=True)),
+            [posts[2].pk, posts[2].pk])
+
+class AnnotatedTaxonomyTest(BlogTestCase):
+    urls = 'blog.urls'
+
+    def test_get_annotated(self):
+        for number in range(4):
+            post = self.create_post(number, is_published=number != 3,
+                series=self.series)
+            post.categories.add(self.category)
+        Category.objects.create(title='Empty', slug='empty')
+        Post.objects.get_visible_as_of()
+        # the counts and latest publish dates, the latest posts and the
+        # categories
+        with self.assertNumQueries(3):
+            categories = Category.objects.get_annotated()
+        self.assertEqual([(category.slug, category.post_count,
+            category.latest_post_title, category.latest_post_url)
+            for category in categories],
+            [('category', 3, 'Post 2', '/2010/01/03/post-2/'),
+            ('empty', 0, None, None)])
+        self.assertNumQueries(0, Category.objects.get_annotated)
+        self.assertEqual([(series.slug, series.post_count,
+            series.latest_post_title)
+            for series in Series.objects.get_annotated()],
+            [('series', 3, 'Post 2')])
+
+class MemoTest(BlogTestCase):
+    def test_template_tags(self):
+        self.create_post(1)
+        template = Template('{% load blog_tags %}'
+            '{% get_blog_post_archive as archive %}'
+            '{% get_blog_post_archive as archive %}')
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        def render():
+            # the blog context processors share the request's memo
+            return template.render(RequestContext(request,
+                processors=[blog_tags_processor]))
+        TagUsage.objects.get_usage()
+        self.assertNumQueries(1, render)
+        # memoized for the rest of the request
+        self.assertNumQueries(0, render)
+
+class TaxonomyCacheTest(BlogTestCase):
+    def test_invalidate(self):
+        self.assertEqual(taxonomy_cache.get(Category, slug='category').title,
+            'Category')
+        series = taxonomy_cache.get(Series, slug='series')
+        self.category.title = 'Renamed'
+        self.category.save()
+        self.assertEqual(taxonomy_cache.get(Category, slug='category').title,
+            'Renamed')
+        self.assertTrue(taxonomy_cache.get(Series, slug='series') is series)
+
+class InstrumentationTest(TestCase):
+    def tearDown(self):
+        set_sinks([])
+
+    def test_memory_sink(self):
+        sink = MemorySink()
+        set_sinks([sink])
+
+        @instrumented('test.count')
+        def count_posts():
+            return Post.objects.count()
+
+        count_posts()
+        count_posts()
+        self.assertEqual([sample.queries
+            for sample in sink.samples['test.count']], [1, 1])
+        (name, count, measures), = sink.get_percentiles()
+        self.assertEqual((name, count, measures['queries']),
+            ('test.count', 2, [1, 1, 1]))
+
+    def test_manager_methods(self):
+        sink = MemorySink()
+        set_sinks([sink])
+        Post.objects.attach_categories([Post(pk=1)])
+        self.assertEqual([sample.queries for sample in
+            sink.samples['manager.PostManager.attach_categories']], [1])
+
+    def test_statsd_sink(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            server.bind(('127.0.0.1', 0))
+            server.settimeout(5)
+            sink = StatsDSink(port=server.getsockname()[1])
+            sink.record(Sample('view.post_index', 0.0125, 3, 0.002))
+            packet = server.recvfrom(1024)[0].decode('utf-8')
+        finally:
+            server.close()
+        self.assertEqual(packet.split('\n'), [
+            'blog.view.post_index.time:12.500|ms',
+            'blog.view.post_index.queries:3|ms',
+            'blog.view.post_index.sql_time:2.000|ms',])
+
+class BenchmarkTest(TestCase):
+    def test_clear_caches(self):
+        local_cache = taxonomy_cache.cache
+        taxonomy_cache.cache = object()
+        try:
+            self.assertRaises(benchmark.BenchmarkError,
+                benchmark.clear_caches)
+        finally:
+            taxonomy_cache.cache = local_cache
+        if isinstance(local_cache, LocMemCache):
+            local_cache.set('blog.test', 1)
+            benchmark.clear_caches()
+            self.assertEqual(local_cache.get('blog.test'), None)
+
+    def test_compare(self):
+        baseline = {'benchmarks': {'index': {'p50': 0.010, 'queries': 4}},
+            'peak_memory': 1000}
+        self.assertEqual(benchmark.compare({'benchmarks': {'index': {
+            'p50': 0.011, 'queries': 4}}, 'peak_memory': 1100}, baseline), [])
+        self.assertEqual(len(benchmark.compare({'benchmarks': {'index': {
+            'p50': 0.020, 'queries': 5}}, 'peak_memory': 1300}, baseline)), 3)
+
+class DateRangeTest(BlogTestCase):
+    def test_get_date_range(self):
+        self.assertEqual(get_date_range('2010'),
+            (datetime(2010, 1, 1), datetime(2011, 1, 1)))
+        self.assertEqual(get_date_range('2010', '12'),
+            (datetime(2010, 12, 1), datetime(2011, 1, 1)))
+        self.assertEqual(get_date_range('2010', '02', '28'),
+            (datetime(2010, 2, 28), datetime(2010, 3, 1)))
+        for date in (('next',), ('2010', '13'), ('2010', '02', '29')):
+            self.assertRaises(ValueError, get_date_range, *date)
+
+    def test_boundaries(self):
+        self.create_post(1, publish_date=datetime(2010, 1, 31, 23, 59, 59))
+        self.create_post(2, publish_date=datetime(2010, 2, 1))
+        def get_slugs(year, month=None):
+            return [post.slug for post in Post.objects.build_query(
+                year=year, month=month)]
+        self.assertEqual(get_slugs('2010', '01'), ['post-1'])
+        self.assertEqual(get_slugs('2010', '02'), ['post-2'])
+        self.assertEqual(get_slugs('2010'), ['post-2', 'post-1'])
+
+    def test_invalid_date(self):
+        self.create_post(1)
+        for year, month in (('2010', '13'), ('0', None)):
+            self.assertEqual(list(Post.objects.build_query(year=year,
+                month=month)), [])
+
+class TransferTest(BlogTestCase):
+    def export(self):
+        stream = StringIO()
+        transfer.write_jsonl(stream)
+        return stream.getvalue()
+
+    def test_round_trip(self):
+        post = self.create_post(1, series=self.series)
+        post.categories.add(self.category)
+        self.create_post(2, is_published=False)
+        exported = self.export()
+
+        Post.objects.all().delete()
+        # django-tagging leaves the tagged items of deleted objects
+        TaggedItem.objects.all().delete()
+        importer = transfer.Importer(batch_size=1)
+        counts = importer.run(transfer.read_jsonl(StringIO(exported)))
+        importer.finish()
+        self.assertEqual((counts['posts'], counts['skipped']), (2, 0))
+        self.assertEqual(self.export(), exported)
+        post = Post.objects.get(slug='post-1')
+        self.assertEqual(list(post.categories.all()), [self.category])
+        self.assertEqual(post.series, self.series)
+        self.assertEqual(list(PostArchiveEntry.objects.filter(
+            category=self.category).values_list('post', flat=True)),
+            [post.pk])
+
+        counts = transfer.Importer().run(transfer.read_jsonl(
+            StringIO(exported)))
+        self.assertEqual((counts['posts'], counts['skipped']), (0, 2))
+
+    def test_resume(self):
+        records = [
+            {'type': 'post', 'id': 1, 'title': 'Post 1', 'slug': 'post-1',
+                'publish_date': '2010-01-02 00:00:00', 'author': 'author'},
+            {'type': 'image', 'post': 1, 'title': 'Image',
+                'image': 'images/1.jpg'},
+            {'type': 'post', 'id': 2, 'title': 'Post 2', 'slug': 'post-2',
+                'publish_date': '2010-01-03 00:00:00', 'author': 'author'},
+            {'type': 'image', 'post': 2, 'title': 'Image',
+                'image': 'images/2.jpg'},
+        ]
+        # the first run stopped after the first post and its image
+        transfer.Importer(batch_size=1).run([dict(record)
+            for record in records[:2]])
+        fd, checkpoint = mkstemp()
+        try:
+            f = os.fdopen(fd, 'w')
+            f.write('2\n')
+            f.close()
+            counts = transfer.Importer(batch_size=1,
+                checkpoint=checkpoint).run(records)
+        finally:
+            os.remove(checkpoint)
+        self.assertEqual((counts['posts'], counts['images']), (1, 1))
+        self.assertEqual(sorted(PostImage.objects.values_list('post__slug',
+            'image')), [('post-1', 'images/1.jpg'),
+            ('post-2', 'images/2.jpg')])
+
+    def test_wxr(self):
+        post = self.create_post(1)
+        post.categories.add(self.category)
+        stream = BytesIO()
+        transfer.write_wxr(stream)
+        stream.seek(0)
+        records = [record for record in transfer.read_wxr(stream)
+            if record['type'] == 'post']
+        self.assertEqual([(record['slug'], record['categories'])
+            for record in records], [('post-1', ['category'])])
+
+class BulkPublishTest(BlogTestCase):
+    def assertIndexesRebuilt(self):
+        self.assertRebuilt(get_archive_rows, PostArchiveEntry.objects.rebuild)
+        self.assertRebuilt(get_tag_posting_rows, TagPosting.objects.rebuild)
+        self.assertRebuilt(get_tag_usage_rows, TagUsage.objects.rebuild)
+        self.assertRebuilt(get_related_rows, related.rebuild, processes=1)
+        self.assertRebuilt(get_neighbor_rows, neighbors.rebuild)
+
+    def test_update_posts(self):
+        for number in range(6):
+            post = self.create_post(number, is_published=False)
+            post.categories.add(self.category)
+        posts = Post.objects.filter(publish_date__lt=datetime(2010, 1, 5))
+        self.assertEqual(publishing.update_posts(posts, is_published=True), 4)
+        self.assertEqual(publishing.update_posts(posts, is_published=True), 0)
+        self.assertIndexesRebuilt()
+        self.assertEqual(publishing.update_posts(Post.objects.filter(
+            slug='post-2'), is_published=False, is_featured=True), 1)
+        self.assertIndexesRebuilt()
+        self.assertRaises(TypeError, publishing.update_posts, posts,
+            allow_comments=False)
+
+class PostAdminTest(BlogTestCase):
+    def setUp(self):
+        super(PostAdminTest, self).setUp()
+        for number in range(4):
+            post = self.create_post(number, is_published=False,
+                series=self.series)
+            post.categories.add(self.category)
+        self.post_admin = PostAdmin(Post, AdminSite())
+        self.request = RequestFactory().get('/admin/blog/post/')
+        self.request.user = User.objects.create(username='staff',
+            is_staff=True, is_superuser=True)
+
+    def test_actions(self):
+        self.post_admin.publish_posts(self.request,
+            Post.objects.filter(slug__in=['post-1', 'post-2']))
+        self.post_admin.feature_posts(self.request, Post.objects.all())
+        self.post_admin.unpublish_posts(self.request,
+            Post.objects.filter(slug='post-1'))
+        self.assertEqual(self.request.user.get_and_delete_messages(),
+            ['2 posts published.', '4 posts featured.',
+            '1 post unpublished.'])
+        self.assertEqual(list(Post.objects.filter(is_published=True,
+            is_featured=True).values_list('slug', flat=True)), ['post-2'])
+
+    def test_changelist_queries(self):
+        ContentType.objects.get_for_model(Post)
+        # the posts with their series, their categories and their tags
+        with self.assertNumQueries(3):
+            rows = [(post.post_categories_string,
+                self.post_admin.post_tags_string(post), post.series.title)
+                for post in self.post_admin.queryset(self.request)]
+        self.assertEqual(rows[0], ('Category', 'tag0, tag1', 'Series'))
+        self.assertEqual(len(rows), 4)
+
+class RenditionTest(BlogTestCase):
+    def setUp(self):
+        super(RenditionTest, self).setUp()
+        output = BytesIO()
+        Image.new('RGB', (400, 200), (255, 0, 0)).save(output, 'PNG')
+        self.name = default_storage.save('blog-tests/red.png',
+            ContentFile(output.getvalue()))
+        self.content_hash = renditions.get_content_hash(self.name)
+
+    def tearDown(self):
+        renditions.delete_renditions(self.content_hash)
+        default_storage.delete(self.name)
+
+    def test_render(self):
+        rendered = renditions.render((self.name, None, (100, 800),
+            ('png',), 80))
+        self.assertEqual([(format, width, height)
+            for format, width, height, name in rendered],
+            [('png', 100, 50), ('png', 400, 200)])
+        for format, width, height, name in rendered:
+            self.assertTrue(default_storage.exists(name))
+        self.assertTrue(renditions.delete_renditions(self.content_hash))
+        self.assertFalse(default_storage.exists(rendered[0][3]))
+
+    def test_unreadable(self):
+        name = default_storage.save('blog-tests/broken.png',
+            ContentFile(b'not an image'))
+        # the error is logged
+        renditions.logger.disabled = True
+        try:
+            self.assertEqual(renditions.render((name, None, (100,),
+                ('png',), 80)), None)
+        finally:
+            renditions.logger.disabled = False
+            default_storage.delete(name)
+
+    def test_kept_renditions(self):
+        image = PostImage(post=self.create_post(1), title='Red')
+        bulk_insert(PostImage, [image])
+        image = PostImage.objects.get()
+        rendered = renditions.render((self.name, None, (100,), ('png',), 80))
+        renditions.write_renditions(image.pk, rendered)
+        self.assertEqual(ImageRendition.objects.count(), 1)
+        self.assertFalse(renditions.delete_renditions(self.content_hash))
+
+class CollectGarbageTest(BlogTestCase):
+    def create_blob(self, name, saved_on):
+        default_storage.save(name, ContentFile(b'blob'))
+        return ImageBlob.objects.create(name=name, content_hash=name[-10:],
+            size=4, saved_on=saved_on)
+
+    def tearDown(self):
+        for name in ('blog-tests/0000000001.jpg', 'blog-tests/0000000002.jpg',
+            'blog-tests/0000000003.jpg'):
+            default_storage.delete(name)
+
+    def test_collect_garbage(self):
+        old = datetime.now() - timedelta(days=1)
+        unreferenced = self.create_blob('blog-tests/0000000001.jpg', old)
+        referenced = self.create_blob('blog-tests/0000000002.jpg', old)
+        recent = self.create_blob('blog-tests/0000000003.jpg',
+            datetime.now())
+        bulk_insert(PostImage, [PostImage(post=self.create_post(1),
+            title='Image', image=referenced.name)])
+
+        self.assertEqual(storage.collect_garbage(grace=3600, dry_run=True),
+            [unreferenced.name])
+        self.assertTrue(default_storage.exists(unreferenced.name))
+        self.assertEqual(storage.collect_garbage(grace=3600),
+            [unreferenced.name])
+        self.assertFalse(default_storage.exists(unreferenced.name))
+        self.assertEqual(sorted(ImageBlob.objects.values_list('name',
+            'reference_count')), [(referenced.name, 1), (recent.name, 0)])
+
+    def test_delete_unreferenced(self):
+        blob = self.create_blob('blog-tests/0000000001.jpg',
+            datetime.now() - timedelta(days=1))
+        ImageBlob.objects.record(blob.name, blob.content_hash, 4)
+        self.assertFalse(ImageBlob.objects.delete_unreferenced(blob.pk,
+            datetime.now() - timedelta(hours=1)))
+        self.assertTrue(ImageBlob.objects.delete_unreferenced(blob.pk,
+            datetime.now() + timedelta(seconds=1)))
+
+class ApiTest(BlogTestCase):
+    urls = 'blog.urls'
+
+    def setUp(self):
+        super(ApiTest, self).setUp()
+        for number in range(5):
+            post = self.create_post(number, is_published=number != 2)
+            post.categories.add(self.category)
+
+    def get(self, path, status=200, **data):
+        response = self.client.get(path, data)
+        self.assertEqual(response.status_code, status)
+        return simplejson.loads(response.content)
+
+    def test_post_list(self):
+        slugs = []
+        data = {'limit': 2, 'fields': 'slug,categories,tags'}
+        while True:
+            page = self.get('/api/posts/', **data)
+            slugs.extend([result['slug'] for result in page['results']])
+            if not page['next']:
+                break
+            data['cursor'] = page['next']
+        self.assertEqual(slugs, ['post-4', 'post-3', 'post-1', 'post-0'])
+        self.assertEqual(page['results'][-1], {'slug': 'post-0',
+            'categories': ['category'], 'tags': ['tag0', 'tag1']})
+
+    def test_filters(self):
+        page = self.get('/api/posts/', year='2010', month='01',
+            category='category', fields='id')
+        self.assertEqual(len(page['results']), 4)
+        page = self.get('/api/posts/', year='2011', fields='id')
+        self.assertEqual(page, {'results': [], 'next': None})
+        page = self.get('/api/archive/', tag='tag1')
+        self.assertEqual([result['slug'] for result in page['results']],
+            ['post-4', 'post-3', 'post-1', 'post-0'])
+
+    def test_bad_requests(self):
+        for data in ({'fields': 'slug,password'}, {'limit': 'ten'},
+            {'year': '2010', 'month': '13'}, {'year': 'next'},
+            {'cursor': 'garbage'}):
+            self.assertTrue('error' in self.get('/api/posts/', 400, **data))
+        self.assertTrue('error' in self.get('/api/archive/', 400,
+            year='2010', month='0'))
+        self.assertTrue('error' in self.get('/api/tags/', 400,
+            fields='count'))
+
+    def test_post_detail(self):
+        post = self.get('/api/posts/2010/01/02/post-1/')
+        self.assertEqual((post['slug'], post['categories'], post['url']),
+            ('post-1', ['category'], '/2010/01/02/post-1/'))
+        # drafts are only shown to staff
+        request = RequestFactory().get('/api/posts/2010/01/03/post-2/')
+        request.user = AnonymousUser()
+        self.assertRaises(Http404, api.post_detail, request, '2010', '01',
+            '03', 'post-2')
+        request.user = User(is_staff=True)
+        self.assertEqual(simplejson.loads(api.post_detail(request, '2010',
+            '01', '03', 'post-2').content)['is_published'], False)
+
+    def test_taxonomy_lists(self):
+        page = self.get('/api/categories/', fields='slug,post_count')
+        self.assertEqual(page['results'], [{'slug': 'category',
+            'post_count': 4}])
+        page = self.get('/api/tags/', fields='name,post_count')
+        self.assertEqual(page['results'], [
+            {'name': 'tag0', 'post_count': 2},
+            {'name': 'tag1', 'post_count': 4},
+            {'name': 'tag2', 'post_count': 2},])
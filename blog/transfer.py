@@ -0,0 +1,707 @@
+"""
+Bulk import and export
+
+Streams posts, with their categories, series, tags and images, in and out
+as JSON Lines or WordPress eXtended RSS (WXR).  Exports run in constant
+memory.  Imports hold a batch of records at a time, but remember the tag
+and author ids and the post id of every source (WordPress) post id, which
+WXR attachments refer to, so their memory grows by a small dictionary
+entry per imported post.
+
+Imports insert posts in batches, with bulk_create where the Django version
+has it, and skip the per-save side effects: Post.save, the blog's index
+signal handlers and django-tagging's per-object tag writes.  Category, tag
+and image rows are written in bulk per batch.  Posts that already exist
+(the same slug on the same day) are skipped, so an interrupted import can
+simply be run again, and a checkpoint file lets it skip the records it
+already imported (up to the first attachment whose post hasn't been
+imported, so attachments are never skipped).  The denormalized indexes are
+rebuilt once at the end.
+
+JSON Lines records are objects with a "type" of "category", "series" or
+"post"; post records hold their category and series slugs, tag names and
+images.
+"""
+import os
+from datetime import datetime
+from urlparse import urlparse
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.template.defaultfilters import slugify
+from django.utils import simplejson
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from tagging.models import Tag, TaggedItem
+from tagging.utils import edit_string_for_tags, parse_tag_input
+from tagging import settings as tagging_settings
+
+from models import Post, Category, Series, PostImage, LastChange
+from managers import bulk_insert
+from sitemaps import get_sitemap_section
+from cache import taxonomy_cache
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+WXR_NAMESPACES = {
+    'xmlns:excerpt': 'http://wordpress.org/export/1.2/excerpt/',
+    'xmlns:content': 'http://purl.org/rss/1.0/modules/content/',
+    'xmlns:dc': 'http://purl.org/dc/elements/1.1/',
+    'xmlns:wp': 'http://wordpress.org/export/1.2/',
+}
+WXR_META_KEYWORDS = 'blogyall_meta_keywords'
+
+def format_date(value):
+    """
+    Format a datetime for export (to the second)
+    """
+    return value and value.strftime(DATE_FORMAT) or None
+
+def parse_date(value):
+    """
+    Parse an exported datetime, in either 'YYYY-MM-DD HH:MM:SS' or ISO 8601
+    form
+    """
+    if not value:
+        return None
+    return datetime.strptime(value.replace('T', ' ').split('.')[0][:19],
+        DATE_FORMAT)
+
+# export
+
+def iter_taxonomy_records():
+    """
+    Yield the category and series records
+    """
+    for category in Category.objects.order_by('pk').iterator():
+        yield {'type': 'category', 'slug': category.slug,
+            'title': category.title, 'summary': category.summary}
+    for series in Series.objects.order_by('pk').iterator():
+        yield {'type': 'series', 'slug': series.slug, 'title': series.title,
+            'summary': series.summary, 'preface': series.preface,
+            'created_on': format_date(series.created_on)}
+
+def iter_post_records(batch_size=500):
+    """
+    Yield the post records in id order, reading batch_size posts, and their
+    categories, tags and images, at a time
+    """
+    post_type = ContentType.objects.get_for_model(Post)
+    category_slugs = dict(Category.objects.values_list('pk', 'slug'))
+    series_slugs = dict(Series.objects.values_list('pk', 'slug'))
+    usernames = {}
+    last_pk = 0
+    while True:
+        posts = list(Post.objects.filter(pk__gt=last_pk).order_by('pk')[
+            :batch_size])
+        if not posts:
+            return
+        last_pk = posts[-1].pk
+        pks = [post.pk for post in posts]
+
+        categories = {}
+        for post_id, category_id in Post.categories.through.objects.filter(
+            post__in=pks).values_list('post', 'category'):
+            categories.setdefault(post_id, []).append(
+                category_slugs[category_id])
+        tags = {}
+        for object_id, name in TaggedItem.objects.filter(
+            content_type=post_type, object_id__in=pks).values_list(
+            'object_id', 'tag__name').order_by('tag__name'):
+            tags.setdefault(object_id, []).append(name)
+        images = {}
+        for image in PostImage.objects.filter(post__in=pks).values(
+            'post', 'title', 'summary', 'image', 'gallery_position'):
+            images.setdefault(image.pop('post'), []).append(image)
+        usernames.update(User.objects.filter(pk__in=set(
+            [post.author_id for post in posts]) - set(usernames)
+            ).values_list('pk', 'username'))
+
+        for post in posts:
+            yield {'type': 'post', 'id': post.pk, 'title': post.title,
+                'slug': post.slug, 'author': usernames.get(post.author_id),
+                'publish_date': format_date(post.publish_date),
+                'last_modified': format_date(post.last_modified),
+                'is_published': post.is_published,
+                'is_featured': post.is_featured,
+                'allow_comments': post.allow_comments,
+                'categories': categories.get(post.pk, []),
+                'series': series_slugs.get(post.series_id),
+                'tags': tags.get(post.pk, []),
+                'meta_keywords': post.meta_keywords,
+                'summary': post.summary, 'content': post.content,
+                'images': images.get(post.pk, [])}
+
+def write_jsonl(stream, batch_size=500):
+    """
+    Write every category, series and post to a stream as JSON Lines
+
+    Returns the number of records written.
+    """
+    count = 0
+    for records in (iter_taxonomy_records(), iter_post_records(batch_size)):
+        for record in records:
+            stream.write(simplejson.dumps(record) + '\n')
+            count += 1
+    return count
+
+def write_wxr(stream, batch_size=500, title='blog', link='/',
+    description=''):
+    """
+    Write every category, series and post to a stream as WordPress
+    eXtended RSS
+
+    Series are written as terms of a 'series' taxonomy, and images as
+    attachments of their posts.  Returns the number of posts written.
+    """
+    xml = SimplerXMLGenerator(stream, 'utf-8')
+    xml.startDocument()
+    xml.startElement('rss', dict(WXR_NAMESPACES, version='2.0'))
+    xml.startElement('channel', {})
+    xml.addQuickElement('title', title)
+    xml.addQuickElement('link', link)
+    xml.addQuickElement('description', description)
+    xml.addQuickElement('wp:wxr_version', '1.2')
+
+    for record in iter_taxonomy_records():
+        if record['type'] == 'category':
+            xml.startElement('wp:category', {})
+            xml.addQuickElement('wp:category_nicename', record['slug'])
+            xml.addQuickElement('wp:cat_name', record['title'])
+            xml.addQuickElement('wp:category_description', record['summary'])
+            xml.endElement('wp:category')
+        else:
+            xml.startElement('wp:term', {})
+            xml.addQuickElement('wp:term_taxonomy', 'series')
+            xml.addQuickElement('wp:term_slug', record['slug'])
+            xml.addQuickElement('wp:term_name', record['title'])
+            xml.addQuickElement('wp:term_description', record['summary'])
+            xml.endElement('wp:term')
+
+    # attachments need ids that don't collide with the posts'
+    last_post = Post.objects.order_by('-pk').values_list('pk', flat=True)[:1]
+    attachment_id = last_post and last_post[0] or 0
+    category_titles = dict(Category.objects.values_list('slug', 'title'))
+    series_titles = dict(Series.objects.values_list('slug', 'title'))
+    now = datetime.now()
+    count = 0
+    for record in iter_post_records(batch_size):
+        publish_date = parse_date(record['publish_date'])
+        if not record['is_published']:
+            status = 'draft'
+        elif publish_date > now:
+            status = 'future'
+        else:
+            status = 'publish'
+        xml.startElement('item', {})
+        xml.addQuickElement('title', record['title'])
+        xml.addQuickElement('pubDate',
+            publish_date.strftime('%a, %d %b %Y %H:%M:%S +0000'))
+        xml.addQuickElement('dc:creator', record['author'] or '')
+        xml.addQuickElement('guid', 'blogyall-post-%d' % record['id'],
+            {'isPermaLink': 'false'})
+        xml.addQuickElement('description', '')
+        xml.addQuickElement('content:encoded', record['content'])
+        xml.addQuickElement('excerpt:encoded', record['summary'])
+        xml.addQuickElement('wp:post_id', str(record['id']))
+        xml.addQuickElement('wp:post_date', record['publish_date'])
+        xml.addQuickElement('wp:post_modified', record['last_modified'] or '')
+        xml.addQuickElement('wp:comment_status',
+            record['allow_comments'] and 'open' or 'closed')
+        xml.addQuickElement('wp:post_name', record['slug'])
+        xml.addQuickElement('wp:status', status)
+        xml.addQuickElement('wp:post_type', 'post')
+        xml.addQuickElement('wp:is_sticky',
+            record['is_featured'] and '1' or '0')
+        for slug in record['categories']:
+            xml.addQuickElement('category', category_titles.get(slug, slug),
+                {'domain': 'category', 'nicename': slug})
+        for name in record['tags']:
+            xml.addQuickElement('category', name,
+                {'domain': 'post_tag', 'nicename': slugify(name)})
+        if record['series']:
+            xml.addQuickElement('category',
+                series_titles.get(record['series'], record['series']),
+                {'domain': 'series', 'nicename': record['series']})
+        if record['meta_keywords']:
+            xml.startElement('wp:postmeta', {})
+            xml.addQuickElement('wp:meta_key', WXR_META_KEYWORDS)
+            xml.addQuickElement('wp:meta_value', record['meta_keywords'])
+            xml.endElement('wp:postmeta')
+        xml.endElement('item')
+
+        for image in record['images']:
+            attachment_id += 1
+            xml.startElement('item', {})
+            xml.addQuickElement('title', image['title'])
+            xml.addQuickElement('content:encoded', image['summary'])
+            xml.addQuickElement('wp:post_id', str(attachment_id))
+            xml.addQuickElement('wp:post_date', record['publish_date'])
+            xml.addQuickElement('wp:post_parent', str(record['id']))
+            xml.addQuickElement('wp:menu_order',
+                str(image['gallery_position'] or 0))
+            xml.addQuickElement('wp:post_type', 'attachment')
+            xml.addQuickElement('wp:status', 'inherit')
+            xml.addQuickElement('wp:attachment_url',
+                default_storage.url(image['image']))
+            xml.endElement('item')
+        count += 1
+
+    xml.endElement('channel')
+    xml.endElement('rss')
+    xml.endDocument()
+    return count
+
+# import
+
+def read_jsonl(stream):
+    """
+    Yield the records of a JSON Lines stream
+    """
+    for line in stream:
+        if line.strip():
+            yield simplejson.loads(line)
+
+def _split_tag(tag):
+    # ('{namespace}name' or 'name') -> (kind of namespace, name)
+    namespace, name = '', tag
+    if tag.startswith('{'):
+        namespace, name = tag[1:].split('}', 1)
+    if 'wordpress.org/export/' in namespace:
+        kind = namespace.rstrip('/').endswith('excerpt') and 'excerpt' or 'wp'
+    elif namespace == WXR_NAMESPACES['xmlns:content']:
+        kind = 'content'
+    elif namespace == WXR_NAMESPACES['xmlns:dc']:
+        kind = 'dc'
+    else:
+        kind = ''
+    return kind, name
+
+def _get_children(element):
+    # the text of the element's children by (kind of namespace, name)
+    children = {}
+    for child in element:
+        children[_split_tag(child.tag)] = child.text or ''
+    return children
+
+def _get_image_name(url):
+    # storage name of an attachment url under MEDIA_URL, or the url's path
+    path = urlparse(url).path
+    media_path = urlparse(getattr(settings, 'MEDIA_URL', '') or '').path
+    if media_path and path.startswith(media_path):
+        return path[len(media_path):]
+    return path.lstrip('/')
+
+def read_wxr(stream):
+    """
+    Yield the records of a WordPress eXtended RSS stream
+
+    Posts and attachments of posts are read; pages and other post types are
+    skipped.  Attachment image records refer to their post's WordPress id.
+    """
+    channel = None
+    for event, element in iterparse(stream, events=('start', 'end')):
+        kind, name = _split_tag(element.tag)
+        if event == 'start':
+            if (kind, name) == ('', 'channel'):
+                channel = element
+            continue
+        if element is channel or (kind, name) not in (('wp', 'category'),
+            ('wp', 'term'), ('', 'item')):
+            continue
+        children = _get_children(element)
+        record = None
+        if name == 'category':
+            record = {'type': 'category',
+                'slug': children.get(('wp', 'category_nicename')),
+                'title': children.get(('wp', 'cat_name')),
+                'summary': children.get(('wp', 'category_description'), '')}
+        elif name == 'term':
+            if children.get(('wp', 'term_taxonomy')) == 'series':
+                record = {'type': 'series',
+                    'slug': children.get(('wp', 'term_slug')),
+                    'title': children.get(('wp', 'term_name')),
+                    'summary': children.get(('wp', 'term_description'), '')}
+        elif children.get(('wp', 'post_type')) == 'attachment':
+            if children.get(('wp', 'post_parent'), '0') != '0':
+                position = int(children.get(('wp', 'menu_order')) or 0)
+                record = {'type': 'image',
+                    'post': int(children[('wp', 'post_parent')]),
+                    'title': children.get(('', 'title'), ''),
+                    'summary': children.get(('content', 'encoded'), ''),
+                    'image': _get_image_name(
+                        children.get(('wp', 'attachment_url'), '')),
+                    'gallery_position': position or None}
+        elif children.get(('wp', 'post_type')) == 'post':
+            status = children.get(('wp', 'status'))
+            title = children.get(('', 'title'), '')
+            record = {'type': 'post',
+                'id': int(children.get(('wp', 'post_id')) or 0) or None,
+                'title': title,
+                'slug': children.get(('wp', 'post_name')) or slugify(title),
+                'author': children.get(('dc', 'creator')),
+                'publish_date': children.get(('wp', 'post_date')),
+                'last_modified': children.get(('wp', 'post_modified')),
+                'is_published': status in ('publish', 'future'),
+                'is_featured': children.get(('wp', 'is_sticky')) == '1',
+                'allow_comments': children.get(
+                    ('wp', 'comment_status')) != 'closed',
+                'categories': [], 'series': None, 'tags': [],
+                'category_titles': {}, 'meta_keywords': '',
+                'summary': children.get(('excerpt', 'encoded'), ''),
+                'content': children.get(('content', 'encoded'), ''),
+                'images': []}
+            for child in element:
+                child_kind, child_name = _split_tag(child.tag)
+                if (child_kind, child_name) == ('', 'category'):
+                    domain = child.get('domain')
+                    slug = child.get('nicename') or slugify(child.text or '')
+                    if domain == 'category':
+                        record['categories'].append(slug)
+                        record['category_titles'][slug] = child.text or slug
+                    elif domain == 'post_tag':
+                        record['tags'].append(child.text or slug)
+                    elif domain == 'series':
+                        record['series'] = slug
+                elif (child_kind, child_name) == ('wp', 'postmeta'):
+                    meta = _get_children(child)
+                    if meta.get(('wp', 'meta_key')) == WXR_META_KEYWORDS:
+                        record['meta_keywords'] = meta.get(
+                            ('wp', 'meta_value'), '')
+        # drop the element so the tree doesn't grow with the stream
+        if channel is not None:
+            channel.remove(element)
+        element.clear()
+        if record is not None:
+            yield record
+
+class Importer(object):
+    """
+    Batched post importer
+
+    Run it with an iterable of records (from read_jsonl or read_wxr).
+    """
+    def __init__(self, batch_size=500, checkpoint=None, default_author=None,
+        stdout=None):
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.default_author = default_author
+        self.stdout = stdout
+        self.post_type = ContentType.objects.get_for_model(Post)
+        self.category_ids = dict(Category.objects.values_list('slug', 'pk'))
+        self.series_ids = dict(Series.objects.values_list('slug', 'pk'))
+        self.tag_ids = {}
+        self.author_ids = {}
+        # WordPress post id: post id, for attachments
+        self.source_ids = {}
+        self.pending_images = []
+        self.sitemap_sections = set()
+        self.counts = {'posts': 0, 'skipped': 0, 'images': 0}
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write('%s\n' % message)
+
+    def read_checkpoint(self):
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            f = open(self.checkpoint)
+            try:
+                return int(f.read().strip() or 0)
+            finally:
+                f.close()
+        return 0
+
+    def write_checkpoint(self, position):
+        if not self.checkpoint:
+            return
+        temp_path = '%s.tmp' % self.checkpoint
+        f = open(temp_path, 'w')
+        try:
+            f.write('%d\n' % position)
+        finally:
+            f.close()
+        os.rename(temp_path, self.checkpoint)
+
+    def get_category_id(self, slug, title=None):
+        if slug not in self.category_ids:
+            category, created = Category.objects.get_or_create(slug=slug,
+                defaults={'title': title or slug})
+            self.category_ids[slug] = category.pk
+        return self.category_ids[slug]
+
+    def get_series_id(self, slug, title=None):
+        if slug not in self.series_ids:
+            series, created = Series.objects.get_or_create(slug=slug,
+                defaults={'title': title or slug})
+            self.series_ids[slug] = series.pk
+        return self.series_ids[slug]
+
+    def get_author_id(self, username):
+        username = username or self.default_author
+        if not username:
+            raise ValueError('A post has no author and no default author ' \
+                'was given.')
+        if username not in self.author_ids:
+            try:
+                user = User.objects.get(username=username)
+            except User.DoesNotExist:
+                user = User(username=username)
+                user.set_unusable_password()
+                user.save()
+            self.author_ids[username] = user.pk
+        return self.author_ids[username]
+
+    def get_tag_ids(self, names):
+        missing = [name for name in names if name not in self.tag_ids]
+        if missing:
+            self.tag_ids.update(Tag.objects.filter(name__in=missing
+                ).values_list('name', 'pk'))
+            bulk_insert(Tag, [Tag(name=name) for name in missing
+                if name not in self.tag_ids])
+            self.tag_ids.update(Tag.objects.filter(name__in=missing
+                ).values_list('name', 'pk'))
+        return [self.tag_ids[name] for name in names]
+
+    def get_tag_names(self, tags):
+        if isinstance(tags, basestring):
+            tags = parse_tag_input(tags)
+        names = []
+        for name in tags:
+            name = name.strip()[:tagging_settings.MAX_TAG_LENGTH]
+            if tagging_settings.FORCE_LOWERCASE_TAGS:
+                name = name.lower()
+            if name and name not in names:
+                names.append(name)
+        return names
+
+    def insert_posts(self, posts):
+        if hasattr(Post.objects, 'bulk_create'):
+            # bulk_create sends no signals
+            Post.objects.bulk_create(posts)
+            return
+        # raw saves skip Post.save and the blog's index handlers; the tags
+        # are written in bulk instead of by django-tagging's handler
+        tag_field = Post._meta.get_field('tags')
+        post_save.disconnect(tag_field._save, sender=Post)
+        try:
+            for post in posts:
+                post.save_base(raw=True)
+        finally:
+            post_save.connect(tag_field._save, sender=Post, weak=True)
+
+    def add_images(self, post_id, images):
+        bulk_insert(PostImage, [PostImage(post_id=post_id,
+            title=image.get('title') or '',
+            summary=image.get('summary') or '', image=image['image'],
+            gallery_position=image.get('gallery_position'))
+            for image in images])
+        self.counts['images'] += len(images)
+
+    def get_existing(self, records):
+        """
+        Return a dictionary of (slug, publish day): post id of the existing
+        posts of a batch of post records
+        """
+        return dict([((slug, publish_date.date()), pk)
+            for pk, slug, publish_date in Post.objects.filter(
+            slug__in=set([record['slug'] for record in records])
+            ).values_list('pk', 'slug', 'publish_date')])
+
+    def map_source_ids(self, records):
+        """
+        Map the WordPress ids of a batch of post records imported before the
+        checkpoint to their posts, for the attachments after it
+        """
+        existing = self.get_existing(records)
+        for record in records:
+            publish_date = parse_date(record.get('publish_date'))
+            if publish_date is None:
+                continue
+            key = (record['slug'], publish_date.date())
+            if key in existing:
+                self.source_ids[record['id']] = existing[key]
+
+    def flush(self, records):
+        """
+        Import a batch of post records
+        """
+        if not records:
+            return
+        for record in records:
+            record['publish_date'] = parse_date(record.get('publish_date')) \
+                or datetime.now()
+        existing = self.get_existing(records)
+
+        new_records = []
+        keys = set()
+        for record in records:
+            key = (record['slug'], record['publish_date'].date())
+            if key in existing or key in keys:
+                self.counts['skipped'] += 1
+                if key in existing and record.get('id'):
+                    self.source_ids[record['id']] = existing[key]
+                continue
+            keys.add(key)
+            new_records.append(record)
+
+        posts = []
+        for record in new_records:
+            record['tags'] = self.get_tag_names(record.get('tags') or [])
+            post = Post(title=record['title'], slug=record['slug'],
+                author_id=self.get_author_id(record.get('author')),
+                publish_date=record['publish_date'],
+                last_modified=parse_date(record.get('last_modified'))
+                    or record['publish_date'],
+                is_published=record.get('is_published', True),
+                is_featured=record.get('is_featured', False),
+                allow_comments=record.get('allow_comments', True),
+                meta_keywords=record.get('meta_keywords') or '',
+                summary=record.get('summary') or '',
+                content=record.get('content') or '')
+            if record.get('series'):
+                post.series_id = self.get_series_id(record['series'])
+            post.tags = edit_string_for_tags(
+                [Tag(name=name) for name in record['tags']])
+            posts.append(post)
+        self.insert_posts(posts)
+
+        post_ids = dict([((slug, publish_date.date()), pk)
+            for pk, slug, publish_date in Post.objects.filter(
+            slug__in=keys and set([slug for slug, date in keys]) or ['']
+            ).values_list('pk', 'slug', 'publish_date')])
+        memberships = []
+        tagged_items = []
+        for record in new_records:
+            post_id = post_ids[(record['slug'], record['publish_date'].date())]
+            if record.get('id'):
+                self.source_ids[record['id']] = post_id
+            self.sitemap_sections.add(get_sitemap_section(post_id))
+            titles = record.get('category_titles', {})
+            for slug in record.get('categories') or []:
+                memberships.append(Post.categories.through(post_id=post_id,
+                    category_id=self.get_category_id(slug, titles.get(slug))))
+            for tag_id in self.get_tag_ids(record['tags']):
+                tagged_items.append(TaggedItem(tag_id=tag_id,
+                    content_type=self.post_type, object_id=post_id))
+            if record.get('images'):
+                self.add_images(post_id, record['images'])
+        bulk_insert(Post.categories.through, memberships)
+        bulk_insert(TaggedItem, tagged_items)
+        self.counts['posts'] += len(new_records)
+
+    def flush_images(self):
+        """
+        Import the attachment images whose posts have been imported, unless
+        an interrupted run already imported them
+        """
+        pending = []
+        images = {}
+        for position, record in self.pending_images:
+            post_id = self.source_ids.get(record['post'])
+            if post_id is None:
+                pending.append((position, record))
+            else:
+                images.setdefault(post_id, []).append(record)
+        self.pending_images = pending
+        if not images:
+            return
+        existing = set(PostImage.objects.filter(post__in=images.keys()
+            ).values_list('post', 'image'))
+        for post_id, records in images.items():
+            new_records = []
+            for record in records:
+                if (post_id, record['image']) not in existing:
+                    existing.add((post_id, record['image']))
+                    new_records.append(record)
+            if new_records:
+                self.add_images(post_id, new_records)
+
+    def run(self, records):
+        """
+        Import the records
+
+        Returns a dictionary of the number of imported posts, skipped
+        existing posts and imported images.
+        """
+        skip = self.read_checkpoint()
+        if skip:
+            self.log('Resuming after record %d.' % skip)
+        batch = []
+        resumed = []
+        position = 0
+        for record in records:
+            position += 1
+            if position <= skip:
+                if record.get('type') == 'post' and record.get('id'):
+                    resumed.append(record)
+                    if len(resumed) >= self.batch_size:
+                        self.map_source_ids(resumed)
+                        resumed = []
+                continue
+            if resumed:
+                self.map_source_ids(resumed)
+                resumed = []
+            kind = record.get('type')
+            if kind == 'category':
+                self.get_category_id(record['slug'], record.get('title'))
+            elif kind == 'series':
+                self.get_series_id(record['slug'], record.get('title'))
+            elif kind == 'post':
+                batch.append(record)
+            elif kind == 'image':
+                self.pending_images.append((position, record))
+            if len(batch) >= self.batch_size:
+                self.commit(batch, position)
+                batch = []
+        if resumed:
+            self.map_source_ids(resumed)
+        self.commit(batch, position)
+        if self.pending_images:
+            self.log('Skipped %d images of unknown posts.' % (
+                len(self.pending_images),))
+        return self.counts
+
+    def finish(self):
+        """
+        Rebuild the blog indexes and forget the cached pages and taxonomies
+        """
+        self.log('Rebuilding the blog indexes.')
+        call_command('blog_rebuild_indexes', verbosity=0)
+        call_command('blog_rebuild_related_posts', verbosity=0)
+        LastChange.objects.touch('posts', 'categories', 'series',
+            *['sitemap.posts.%d' % section
+            for section in sorted(self.sitemap_sections)])
+        Category.objects.reset_annotated()
+        Series.objects.reset_annotated()
+        for model in (Category, Series, Tag):
+            taxonomy_cache.invalidate(model)
+
+    def commit(self, batch, position):
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            try:
+                self.flush(batch)
+                self.flush_images()
+                transaction.commit()
+            except:
+                transaction.rollback()
+                raise
+        finally:
+            transaction.leave_transaction_management()
+        # resume before the first image whose post hasn't been imported yet
+        self.write_checkpoint(min([position] + [image_position - 1
+            for image_position, record in self.pending_images]))
+        if batch:
+            self.log('Imported %d posts (%d skipped).' % (
+                self.counts['posts'], self.counts['skipped']))
@@ -17,9 +17,19 @@ urlpatterns = patterns('blog.views',
     (r'^series/(?P<series_slug>[-\w]+)/(?P<year>\d{4})/$', 'post_index'),
     (r'^series/(?P<series_slug>[-\w]+)/(?P<year>\d{4})/(?P<month>0[1-9]|1[0-2])/$', 'post_index'),
     (r'^series/(?P<slug>[-\w]+)/$', 'series_detail'),
+    (r'^search/$', 'search'),
     (r'^tags/$', 'tag_index'),
     (r'^tags/(?P<tag>[-\w]+)/(?P<year>\d{4})/$', 'post_index'),
     (r'^tags/(?P<tag>[-\w]+)/(?P<year>\d{4})/(?P<month>0[1-9]|1[0-2])/$', 'post_index'),
     (r'^tags/(?P<tag>.+)/$', 'tag_detail'),
     (r'^(?P<year>\d{4})/(?P<month>0[1-9]|1[0-2])/(?P<day>\d{2})/(?P<slug>[-\w]+)/$', 'post_detail'),
 )
+
+urlpatterns += patterns('blog.api',
+    (r'^api/posts/$', 'post_list'),
+    (r'^api/posts/(?P<year>\d{4})/(?P<month>0[1-9]|1[0-2])/(?P<day>\d{2})/(?P<slug>[-\w]+)/$', 'post_detail'),
+    (r'^api/archive/$', 'post_archive'),
+    (r'^api/categories/$', 'category_list'),
+    (r'^api/series/$', 'series_list'),
+    (r'^api/tags/$', 'tag_list'),
+)
@@ -5,29 +5,42 @@ from django.shortcuts import render_to_response, get_object_or_404
 from tagging.models import Tag, TaggedItem
 
 from models import Post, Category, Series
+from settings import BLOG_POSTS_PER_PAGE, BLOG_SEARCH_RESULTS_PER_PAGE
+from conditional import blog_condition, get_post_stamps
+from instrumentation import instrumented
 
 from context_processors import blog_posts_processor, blog_post_processor, \
     blog_categories_processor, blog_category_processor, \
     blog_seriess_processor, blog_series_processor, \
-    blog_tags_processor, blog_tag_processor
+    blog_tags_processor, blog_tag_processor, blog_search_processor
      
 
+@instrumented('view.post_index')
+@blog_condition('posts', 'categories', 'series', 'comments')
 def post_index(request, year=None, month=None, category_slug=None,
     series_slug=None, tag=None, start_post=1, max_posts=None,
-    template_name="blog/post/index.html"):
+    per_page=BLOG_POSTS_PER_PAGE, template_name="blog/post/index.html"):
     """
     Post Index
+
+    When per_page is set (and max_posts isn't), posts are paged with the
+    opaque cursor passed in the "cursor" query string parameter
     """
+    if max_posts != None:
+        per_page = None
     return render_to_response(
         template_name,
         context_instance=RequestContext(
             request,
             processors=[blog_posts_processor(year=year, month=month,
                 category_slug=category_slug, series_slug=series_slug,
-                tag=tag, start_post=start_post, max_posts=max_posts),]
+                tag=tag, start_post=start_post, max_posts=max_posts,
+                cursor=request.GET.get('cursor'), per_page=per_page),]
         )
     )
 
+@instrumented('view.post_archive')
+@blog_condition('posts', 'categories', 'series', 'comments')
 def post_archive(request, year=None, month=None,
     template_name="blog/post/archive.html"):
     """
@@ -41,6 +54,9 @@ def post_archive(request, year=None, month=None,
         )
     )
 
+@instrumented('view.post_detail')
+@blog_condition('posts', 'categories', 'series',
+    object_stamps=get_post_stamps)
 def post_detail(request, year, month, day, slug,
     template_name="blog/post/detail.html"):
     """
@@ -55,6 +71,8 @@ def post_detail(request, year, month, day, slug,
         )
     )
 
+@instrumented('view.category_index')
+@blog_condition('posts', 'categories')
 def category_index(request, template_name="blog/category/index.html"):
     """
     Category Index
@@ -67,6 +85,8 @@ def category_index(request, template_name="blog/category/index.html"):
         )
     )
 
+@instrumented('view.category_detail')
+@blog_condition('posts', 'categories', 'comments')
 def category_detail(request, slug, template_name="blog/category/detail.html"):
     """
     Category Detail
@@ -79,6 +99,8 @@ def category_detail(request, slug, template_name="blog/category/detail.html"):
         )
     )
 
+@instrumented('view.series_index')
+@blog_condition('posts', 'series')
 def series_index(request, template_name="blog/series/index.html"):
     """
     Series Index
@@ -91,6 +113,8 @@ def series_index(request, template_name="blog/series/index.html"):
         )
     )
 
+@instrumented('view.series_detail')
+@blog_condition('posts', 'series', 'comments')
 def series_detail(request, slug, template_name="blog/series/detail.html"):
     """
     Series Detail
@@ -103,6 +127,8 @@ def series_detail(request, slug, template_name="blog/series/detail.html"):
         )
     )
 
+@instrumented('view.tag_index')
+@blog_condition('posts')
 def tag_index(request, template_name="blog/tag/index.html"):
     """
     Tag Index
@@ -115,6 +141,8 @@ def tag_index(request, template_name="blog/tag/index.html"):
         )
     )
 
+@instrumented('view.tag_detail')
+@blog_condition('posts', 'categories', 'series', 'comments')
 def tag_detail(request, tag, template_name="blog/tag/detail.html"):
     """
     Tag Detail
@@ -123,7 +151,34 @@ def tag_detail(request, tag, template_name="blog/tag/detail.html"):
         template_name,
         context_instance=RequestContext(
             request,
-            processors=[blog_tag_processor(tag=tag),]
+            # the tag processor owns "tag", the Tag object
+            processors=[blog_posts_processor(tag=tag,
+                tag_context_name='tag_name'),
+                blog_tag_processor(tag=tag),]
         )
     )
 
+
+@instrumented('view.search')
+@blog_condition('posts')
+def search(request, per_page=BLOG_SEARCH_RESULTS_PER_PAGE,
+    template_name="blog/search/results.html"):
+    """
+    Search
+
+    The query is read from the "q" query string parameter and the results
+    page from "page"
+    """
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        raise Http404
+    return render_to_response(
+        template_name,
+        context_instance=RequestContext(
+            request,
+            processors=[blog_search_processor(
+                query=request.GET.get('q', ''), page=page,
+                per_page=per_page),]
+        )
+    )
@@ -5,7 +5,8 @@ setup(
     version='1.2.2',
     author='David Davis',
     author_email='davisd@davisd.com',
-    packages=['blog','blog.templatetags'],
+    packages=['blog','blog.templatetags','blog.management',
+        'blog.management.commands'],
     url='http://www.davisd.com/projects/django-blogyall',
     data_files=[('.',['LICENSE'])],
     license='LICENSE',